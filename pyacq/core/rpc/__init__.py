@@ -2,7 +2,8 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
-from .client import RPCClient, RemoteCallException, Future
+from .client import RPCClient, RemoteCallException, Future, Batch, BatchFuture
+from .asyncclient import AsyncRPCClient, AsyncFuture
 from .server import RPCServer, QtRPCServer
 from .proxy import ObjectProxy
 from .processspawner import ProcessSpawner
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import asyncio
+import zmq
+import zmq.asyncio
+
+from .client import RPCClient, Future
+
+
+class AsyncRPCClient(RPCClient):
+    """Connection to an :class:`RPCServer` for use with asyncio.
+
+    Requests sent with ``sync='async'`` (the default for this client and for
+    the proxies it returns) return an :class:`AsyncFuture` that can be awaited;
+    responses are read by a task of the event loop instead of a blocking
+    ``process_until_future()`` loop. This allows a single thread to drive many
+    servers concurrently::
+
+        async def start_all(addresses):
+            clients = [AsyncRPCClient(addr) for addr in addresses]
+            nodegroups = [cli['nodegroup'] for cli in clients]
+            nodes = await asyncio.gather(*[ng.create_node('MyNode') for ng in nodegroups])
+            await asyncio.gather(*[node.configure() for node in nodes])
+
+    Requests made with ``sync='sync'`` (such as ``client['name']``) still
+    block until their result arrives, including the event loop.
+
+    Like RPCClient, each AsyncRPCClient may only be used from the thread that
+    created it, and proxies created by this client use it for their requests.
+
+    Parameters
+    ----------
+    address : URL
+        Address of RPC server to connect to.
+    serializer : str
+        Name of the serializer (see :class:`RPCClient`).
+    """
+    def __init__(self, address, serializer='msgpack'):
+        self._async_socket = None
+        self._reader = None
+        RPCClient.__init__(self, address, reentrant=False, serializer=serializer)
+        self.default_proxy_options['sync'] = 'async'
+
+    def _make_future(self, req_id):
+        return AsyncFuture(self, req_id)
+
+    def send(self, action, opts=None, return_type='auto', sync='async', timeout=10.0):
+        """Send a request to the remote process.
+
+        This is the same as :func:`RPCClient.send()`, except that *sync*
+        defaults to 'async'. The *timeout* only applies to synchronous
+        requests; use ``asyncio.wait_for()`` to limit the time spent waiting
+        for an AsyncFuture.
+        """
+        return RPCClient.send(self, action, opts=opts, return_type=return_type, sync=sync, timeout=timeout)
+
+    def _start_reader(self):
+        # Start the task that reads responses, if it is not already running
+        if self._reader is None or self._reader.done():
+            if self._async_socket is None:
+                # asyncio view of the same zmq socket
+                self._async_socket = zmq.asyncio.Socket.from_socket(self._socket)
+            self._reader = asyncio.ensure_future(self._read_responses())
+
+    async def _read_responses(self):
+        # Read responses until no request is waiting for one
+        while len(self.futures) > 0 and not self._disconnected:
+            try:
+                await self._async_socket.poll(timeout=100)
+            except zmq.error.Again:
+                # Responses may also have been left in the socket by
+                # synchronous requests, which read it directly; check after a
+                # timeout too.
+                pass
+            self._read_and_process_all()
+
+    def close(self):
+        """Close this client's socket (but leave the server running).
+        """
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        RPCClient.close(self)
+
+
+class AsyncFuture(Future):
+    """Future returned by :class:`AsyncRPCClient` requests.
+
+    It can be awaited from a coroutine running in the client's thread, or
+    used as a :class:`Future`.
+    """
+    def __await__(self):
+        self.client._start_reader()
+        return asyncio.wrap_future(self).__await__()
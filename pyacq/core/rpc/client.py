@@ -15,7 +15,7 @@ import numpy as np
 from pyqtgraph.Qt import QtGui
 
 from .serializer import all_serializers
-from .proxy import ObjectProxy
+from .proxy import ObjectProxy, BatchReference
 from .server import RPCServer, QtRPCServer
 from . import log
 
@@ -42,6 +42,11 @@ class RPCClient(object):
         for a response. This is necessary to avoid deadlocks in case of 
         reentrant RPC requests (eg, server A calls server B, which then calls
         server A again). Default is True.
+    serializer : str
+        Name of the serializer used for requests and results: 'msgpack'
+        (default), 'json' or 'pickle' (see :class:`PickleSerializer`; for
+        trusted processes only). Each client may use a different serializer
+        with the same server.
     """
     
     clients_by_thread = {}  # (thread_id, rpc_addr): client
@@ -115,6 +120,9 @@ class RPCClient(object):
         self.connect_established = False
         self.establishing_connect = False
         self._disconnected = False
+        
+        # Batch collecting the requests of this client (see batch())
+        self._batch = None
 
         # For unserializing results returned from servers. This cannot be
         # used to send proxies of local objects unless there is also a server
@@ -144,6 +152,9 @@ class RPCClient(object):
                 self._poller = zmq.Poller()
                 self._poller.register(self._socket, zmq.POLLIN)
                 self._poller.register(server._socket, zmq.POLLIN)
+                if server._result_socket is not None:
+                    # results of the server's worker threads
+                    self._poller.register(server._result_socket, zmq.POLLIN)
         return self._poller
 
     def disconnected(self):
@@ -209,9 +220,14 @@ class RPCClient(object):
                                                          | ref_id: proxy reference ID
         import   Import and return a proxy to a module   | module: name of module to import
         ping     Return 'pong'                           | 
+        batch    Invoke a list of requests in order      | requests: list of [action, opts, return_type]
+                 (see :func:`batch`)                     |
         ======== ======================================= ==========================================
         
         """
+        if self._batch is not None:
+            return self._batch.send(action, opts=opts, return_type=return_type, sync=sync)
+        
         # This is nice, but very expensive!
         #if self.disconnected():
         if self._disconnected:
@@ -227,18 +243,19 @@ class RPCClient(object):
         logger.debug("    => sync=%s return=%s opts=%s", sync, return_type, opts)
         
         if opts is None:
-            opts_str = b''
+            opts_frames = [b'']
         else:
-            opts_str = self.serializer.dumps(opts)
+            # large arrays follow the options as separate frames
+            opts_frames = self.serializer.dumps_frames(opts)
         ser_type = self.serializer.type.encode()
         
-        msg = [str(req_id).encode(), action.encode(), return_type.encode(), ser_type, opts_str]
-        self._socket.send_multipart(msg)
+        msg = [str(req_id).encode(), action.encode(), return_type.encode(), ser_type] + opts_frames
+        self._socket.send_multipart(msg, copy=False)
         
         if sync == 'off':
             return
         
-        fut = Future(self, req_id)
+        fut = self._make_future(req_id)
         if action == 'close':
             # for server closure we require a little special handling
             fut.add_done_callback(self._close_request_returned)
@@ -251,6 +268,34 @@ class RPCClient(object):
         else:
             raise ValueError('Invalid sync value: %s' % sync)
 
+    def batch(self, timeout=10.0):
+        """Return a :class:`Batch` that sends the requests made through this
+        client in a single message.
+        
+        This avoids one network round-trip per request, for example when
+        configuring many nodes of a remote pipeline::
+        
+            with client.batch():
+                node = nodegroup.create_node('MyNode')
+                node.configure(param=1)
+                node.output.configure(protocol='tcp')
+                node.initialize()
+            node = node.result()
+        
+        See :class:`Batch`.
+        
+        Parameters
+        ----------
+        timeout : float
+            Maximum time (seconds) to wait for the results when leaving the
+            ``with`` block.
+        """
+        return Batch(self, timeout=timeout)
+
+    def _make_future(self, req_id):
+        # Future for the result of request req_id
+        return Future(self, req_id)
+
     def call_obj(self, obj, args=None, kwargs=None, **kwds):
         """Invoke a remote callable object.
         
@@ -452,8 +497,8 @@ class RPCClient(object):
             # NOTE: docs say timeout can only be set before bind, but this
             # seems to work for now.
             self._socket.setsockopt(zmq.RCVTIMEO, timeout)
-            msg = self._socket.recv()
-            msg = self.serializer.loads(msg)
+            msg = self._socket.recv_multipart(copy=False)
+            msg = self.serializer.loads_frames(msg)
         except zmq.error.Again:
             raise TimeoutError("Timeout waiting for Future result.")
         
@@ -606,3 +651,136 @@ class Future(concurrent.futures.Future):
         """
         self.client.process_until_future(self, timeout=timeout)
         return concurrent.futures.Future.result(self)
+
+
+class Batch(object):
+    """Requests queued to be sent to an :class:`RPCServer` in a single message.
+    
+    Batches are created by :func:`RPCClient.batch()`. Inside the ``with`` block,
+    requests made through the client (including calls to its proxies) are not
+    sent; each returns a :class:`BatchFuture` instead (or None for requests
+    made with ``sync='off'``). BatchFutures stand for results that do not
+    exist yet: their attributes can be called, and they can be passed as
+    arguments to later requests of the batch.
+    
+    When the block exits, all requests are sent in one message and invoked by
+    the server in order. The block then waits for the results and raises
+    :class:`RemoteCallException` if a request failed; requests after a failed
+    request are not invoked.
+    
+    Use :func:`submit()` instead of a ``with`` block to send the requests
+    without waiting for their results. With :class:`AsyncRPCClient`, use
+    ``async with client.batch():`` to wait without blocking the event loop.
+    """
+    def __init__(self, client, timeout=10.0):
+        self.client = client
+        self.timeout = timeout
+        self.requests = []  # [action, opts, return_type]
+        self.futures = []
+        self._future = None
+
+    def send(self, action, opts=None, return_type='auto', sync='sync', timeout=None):
+        """Queue a request; see :func:`RPCClient.send()`.
+        """
+        if self._future is not None:
+            raise RuntimeError("Cannot add requests to a batch that was already sent.")
+        fut = BatchFuture(self, len(self.requests))
+        self.requests.append([action, opts, return_type])
+        self.futures.append(fut)
+        return None if sync == 'off' else fut
+
+    def submit(self):
+        """Send the queued requests and return a :class:`Future` for the list of
+        ``[rval, error]`` of each request.
+        """
+        if self._future is None:
+            if self.client._batch is self:
+                self.client._batch = None
+            self._future = self.client.send('batch', opts={'requests': self.requests}, sync='async')
+            self._future.add_done_callback(self._batch_returned)
+        return self._future
+
+    def result(self, timeout=None):
+        """Send the queued requests if needed, and return the list of their
+        results.
+        
+        Raise RemoteCallException for the first request that failed.
+        """
+        self.submit().result(timeout=timeout)
+        return [fut.result() for fut in self.futures]
+
+    def _batch_returned(self, fut):
+        exc = fut.exception()
+        if exc is not None:
+            for f in self.futures:
+                f.set_exception(exc)
+            return
+        returns = concurrent.futures.Future.result(fut)
+        for f, (rval, error) in zip(self.futures, returns):
+            if error is None:
+                f.set_result(rval)
+            else:
+                f.set_exception(RemoteCallException(*error))
+        for f in self.futures[len(returns):]:
+            f.set_exception(RuntimeError("Request %d of batch was not invoked because an "
+                                         "earlier request failed." % f._index))
+
+    def __enter__(self):
+        if self.client._batch is not None:
+            raise RuntimeError("A batch is already active for this client.")
+        self.client._batch = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.client._batch is self:
+            self.client._batch = None
+        if exc_type is None:
+            self.result(timeout=self.timeout)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # for AsyncRPCClient: wait for the results on the event loop
+        if self.client._batch is self:
+            self.client._batch = None
+        if exc_type is None:
+            await self.submit()
+            self.result()
+
+
+class _BatchAttribute(BatchReference):
+    # Attribute of the future result of a batch request
+    def __init__(self, batch, index, attributes=()):
+        BatchReference.__init__(self, index, attributes)
+        self.__dict__['_batch'] = batch
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return _BatchAttribute(self._batch, self._index, self._attributes + (attr,))
+
+    def __call__(self, *args, **kwargs):
+        opts = {}
+        for k in ('sync', 'return_type', 'timeout'):
+            if '_' + k in kwargs:
+                opts[k] = kwargs.pop('_' + k)
+        return self._batch.send('call_obj', opts={'obj': self, 'args': args, 'kwargs': kwargs}, **opts)
+
+
+class BatchFuture(Future, _BatchAttribute):
+    """Future result of a request queued in a :class:`Batch`.
+    
+    Until the batch is sent, accessing attributes (other than the Future
+    methods) and calling them queues requests on the result, and BatchFutures
+    may be passed as arguments to other requests of the batch; the server
+    replaces them with the result. Calling :func:`result()` sends the batch if
+    it was not sent yet.
+    """
+    def __init__(self, batch, index):
+        Future.__init__(self, batch.client, None)
+        _BatchAttribute.__init__(self, batch, index)
+
+    def result(self, timeout=None):
+        self._batch.submit()
+        return Future.result(self, timeout=timeout)
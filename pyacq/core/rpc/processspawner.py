@@ -48,6 +48,13 @@ class ProcessSpawner(object):
         process.
     executable : str | None
         Optional python executable to invoke. The default value is `sys.executable`.
+    serializer : str
+        Serializer used by the client to communicate with the new process
+        (see :class:`RPCClient`). Default is 'msgpack'.
+    max_workers : int
+        Number of worker threads of the new process's RPCServer, for requests
+        to thread-safe objects (see :class:`RPCServer`). Not supported with
+        ``qt=True``. Default is 0.
         
     Examples
     --------
@@ -66,7 +73,7 @@ class ProcessSpawner(object):
         proc.wait()
     """
     def __init__(self, name=None, address="tcp://127.0.0.1:*", qt=False, log_addr=None, 
-                 log_level=None, executable=None):
+                 log_level=None, executable=None, serializer='msgpack', max_workers=0):
         #logger.warn("Spawning process: %s %s %s", name, log_addr, log_level)
         assert qt in (True, False)
         assert isinstance(address, (str, bytes))
@@ -92,6 +99,10 @@ class ProcessSpawner(object):
         # Spawn new process
         class_name = 'QtRPCServer' if qt else 'RPCServer'
         args = {'address': address}
+        if max_workers > 0:
+            if qt:
+                raise ValueError("max_workers is not supported with qt=True.")
+            args['max_workers'] = max_workers
         bootstrap_conf = dict(
             class_name=class_name, 
             args=args,
@@ -147,7 +158,7 @@ class ProcessSpawner(object):
         if 'address' in status:
             self.address = status['address']
             #: An RPCClient instance that is connected to the RPCServer in the remote process
-            self.client = RPCClient(self.address.encode())
+            self.client = RPCClient(self.address.encode(), serializer=serializer)
         else:
             err = ''.join(status['error'])
             self.kill()
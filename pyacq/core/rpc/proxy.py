@@ -491,3 +491,17 @@ class ObjectProxy(object):
         
     def __rmod__(self, *args):
         return self._deferred_attr('__rmod__')(*args)
+
+
+class BatchReference(object):
+    """Reference to the result of an earlier request of a batch (see
+    :func:`RPCClient.batch()`), or to an attribute of that result.
+    
+    The RPCServer replaces references with the results they refer to before
+    invoking a request.
+    """
+    def __init__(self, index, attributes=()):
+        self.__dict__.update(_index=index, _attributes=tuple(attributes))
+
+    def _save(self):
+        return {'index': self._index, 'attributes': self._attributes}
@@ -4,15 +4,19 @@
 
 import numpy as np
 import datetime
+import io
 import base64
 import json
+import pickle
+import types
+import zmq
 try:
     import msgpack
     HAVE_MSGPACK = True
 except ImportError:
     HAVE_MSGPACK = False
 
-from .proxy import ObjectProxy
+from .proxy import ObjectProxy, BatchReference
 
 
 # Global list of supported serializers.
@@ -37,10 +41,22 @@ class Serializer:
     
     Note that tuples are converted to lists in transit. See:
     https://github.com/msgpack/msgpack-python/issues/98
+    
+    With :func:`dumps_frames()` / :func:`loads_frames()`, the data of arrays of
+    at least ``frame_threshold`` bytes is not embedded in the serialized
+    message but carried as separate zmq frames, which are sent without copy and
+    received as arrays that share memory with the received frame. Arrays sent
+    this way must not be modified until the message has been sent.
     """
+    
+    #: Minimum size (bytes) of arrays sent as separate frames by dumps_frames().
+    frame_threshold = 65536
+    
     def __init__(self, server=None, client=None):
         self._server = server
         self.client = client
+        # out-of-band buffers of the message being serialized / unserialized
+        self._frames = None
     
     @property
     def server(self):
@@ -63,6 +79,45 @@ class Serializer:
         """
         raise NotImplementedError()
 
+    def dumps_frames(self, obj):
+        """Convert obj to a list of message frames.
+        
+        The first frame is the serialized message; it is followed by the data
+        of large arrays (see ``frame_threshold``).
+        """
+        self._frames = []
+        try:
+            msg = self.dumps(obj)
+            return [msg] + self._frames
+        finally:
+            self._frames = None
+
+    def loads_frames(self, frames):
+        """Convert from a list of message frames (as returned by
+        :func:`dumps_frames()`) to python object.
+        
+        Frames may be bytes or zmq.Frame instances.
+        """
+        frames = [f.bytes if isinstance(f, zmq.Frame) else f for f in frames[:1]] + list(frames[1:])
+        self._frames = frames[1:]
+        try:
+            return self.loads(frames[0])
+        finally:
+            self._frames = None
+
+    def _encode_frame(self, obj):
+        # Return the serializable description of an array sent as a separate
+        # frame, or None if it must be sent in the message.
+        if self._frames is None or obj.nbytes < self.frame_threshold or obj.dtype.hasobject:
+            return None
+        if not obj.flags['C_CONTIGUOUS']:
+            obj = np.ascontiguousarray(obj)
+        self._frames.append(obj.reshape(-1).view('u1'))
+        return {encode_key: 'ndarray',
+                'frame': len(self._frames),
+                'dtype': str(obj.dtype),
+                'shape': obj.shape}
+
     def encode(self, obj):
         """Convert various types to serializable objects.
         
@@ -70,6 +125,9 @@ class Serializer:
         are converted to proxies.
         """
         if isinstance(obj, np.ndarray):
+            ser = self._encode_frame(obj)
+            if ser is not None:
+                return ser
             if not obj.flags['C_CONTIGUOUS']:
                 obj = np.ascontiguousarray(obj)
             assert(obj.flags['C_CONTIGUOUS'])
@@ -85,6 +143,10 @@ class Serializer:
                     'data': obj.strftime('%Y-%m-%d')}
         elif obj is None:
             return {encode_key: 'none'}
+        elif isinstance(obj, BatchReference):
+            ser = {encode_key: 'batch_reference'}
+            ser.update(obj._save())
+            return ser
         elif isinstance(obj, np.float_):
             #convert for numpy.float32, numpy.float64, ...
             return float(obj)
@@ -115,6 +177,8 @@ class Serializer:
                     d = {}
                     exec('dtype='+dt, None, d)
                     dt = d['dtype']
+                if 'frame' in dct:
+                    return np.frombuffer(self._frames[dct['frame'] - 1], dtype=dt).reshape(dct['shape'])
                 return np.fromstring(dct['data'], dtype=dt).reshape(dct['shape'])
             elif type_name == 'datetime':
                 return datetime.datetime.strptime(dct['data'], '%Y-%m-%dT%H:%M:%S.%f')
@@ -122,6 +186,8 @@ class Serializer:
                 return datetime.datetime.strptime(dct['data'], '%Y-%m-%d').date()
             elif type_name == 'none':
                 return None
+            elif type_name == 'batch_reference':
+                return BatchReference(dct['index'], dct['attributes'])
             elif type_name == 'proxy':
                 if 'attributes' in dct:
                     dct['attributes'] = tuple(dct['attributes'])
@@ -199,6 +265,9 @@ class JsonSerializer(Serializer):
 
     def encode(self, obj):
         if isinstance(obj, np.ndarray):
+            ser = self._encode_frame(obj)
+            if ser is not None:
+                return ser
             # JSON doesn't support bytes, so we use base64 encoding instead:
             if not obj.flags['C_CONTIGUOUS']:
                 obj = np.ascontiguousarray(obj)
@@ -218,7 +287,7 @@ class JsonSerializer(Serializer):
     def decode(self, dct):
         if isinstance(dct, dict):
             type_name = dct.get(encode_key, None)
-            if type_name == 'ndarray':
+            if type_name == 'ndarray' and 'frame' not in dct:
                 data = base64.b64decode(dct['data'])
                 return np.frombuffer(data, dct['dtype']).reshape(dct['shape'])
             elif type_name == 'bytes':
@@ -228,7 +297,82 @@ class JsonSerializer(Serializer):
         return dct
 
 
+# Types pickled by value by PickleSerializer; other objects are sent by proxy.
+_pickle_types = (type(None), bool, int, float, complex, str, bytes, bytearray, tuple, list,
+                 dict, set, frozenset, np.ndarray, np.generic, np.dtype, datetime.date,
+                 datetime.time, datetime.timedelta, pickle.PickleBuffer)
+# Classes and functions of these modules are pickled by name; they are needed
+# to rebuild the types above.
+_pickle_modules = ('builtins', 'copyreg', 'numpy', 'datetime', 'collections')
+
+
+def _is_pickle_module(obj):
+    return (getattr(obj, '__module__', None) or '').split('.')[0] in _pickle_modules
+
+
+class PickleSerializer(Serializer):
+    """Class for serializing objects using pickle protocol 5.
+    
+    Unlike msgpack and json, this preserves tuples, structured dtypes, numpy
+    scalars and sets. With :func:`dumps_frames()`, the data of large arrays and
+    other buffers is passed out-of-band by pickle and sent as separate frames
+    without any copy. Objects that are not builtin, numpy or datetime types are
+    converted to object proxies, as with the other serializers; this includes
+    instances of user-defined subclasses of these types (such as namedtuples).
+    
+    **Unpickling can execute arbitrary code.** Only use this serializer
+    between trusted processes (select it with
+    ``RPCClient(address, serializer='pickle')``).
+    """
+    
+    # used to tell server how to unserialize messages
+    type = 'pickle'
+    
+    def dumps(self, obj):
+        """Convert obj to pickle string.
+        """
+        buffer_callback = None if self._frames is None else self._buffer_callback
+        f = io.BytesIO()
+        pickler = pickle.Pickler(f, protocol=5, buffer_callback=buffer_callback)
+        pickler.persistent_id = self._persistent_id
+        pickler.dump(obj)
+        return f.getvalue()
+
+    def loads(self, msg):
+        """Convert from pickle string to python object.
+        
+        Proxies that reference objects owned by the server are converted back
+        into the local object. All other proxies are left as-is.
+        """
+        unpickler = pickle.Unpickler(io.BytesIO(msg), buffers=self._frames)
+        unpickler.persistent_load = self._persistent_load
+        return unpickler.load()
+
+    def _buffer_callback(self, buf):
+        # small buffers stay in the pickle stream
+        view = buf.raw()
+        if view.nbytes < self.frame_threshold:
+            return True
+        self._frames.append(view)
+        return False
+
+    def _persistent_id(self, obj):
+        # Subclasses of the plain types (namedtuple, dict subclasses, ...) are
+        # only pickled by value if their class can itself be pickled by name;
+        # otherwise the whole instance is sent by proxy.
+        if type(obj) in _pickle_types or (isinstance(obj, _pickle_types) and _is_pickle_module(type(obj))):
+            return None
+        if isinstance(obj, (type, types.FunctionType, types.BuiltinFunctionType)):
+            if _is_pickle_module(obj):
+                return None
+        return Serializer.encode(self, obj)
+
+    def _persistent_load(self, pid):
+        return self.decode(dict(pid))
+
+
 #: dict containing {name : SerializerSubclass} for all supported serializers
 all_serializers[JsonSerializer.type] = JsonSerializer
+all_serializers[PickleSerializer.type] = PickleSerializer
 if HAVE_MSGPACK:
     all_serializers[MsgpackSerializer.type] = MsgpackSerializer
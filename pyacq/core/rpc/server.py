@@ -13,10 +13,12 @@ import zmq
 import logging
 import numpy as np
 import atexit
+import collections
+from concurrent.futures import ThreadPoolExecutor
 from pyqtgraph.Qt import QtCore, QtGui
 
 from .serializer import all_serializers
-from .proxy import ObjectProxy
+from .proxy import ObjectProxy, BatchReference
 from .timer import Timer
 from . import log
 
@@ -54,6 +56,11 @@ class RPCServer(object):
         
         **Note:** binding RPCServer to a public IP address is a potential
         security hazard.
+    max_workers : int
+        If > 0, ``call_obj`` requests for thread-safe callables are invoked by
+        a pool of *max_workers* threads, so that slow calls do not block other
+        requests (see below). Default is 0: all requests are invoked by the
+        server thread.
 
     Notes
     -----
@@ -65,6 +72,20 @@ class RPCServer(object):
     RPCServer is not a thread-safe class. Only use :class:`RPCClient` to communicate
     with RPCServer from other threads.
     
+    With *max_workers* > 0, a callable is invoked in a worker thread if it, or
+    the object it is a method of, has an ``rpc_threadsafe`` attribute:
+    
+    * ``rpc_threadsafe = True``: calls may run concurrently.
+    * ``rpc_threadsafe = 'serialize'``: calls run in worker threads, but only
+      one at a time for each object (other calls to the same object wait in a
+      queue).
+    
+    All other requests, and the results of all requests, are still processed
+    by the server thread. When the server closes, it waits up to
+    *worker_close_timeout* seconds for the calls still running in worker
+    threads and sends their results; calls that have not returned by then
+    are answered with an error.
+    
 
     Examples
     --------
@@ -100,6 +121,9 @@ class RPCServer(object):
     servers_by_thread = {}
     servers_by_thread_lock = threading.Lock()
     
+    #: Maximum time (seconds) that close() waits for calls running in worker threads
+    worker_close_timeout = 10.
+    
     @staticmethod
     def get_server():
         """Return the server running in this thread, or None if there is no server.
@@ -142,7 +166,7 @@ class RPCServer(object):
         srv = RPCServer.get_server()
         return RPCClient.get_client(srv.address)
 
-    def __init__(self, address="tcp://127.0.0.1:*"):
+    def __init__(self, address="tcp://127.0.0.1:*", max_workers=0):
         self._socket = zmq.Context.instance().socket(zmq.ROUTER)
         
         # socket will continue attempting to deliver messages up to 5 sec after
@@ -189,6 +213,29 @@ class RPCServer(object):
         self._proxy_refs = {}  # obj_id: [object, set(refs)]
         self._proxy_id_map = {}  # id(obj): obj_id
         
+        # Thread pool for thread-safe requests. Workers append their results to
+        # a queue and wake up the server thread through _result_socket.
+        self._executor = None
+        self._result_socket = None
+        if max_workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+            self._worker_results = collections.deque()
+            self._worker_local = threading.local()
+            # all worker sockets (None once closed), and the lock that protects
+            # them and _worker_results
+            self._worker_sockets = []
+            self._worker_lock = threading.Lock()
+            self._serialized_calls = {}  # id(obj): calls waiting for the running call to obj
+            self._pending_calls = set()  # (caller, req_id) of worker calls awaiting a reply
+            self._running_calls = 0  # all calls submitted to workers, with or without reply
+            self._result_addr = 'inproc://rpc_results_%x' % id(self)
+            self._result_socket = zmq.Context.instance().socket(zmq.PULL)
+            self._result_socket.linger = 0
+            self._result_socket.bind(self._result_addr)
+            self._poller = zmq.Poller()
+            self._poller.register(self._socket, zmq.POLLIN)
+            self._poller.register(self._result_socket, zmq.POLLIN)
+        
         # Make sure we inform clients of closure
         atexit.register(self._atexit)
 
@@ -239,14 +286,17 @@ class RPCServer(object):
         
     @staticmethod
     def _read_one(socket):
-        name, req_id, action, return_type, ser_type, opts = socket.recv_multipart()
+        # frames after opts carry the data of large arrays
+        name, req_id, action, return_type, ser_type, opts, *frames = socket.recv_multipart(copy=False)
         msg = {
-            'req_id': int(req_id), 
-            'action': action.decode(), 
-            'return_type': return_type.decode(),
-            'ser_type': ser_type.decode(),
-            'opts': opts,
+            'req_id': int(req_id.bytes), 
+            'action': action.bytes.decode(), 
+            'return_type': return_type.bytes.decode(),
+            'ser_type': ser_type.bytes.decode(),
+            'opts': opts.bytes,
+            'frames': frames,
         }
+        name = name.bytes
         return name, msg
         
     def _read_and_process_one(self):
@@ -255,6 +305,14 @@ class RPCServer(object):
         """
         if not self.running:
             raise RuntimeError("RPC server socket is already closed.")
+        
+        if self._executor is not None:
+            # wait for a request or for results of worker threads
+            socks = dict(self._poller.poll())
+            if self._result_socket in socks:
+                self._process_worker_results()
+            if self._socket not in socks:
+                return
             
         name, msg = self._read_one(self._socket)
         self._process_one(name, msg)
@@ -281,28 +339,39 @@ class RPCServer(object):
             except KeyError:
                 raise ValueError("Unsupported serializer '%s'" % ser_type)
             opts = msg.pop('opts', None)
+            frames = msg.pop('frames', [])
             
             logging.debug("RPC recv '%s' from %s [req_id=%s]", action, caller.decode(), req_id)
             logging.debug("    => %s", msg)
             if opts == b'':
                 opts = None
             else:
-                opts = serializer.loads(opts)
+                opts = serializer.loads_frames([opts] + frames)
             logging.debug("    => opts: %s", opts)
             
+            if self._executor is not None and action == 'call_obj':
+                worker_key = self._worker_key(opts['obj'])
+                if worker_key is not False:
+                    self._submit_call(worker_key, (caller, req_id, opts, return_type))
+                    return
+            
             result = self.process_action(action, opts, return_type, caller)
             exc = None
         except:
+            result = None
             exc = sys.exc_info()
 
+        self._send_return(caller, req_id, return_type, result, exc)
+            
+        if action == 'close':
+            self._final_close()
+    
+    def _send_return(self, caller, req_id, return_type, result, exc):
         # Send result or error back to client
         if req_id >= 0:
             if exc is None:
                 #print "returnValue:", returnValue, result
-                if return_type == 'auto':
-                    result = self.auto_proxy(result, self.no_proxy_types)
-                elif return_type == 'proxy':
-                    result = self.get_proxy(result)
+                result = self._return_value(result, return_type)
                 
                 try:
                     self._send_result(caller, req_id, rval=result)
@@ -318,16 +387,97 @@ class RPCServer(object):
             # An exception occurred, but client did not request a response.
             # Instead we will dump the exception here.
             sys.excepthook(*exc)
-            
-        if action == 'close':
-            self._final_close()
     
-    def _send_error(self, caller, req_id, exc):
+    def _worker_key(self, func):
+        # Return False if func must be invoked in the server thread, None if
+        # it may be invoked concurrently in a worker thread, or the object
+        # whose calls must be serialized.
+        for obj in (func, getattr(func, '__self__', None)):
+            if obj is None or isinstance(obj, ObjectProxy):
+                continue
+            try:
+                mode = getattr(obj, 'rpc_threadsafe', False)
+            except Exception:
+                continue
+            if mode is True:
+                return None
+            elif mode == 'serialize':
+                return obj
+        return False
+    
+    def _submit_call(self, key, call):
+        self._running_calls += 1
+        if call[1] >= 0:
+            # sync='off' requests (req_id -1) are not answered
+            self._pending_calls.add((call[0], call[1]))
+        if key is not None:
+            waiting = self._serialized_calls.get(id(key))
+            if waiting is not None:
+                # another call to this object is running
+                waiting.append((key, call))
+                return
+            self._serialized_calls[id(key)] = collections.deque()
+        self._executor.submit(self._worker_call, key, call)
+    
+    def _worker_call(self, key, call):
+        # Invoke a call_obj request in a worker thread
+        caller, req_id, opts, return_type = call
+        try:
+            result = self.process_action('call_obj', opts, return_type, caller)
+            exc = None
+        except:
+            result = None
+            exc = sys.exc_info()
+        
+        with self._worker_lock:
+            if self._worker_sockets is None:
+                # the server has closed and already answered this call
+                return
+            self._worker_results.append((key, caller, req_id, return_type, result, exc))
+            # each worker thread has its own socket to wake up the server thread
+            sock = getattr(self._worker_local, 'socket', None)
+            if sock is None:
+                sock = zmq.Context.instance().socket(zmq.PUSH)
+                sock.linger = 0
+                sock.connect(self._result_addr)
+                self._worker_local.socket = sock
+                self._worker_sockets.append(sock)
+            sock.send(b'')
+    
+    def _process_worker_results(self):
+        # Send the results of calls completed by worker threads
+        while self._result_socket.poll(0):
+            self._result_socket.recv()
+            with self._worker_lock:
+                key, caller, req_id, return_type, result, exc = self._worker_results.popleft()
+            self._running_calls -= 1
+            if req_id >= 0:
+                self._pending_calls.discard((caller, req_id))
+            if key is not None:
+                waiting = self._serialized_calls[id(key)]
+                if len(waiting) > 0:
+                    self._executor.submit(self._worker_call, *waiting.popleft())
+                else:
+                    del self._serialized_calls[id(key)]
+            self._send_return(caller, req_id, return_type, result, exc)
+    
+    def _return_value(self, result, return_type):
+        # Convert a result to a proxy if requested by return_type
+        if return_type == 'auto':
+            return self.auto_proxy(result, self.no_proxy_types)
+        elif return_type == 'proxy':
+            return self.get_proxy(result)
+        return result
+    
+    def _format_error(self, caller, req_id, exc):
         exc_str = ["Error while processing request %s [%d]: " % (caller.decode(), req_id)]
         exc_str += traceback.format_stack()
         exc_str += [" < exception caught here >\n"]
         exc_str += traceback.format_exception(*exc)
-        self._send_result(caller, req_id, error=(exc[0].__name__, exc_str))
+        return (exc[0].__name__, exc_str)
+    
+    def _send_error(self, caller, req_id, exc):
+        self._send_result(caller, req_id, error=self._format_error(caller, req_id, exc))
     
     def _send_result(self, caller, req_id, rval=None, error=None):
         result = {'action': 'return', 'req_id': req_id,
@@ -338,9 +488,9 @@ class RPCServer(object):
         # Select the correct serializer for this client
         serializer = self._serializers[self._clients[caller]]
         
-        # Serialize and return the result
-        data = serializer.dumps(result)
-        self._socket.send_multipart([caller, data])
+        # Serialize and return the result; large arrays are sent without copy
+        frames = serializer.dumps_frames(result)
+        self._socket.send_multipart([caller] + frames, copy=False)
 
     def process_action(self, action, opts, return_type, caller):
         """Invoke a single action and return the result.
@@ -387,7 +537,12 @@ class RPCServer(object):
                 result = map(mod.__getattr__, fromlist)
         elif action == 'ping':
             result = 'pong'
+        elif action == 'batch':
+            result = self.process_batch(opts['requests'], caller)
         elif action == 'close':
+            if self._executor is not None:
+                # clients drop their pending requests when the server disconnects
+                self._close_workers()
             self._closed = True
             # Send a disconnect message to all known clients
             data = {}
@@ -414,6 +569,44 @@ class RPCServer(object):
         
         return result
 
+    def process_batch(self, requests, caller):
+        """Invoke a list of ``[action, opts, return_type]`` requests in order.
+        
+        Options of each request may contain :class:`BatchReference` instances,
+        which are replaced by the result of an earlier request. Return a list
+        of ``[rval, error]`` for each request that was invoked; requests after
+        the first error are not invoked.
+        """
+        results = []
+        returns = []
+        for i, (action, opts, return_type) in enumerate(requests):
+            try:
+                if action in ('batch', 'close'):
+                    raise ValueError("RPC action '%s' is not allowed in a batch" % action)
+                opts = self._resolve_references(opts, results)
+                result = self.process_action(action, opts, return_type, caller)
+                returns.append([self._return_value(result, return_type), None])
+                results.append(result)
+            except:
+                returns.append([None, self._format_error(caller, i, sys.exc_info())])
+                break
+        return returns
+
+    def _resolve_references(self, obj, results):
+        # Replace BatchReferences in request options with earlier results
+        if isinstance(obj, BatchReference):
+            if obj._index >= len(results):
+                raise ValueError("Batch request %d is not available." % obj._index)
+            result = results[obj._index]
+            for attr in obj._attributes:
+                result = getattr(result, attr)
+            return result
+        elif type(obj) is dict:
+            return {k: self._resolve_references(v, results) for k, v in obj.items()}
+        elif type(obj) in (list, tuple):
+            return type(obj)(self._resolve_references(v, results) for v in obj)
+        return obj
+
     def _atexit(self):
         # Process is exiting; do any last-minute cleanup if necessary.
         if self._closed is not True:
@@ -436,6 +629,32 @@ class RPCServer(object):
         # Called after the server has closed and sent its disconnect messages.
         self._socket.close()
 
+    def _close_workers(self):
+        # Wait for the calls still running in worker threads and send their
+        # results, then stop the workers and close their sockets.
+        deadline = time.perf_counter() + self.worker_close_timeout
+        while self._running_calls > 0:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not self._result_socket.poll(int(remaining * 1000)):
+                break
+            self._process_worker_results()
+        
+        with self._worker_lock:
+            for sock in self._worker_sockets:
+                sock.close()
+            self._worker_sockets = None
+        self._result_socket.close()
+        self._serialized_calls.clear()
+        self._executor.shutdown(wait=False)
+        
+        # calls that did not return in time and expect a reply
+        for caller, req_id in self._pending_calls:
+            try:
+                raise RuntimeError("RPC server closed before the call returned.")
+            except RuntimeError:
+                self._send_return(caller, req_id, None, None, sys.exc_info())
+        self._pending_calls.clear()
+
     def running(self):
         """Boolean indicating whether the server is still running.
         """
@@ -450,8 +669,7 @@ class RPCServer(object):
         logging.info("RPC start server: %s@%s", name, self.address.decode())
         RPCServer.register_server(self)
         while self.running():
-            name, msg = self._read_one(self._socket)
-            self._process_one(name, msg)
+            self._read_and_process_one()
             
     def run_lazy(self):
         """Register this server as being active for the current thread, but do
@@ -612,11 +830,11 @@ class QtPollThread(QtCore.QThread):
             socks = dict(poller.poll(timeout=100))
             
             if self.return_socket in socks:
-                name, data = self.return_socket.recv_multipart()
-                #logger.debug("poller return %s %s", name, data)
-                if name == 'STOP':
+                name, *frames = self.return_socket.recv_multipart(copy=False)
+                #logger.debug("poller return %s %s", name, frames)
+                if name.bytes == b'STOP':
                     break
-                self.rpc_socket.send_multipart([name, data])
+                self.rpc_socket.send_multipart([name] + frames, copy=False)
                 
             if self.rpc_socket in socks:
                 name, msg = RPCServer._read_one(self.rpc_socket)
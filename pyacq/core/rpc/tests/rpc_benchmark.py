@@ -3,7 +3,9 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 import time, threading
+import numpy as np
 from pyacq.core import rpc
+from pyacq.core.rpc.serializer import Serializer
 
 def test_poingrate(cli, dur=2.0):
     start = time.time()
@@ -28,6 +30,32 @@ def test_async_poingrate(cli, dur=2.0, buffer=500):
         
     print("Async ping rate: %0.0f/sec" % (count/dur))
 
+
+def test_array_latency(cli, sizes=(1e3, 1e4, 1e5, 1e6, 1e7, 5e7), dur=1.0):
+    # round trip of an array sent to the server and returned by value
+    for size in sizes:
+        arr = np.ones(int(size) // 8)
+        start = time.perf_counter()
+        count = 0
+        while time.perf_counter() < start + dur:
+            cli.send('get_obj', opts={'obj': arr}, sync='sync')
+            count += 1
+        dt = (time.perf_counter() - start) / count
+        print("Array %9d bytes: %8.3f ms/call %8.0f MB/s" % (arr.nbytes, dt*1000, 2*arr.nbytes/dt/1e6))
+
+
+def test_array_frames(cli):
+    # compare arrays sent as separate frames with arrays embedded in messages
+    print("Arrays >= %d bytes in separate frames:" % Serializer.frame_threshold)
+    test_array_latency(cli)
+    threshold = Serializer.frame_threshold
+    Serializer.frame_threshold = float('inf')
+    try:
+        print("Arrays embedded in messages:")
+        test_array_latency(cli)
+    finally:
+        Serializer.frame_threshold = threshold
+
     
     
 
@@ -40,6 +68,7 @@ thread.start()
 cli = rpc.RPCClient(server.address)
 test_poingrate(cli)
 test_async_poingrate(cli)
+test_array_frames(cli)
 
 cli.close_server()
 
@@ -53,6 +82,7 @@ thread.start()
 cli = rpc.RPCClient(server.address)
 test_poingrate(cli)
 test_async_poingrate(cli)
+test_array_frames(cli)
 
 cli.close_server()
 
@@ -62,6 +92,7 @@ print("=========== TCP to spawned process ============")
 proc = rpc.ProcessSpawner()
 test_poingrate(proc.client)
 test_async_poingrate(proc.client)
+test_array_latency(proc.client)
 
 
 # process
@@ -69,4 +100,5 @@ print("=========== TCP to spawned Qt process ============")
 proc = rpc.ProcessSpawner(qt=True)
 test_poingrate(proc.client)
 test_async_poingrate(proc.client)
+test_array_latency(proc.client)
 
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import os
+import time
+import asyncio
+import threading
+import pytest
+
+from pyacq.core.rpc import RPCServer, AsyncRPCClient, AsyncFuture, RemoteCallException
+
+
+class Sleeper(object):
+    def sleep(self, t):
+        time.sleep(t)
+        return t
+
+
+def test_async_rpc_client():
+    servers = []
+    for i in range(4):
+        server = RPCServer()
+        server['sleeper'] = Sleeper()
+        threading.Thread(target=server.run_forever, daemon=True).start()
+        servers.append(server)
+
+    async def main():
+        clients = [AsyncRPCClient(server.address) for server in servers]
+        sleepers = [cli['sleeper'] for cli in clients]
+
+        # calls to all servers run concurrently
+        start = time.perf_counter()
+        futs = [sleeper.sleep(0.3) for sleeper in sleepers]
+        assert all(isinstance(fut, AsyncFuture) for fut in futs)
+        assert await asyncio.gather(*futs) == [0.3] * 4
+        assert time.perf_counter() - start < 0.9
+
+        # futures can also be used synchronously
+        fut = sleepers[0].sleep(0.01)
+        assert fut.result() == 0.01
+        assert await fut == 0.01
+        assert sleepers[0].sleep(0.01, _sync='sync') == 0.01
+        assert await clients[0].ping(sync='async') == 'pong'
+
+        # batches wait on the event loop
+        async with clients[1].batch():
+            a = sleepers[1].sleep(0.01)
+            b = clients[1]._import('os').getpid()
+        assert a.result() == 0.01
+        assert b.result() == os.getpid()
+
+        with pytest.raises(RemoteCallException):
+            await sleepers[2].sleep('x')
+
+        for cli in clients:
+            cli.close_server()
+            cli.close()
+
+    asyncio.run(main())
+
+
+if __name__ == '__main__':
+    test_async_rpc_client()
@@ -118,6 +118,43 @@ def test_rpc():
     logger.info("-- Test no return --")
     assert obj.add(1, 2, _sync='off') is None
 
+    logger.info("-- Test batch requests --")
+    with client.batch() as batch:
+        obj4 = client['test_class']('obj4')
+        a = obj4.add(3, 4)
+        b = obj.test(obj4)
+        c = obj4.name.upper()
+        assert obj4.add(1, 2, _sync='off') is None
+        assert not a.done()
+    assert a.result() == 7
+    assert b.result()[:3] == ['obj1', 'obj4', 12]
+    assert c.result() == 'OBJ4'
+    assert isinstance(obj4.result(), ObjectProxy)
+    assert batch.result()[2] == 7
+    obj4.result()._delete()
+    
+    try:
+        with client.batch():
+            a = obj.add(1, 2)
+            b = obj.add(1, 'x')
+            c = obj.add(3, 4)
+        raise AssertionError('should have raised RemoteCallException')
+    except RemoteCallException as err:
+        assert err.type_str == 'TypeError'
+    assert a.result() == 3
+    try:
+        c.result()
+        raise AssertionError('should have raised RuntimeError')
+    except RuntimeError:
+        pass
+    
+    # send a batch without waiting
+    batch = client.batch()
+    a = batch.send('call_obj', opts={'obj': obj.sleep, 'args': (0.1,), 'kwargs': {}})
+    fut = batch.submit()
+    assert not fut.done()
+    assert a.result() is None
+
     logger.info("-- Test return by proxy --")
     list_prox = obj.get_list(_return_type='proxy')
     assert isinstance(list_prox, ObjectProxy)
@@ -242,6 +279,14 @@ def test_rpc():
     s2cli = s2rpc.RPCClient.get_client(client.address)  # server2's client for server1
     assert np.all(s2cli['arr'] == arr)  # retrieve via server2
 
+    logger.info("-- Test large arrays --")
+    # sent as separate message frames
+    big = np.random.normal(size=(300, 100))
+    client['big'] = big
+    assert np.all(client['big'] == big)
+    assert np.all(s2cli['big'] == big)
+    assert np.all(s2cli['big'][::2] == big[::2])
+
     logger.info("-- Test JSON client --")
     # Start a JSON client in a remote process
     cli_proc = ProcessSpawner()
@@ -250,6 +295,20 @@ def test_rpc():
     assert cli.serializer.type._get_value() == 'json'
     assert cli['test_class']('json-tester').add(3, 4) == 7
     cli_proc.kill()
+    
+    logger.info("-- Test pickle client --")
+    cli_proc = ProcessSpawner(serializer='pickle')
+    cli = cli_proc.client
+    assert cli.serializer.type == 'pickle'
+    assert cli.send('get_obj', opts={'obj': (1, 2)}) == (1, 2)
+    assert np.all(cli.send('get_obj', opts={'obj': big}) == big)
+    rnp = cli._import('numpy')
+    assert rnp.arange(5).sum() == 10
+    # proxies are sent as proxies
+    robj = cli.transfer([])
+    robj.append(client['my_object'])
+    assert robj[0].add(3, 4) == 7
+    cli_proc.kill()
 
     
     logger.info("-- Setup reentrant communication test.. --")
@@ -329,6 +388,101 @@ def test_qt_rpc():
 
     logger.level = previous_level
 
+def test_rpc_workers():
+    class Worker(object):
+        rpc_threadsafe = True
+        def __init__(self):
+            self.running = 0
+            self.max_running = 0
+            self.lock = threading.Lock()
+        
+        def sleep(self, t):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(t)
+            with self.lock:
+                self.running -= 1
+            return threading.current_thread().name
+        
+        def fail(self):
+            raise TypeError("worker error")
+    
+    class SerialWorker(Worker):
+        rpc_threadsafe = 'serialize'
+    
+    class Plain(object):
+        def thread_name(self):
+            return threading.current_thread().name
+    
+    server = RPCServer(max_workers=4)
+    server['worker'] = Worker()
+    server['serial'] = SerialWorker()
+    server['plain'] = Plain()
+    serve_thread = threading.Thread(target=server.run_forever, daemon=True, name='rpc_server_thread')
+    serve_thread.start()
+    client = RPCClient(server.address)
+    
+    # thread-safe calls run concurrently, and do not block other requests
+    worker = client['worker']
+    start = time.perf_counter()
+    futs = [worker.sleep(0.3, _sync='async') for i in range(4)]
+    assert client.ping() == 'pong'
+    assert time.perf_counter() - start < 0.2
+    names = [fut.result() for fut in futs]
+    assert time.perf_counter() - start < 0.9
+    assert 'rpc_server_thread' not in names
+    assert worker.max_running._get_value() > 1
+    
+    # calls to objects marked 'serialize' run one at a time
+    serial = client['serial']
+    futs = [serial.sleep(0.05, _sync='async') for i in range(4)]
+    assert client.ping() == 'pong'
+    assert 'rpc_server_thread' not in [fut.result() for fut in futs]
+    assert serial.max_running._get_value() == 1
+    
+    # other calls run in the server thread
+    assert client['plain'].thread_name() == 'rpc_server_thread'
+    
+    try:
+        worker.fail()
+        raise AssertionError('should have raised RemoteCallException')
+    except RemoteCallException as err:
+        assert err.type_str == 'TypeError'
+    
+    # closing the server waits for calls still running in worker threads ...
+    futs = [worker.sleep(0.3, _sync='async')] + [serial.sleep(0.1, _sync='async') for i in range(2)]
+    slow = worker.sleep(2.0, _sync='async')
+    time.sleep(0.1)
+    server.worker_close_timeout = 0.5
+    client.close_server(timeout=5)
+    assert all(isinstance(fut.result(), str) for fut in futs)
+    # ... and answers calls that do not return in time with an error
+    try:
+        slow.result()
+        raise AssertionError('should have raised RemoteCallException')
+    except RemoteCallException as err:
+        assert err.type_str == 'RuntimeError'
+    client.close()
+    serve_thread.join()
+    assert server._worker_sockets is None
+    
+    # ... including calls that expect no reply
+    server = RPCServer(max_workers=4)
+    server['worker'] = Worker()
+    serve_thread = threading.Thread(target=server.run_forever, daemon=True)
+    serve_thread.start()
+    client = RPCClient(server.address)
+    for i in range(3):
+        client['worker'].sleep(0.1 * (i + 1), _sync='off')
+    time.sleep(0.05)
+    client.close_server(timeout=5)
+    assert server['worker'].running == 0
+    assert len(server._pending_calls) == 0
+    client.close()
+    serve_thread.join()
+
+
 def test_disconnect():
     #~ logger.level = logging.DEBUG
     
@@ -394,5 +548,6 @@ def test_disconnect():
 if __name__ == '__main__':
     test_rpc()
     test_qt_rpc()
+    test_rpc_workers()
     test_disconnect()
     
@@ -4,10 +4,12 @@
 
 import numpy as np
 import datetime
+import collections
+import threading
 import pytest
 
-from pyacq.core.rpc.serializer import JsonSerializer, MsgpackSerializer, HAVE_MSGPACK
-from pyacq.core.rpc import ObjectProxy, ProcessSpawner
+from pyacq.core.rpc.serializer import JsonSerializer, MsgpackSerializer, PickleSerializer, HAVE_MSGPACK
+from pyacq.core.rpc import ObjectProxy, ProcessSpawner, RPCServer
 
 proc = ProcessSpawner()
 
@@ -33,6 +35,49 @@ def test_msgpack():
 def test_json():
     check_serializer(JsonSerializer())
 
+def test_pickle():
+    serializer = PickleSerializer()
+    check_serializer(serializer)
+    
+    # types that msgpack and json do not preserve
+    data = {'tuple': (1, (2, 3)), 'set': {1, 2}, 'float32': np.float32(1.5),
+            (1, 2): 'tuple key', 'dtype': np.dtype([('a', 'f8'), ('b', 'i4', (2,))])}
+    d2 = serializer.loads(serializer.dumps(data))
+    assert d2 == data
+    assert type(d2['float32']) is np.float32
+    
+    # objects that are not plain data are sent by proxy
+    class Obj:
+        pass
+    with pytest.raises(TypeError):
+        # no server in this thread to make a proxy
+        serializer.dumps([Obj()])
+    
+    # instances of user subclasses of tuple / dict are proxied whole
+    NT = collections.namedtuple('NT', ['x', 'y'])
+    class D(dict):
+        pass
+    nt, d = NT(1, 2), D(a=1)
+    with pytest.raises(TypeError):
+        serializer.dumps(nt)
+    server = RPCServer()
+    threading.Thread(target=server.run_forever, daemon=True).start()
+    serializer = PickleSerializer(server=server)
+    d2 = serializer.loads(serializer.dumps({'nt': nt, 'd': d, 'od': collections.OrderedDict(a=1)}))
+    assert d2['nt'] is nt and d2['d'] is d
+    assert type(d2['od']) is collections.OrderedDict
+    server.close()
+    serializer = PickleSerializer()
+    
+    # out-of-band buffers are sent as frames without copy
+    big = np.zeros(100000, dtype=[('a', 'f8'), ('b', 'i4')])
+    frames = serializer.dumps_frames({'big': big, 'small': np.arange(3)})
+    assert len(frames) == 2
+    assert np.shares_memory(np.frombuffer(frames[1], dtype='u1'), big)
+    d2 = serializer.loads_frames(frames)
+    assert np.all(d2['big'] == big) and d2['big'].dtype == big.dtype
+
+
 def check_serializer(serializer):
     s = serializer.dumps(test_data)
     d2 = serializer.loads(s)
@@ -44,8 +89,21 @@ def check_serializer(serializer):
             assert np.all(v1 == v2)
         else:
             assert v1 == v2
+    
+    # large arrays are carried by separate frames
+    big = {'f8': np.random.normal(size=(200, 50)), 'i2': np.arange(80000, dtype='int32')[::2],
+           'struct': np.zeros(10000, dtype=[('a', 'f8'), ('b', 'i4')]), 'small': np.arange(4)}
+    frames = serializer.dumps_frames(big)
+    # (pickle copies non-contiguous arrays into the message)
+    assert len(frames) in (3, 4)
+    d2 = serializer.loads_frames(frames)
+    for k, v in big.items():
+        assert d2[k].dtype == v.dtype
+        assert np.all(d2[k] == v)
+    assert len(serializer.dumps_frames(test_data)) == 1
 
 
 if __name__ == '__main__':
     test_msgpack()
     test_json()
+    test_pickle()
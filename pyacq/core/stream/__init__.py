@@ -3,13 +3,18 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 from .stream import InputStream, OutputStream
-from .ringbuffer import RingBuffer
+from .asyncstream import AsyncInputStream, AsyncOutputStream
+from .ringbuffer import RingBuffer, RingBufferOverrun, RingBufferCursor
+from .spillbuffer import SpillRingBuffer
 from .sharedarray import SharedArray
 from .streamhelpers import all_transfermodes, register_transfermode
 from .compression import compression_methods
+from .conversion import ChunkConverter
 
 # import transfer modes so they register their helper classes
 from . import plaindatastream
 from . import sharedmemstream
 from . import ndarraystream
 from . import rawbytesstream
+from . import quantizedstream
+from . import inprocstream
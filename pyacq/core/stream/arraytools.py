@@ -67,6 +67,10 @@ def decompose_array(data):
     
     If the input array is discontiguous, it will be copied using axis_order_copy().
     """
+    if data.flags['C_CONTIGUOUS']:
+        # common case; skip the stride analysis below
+        return data, 0, data.strides
+
     if not is_contiguous(data):
         # socket.send requires a contiguous buffer
         data = axis_order_copy(data)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import zmq
+import zmq.asyncio
+
+from .stream import InputStream, OutputStream
+
+
+class AsyncInputStream(object):
+    """InputStream for use with asyncio.
+
+    This wraps an :class:`InputStream` and waits for packets on the asyncio
+    event loop instead of blocking a thread, so that many streams can be
+    consumed from a single event loop::
+
+        stream = AsyncInputStream()
+        stream.connect(output)
+        async for index, data in stream:
+            ...
+
+    Packets are decoded by the same receivers as InputStream, so all transfer
+    modes are supported. The wrapped stream is available as the ``stream``
+    attribute.
+    """
+    def __init__(self, spec=None, node=None, name=None):
+        self.stream = InputStream(spec=spec, node=node, name=name)
+        self._socket = None
+
+    @property
+    def params(self):
+        return self.stream.params
+
+    @property
+    def buffer(self):
+        return self.stream.buffer
+
+    def connect(self, output, channels=None):
+        """Connect an output to this input.
+
+        See :func:`InputStream.connect()`.
+        """
+        if isinstance(output, AsyncOutputStream):
+            output = output.stream
+        self.stream.connect(output, channels=channels)
+        if not isinstance(self.stream.socket, zmq.Socket):
+            self.stream.close()
+            raise ValueError("AsyncInputStream does not support protocol '%s'." % self.params['protocol'])
+        # asyncio view of the same zmq socket
+        self._socket = zmq.asyncio.Socket.from_socket(self.stream.socket)
+
+    async def poll(self, timeout=None):
+        """Wait until a packet is available, or *timeout* ms have elapsed.
+
+        Return a non-zero value if a packet is available.
+        """
+        if self.stream._pending is not None:
+            return zmq.POLLIN
+        return await self._socket.poll(timeout=timeout)
+
+    async def recv(self, **kargs):
+        """Wait for the next packet and return ``(index, data)``.
+
+        See :func:`InputStream.recv()`.
+        """
+        while True:
+            while not await self.poll():
+                pass
+            try:
+                return self.stream._recv_nowait(**kargs)
+            except zmq.Again:
+                # the other channel groups of this chunk have not arrived yet
+                continue
+
+    async def recv_all(self, **kargs):
+        """Wait for at least one packet, then receive all packets that are
+        already waiting.
+
+        See :func:`InputStream.recv_all()`.
+        """
+        while True:
+            while not await self.poll():
+                pass
+            packets = self.stream.recv_all(**kargs)
+            if packets[0] is not None:
+                return packets
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.recv()
+
+    def set_buffer(self, *args, **kargs):
+        """Attach a RingBuffer to this stream; see :func:`InputStream.set_buffer()`.
+        """
+        return self.stream.set_buffer(*args, **kargs)
+
+    def get_data(self, *args, **kargs):
+        """Return a segment of the attached RingBuffer; see :func:`InputStream.get_data()`.
+        """
+        return self.stream.get_data(*args, **kargs)
+
+    def __getitem__(self, *args):
+        return self.stream.__getitem__(*args)
+
+    def close(self):
+        """Close the stream.
+        """
+        self.stream.close()
+        self._socket = None
+
+
+class AsyncOutputStream(object):
+    """OutputStream for use with asyncio.
+
+    This wraps an :class:`OutputStream`; ``await send()`` waits on the event
+    loop until the socket can accept the chunk. This applies backpressure to
+    streams configured with ``lossless=True``; other streams never block
+    (chunks are dropped for subscribers that are too slow), but producers can
+    be written the same way in both cases.
+
+    The wrapped stream is available as the ``stream`` attribute; it is what
+    InputStreams (and AsyncInputStreams) connect to.
+    """
+    def __init__(self, spec=None, node=None, name=None):
+        self.stream = OutputStream(spec=spec, node=node, name=name)
+        self._socket = None
+
+    @property
+    def params(self):
+        return self.stream.params
+
+    @property
+    def last_index(self):
+        return self.stream.last_index
+
+    def configure(self, **kargs):
+        """Configure the output stream; see :func:`OutputStream.configure()`.
+        """
+        self.stream.configure(**kargs)
+        self._socket = None
+
+    async def send(self, data, index=None, **kargs):
+        """Send a data chunk and its frame index, waiting until the socket is
+        ready.
+
+        See :func:`OutputStream.send()`.
+        """
+        if self.stream.sender is not None:
+            if self._socket is None:
+                # created lazily: 'auto' streams bind when an input connects
+                self._socket = zmq.asyncio.Socket.from_socket(self.stream.socket)
+            while not await self._socket.poll(flags=zmq.POLLOUT):
+                pass
+        self.stream.send(data, index=index, **kargs)
+
+    def flush(self):
+        """See :func:`OutputStream.flush()`.
+        """
+        self.stream.flush()
+
+    def close(self):
+        """Close the output.
+        """
+        self.stream.close()
+        self._socket = None
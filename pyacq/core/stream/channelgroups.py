@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import zmq
+import numpy as np
+
+from .streamhelpers import DataSender, DataReceiver
+
+
+# Topics are fixed-width so that no topic is a prefix of another one.
+ALL_TOPIC = b'*all*'
+
+def group_topic(i):
+    return b'g%04d' % i
+
+
+def make_channel_groups(channel_groups, n_channels):
+    """Return the list of channel groups (lists of channel indices) for the
+    *channel_groups* stream parameter: either a group size, or a list of
+    groups.
+    """
+    if isinstance(channel_groups, int):
+        size = channel_groups
+        return [list(range(i, min(i + size, n_channels))) for i in range(0, n_channels, size)]
+    groups = [[int(c) for c in group] for group in channel_groups]
+    for group in groups:
+        for c in group:
+            if not 0 <= c < n_channels:
+                raise ValueError("Channel %d of channel_groups is out of range." % c)
+    return groups
+
+
+def group_params(params, group):
+    """Return the stream params used to send or receive one channel group.
+    """
+    n_channels = params['shape'][1]
+    gparams = dict(params)
+    gparams['shape'] = (params['shape'][0], len(group))
+    gparams['channel_groups'] = None
+    # per-channel parameters (such as a quantization scale)
+    for k in ('scale', 'offset'):
+        v = params.get(k, None)
+        if isinstance(v, (list, tuple, np.ndarray)) and len(v) == n_channels:
+            gparams[k] = [v[c] for c in group]
+    return gparams
+
+
+def check_channel_groups(params):
+    """Raise ValueError if *params* cannot be used with channel groups.
+    """
+    if len(params['shape']) != 2:
+        raise ValueError("channel_groups requires streams with shape (n_samples, n_channels).")
+    if params['transfermode'] in ('sharedmem', 'inprocobject', 'rawbytes'):
+        raise ValueError("channel_groups cannot be used with transfermode='%s'." % params['transfermode'])
+    if params.get('lossless', False) or params['protocol'] == 'multicast':
+        raise ValueError("channel_groups requires a publish/subscribe socket "
+                         "(not lossless=True or protocol='multicast').")
+
+
+class _TopicSocket:
+    # Socket seen by the sender / receiver of one topic: adds or removes the
+    # topic frame.
+    def __init__(self, socket, topic):
+        self.socket = socket
+        self.topic = topic
+        self.message = None
+
+    def send_multipart(self, parts, **kwds):
+        self.socket.send_multipart([self.topic] + list(parts), **kwds)
+
+    def send(self, data, **kwds):
+        self.send_multipart([data], **kwds)
+
+    def recv_multipart(self, **kwds):
+        message, self.message = self.message, None
+        return message
+
+    def recv(self, **kwds):
+        return self.recv_multipart()[0]
+
+
+class ChannelGroupSender(DataSender):
+    """Sender that publishes a stream as a whole and as groups of channels,
+    so that InputStreams can subscribe to a subset of channels.
+
+    Note: this class is usually not instantiated directly; use
+    ``OutputStream.configure(channel_groups=...)``.
+
+    The socket is a zmq.XPUB, which reports which topics have subscribers:
+    each chunk is only sent whole if an InputStream needs all channels, and
+    only for the channel groups that InputStreams subscribed to. Each group is
+    encoded by its own instance of *sender_class*, so that the network, memory
+    and decoding cost of a consumer scale with the channels it uses.
+    """
+    def __init__(self, socket, params, sender_class):
+        DataSender.__init__(self, socket, params)
+        self.groups = make_channel_groups(params['channel_groups'], params['shape'][1])
+        self.all_sender = sender_class(_TopicSocket(socket, ALL_TOPIC), params)
+        self.group_senders = [sender_class(_TopicSocket(socket, group_topic(i)), group_params(params, group))
+                              for i, group in enumerate(self.groups)]
+        self.group_indices = [np.array(group) for group in self.groups]
+        self.subscribed = set()
+
+    def _update_subscriptions(self):
+        # XPUB reports the first subscription and last unsubscription of each topic
+        while self.socket.poll(0):
+            msg = self.socket.recv()
+            if msg[:1] == b'\x01':
+                self.subscribed.add(msg[1:])
+            else:
+                self.subscribed.discard(msg[1:])
+
+    def send(self, index, data):
+        for f in self.funcs:
+            index, data = f(index, data)
+        self._update_subscriptions()
+        if ALL_TOPIC in self.subscribed:
+            self.all_sender.send(index, data)
+        for i, sender in enumerate(self.group_senders):
+            if group_topic(i) in self.subscribed:
+                sender.send(index, data[:, self.group_indices[i]])
+
+    def close(self):
+        self.all_sender.close()
+        for sender in self.group_senders:
+            sender.close()
+
+
+class ChannelGroupReceiver(DataReceiver):
+    """Receiver for streams sent by :class:`ChannelGroupSender`.
+
+    If *channels* is None, the whole stream is received. Otherwise only the
+    channel groups containing these channels are subscribed to, and chunks are
+    returned with only the requested channels, in the requested order.
+    """
+    def __init__(self, socket, params, receiver_class, channels=None):
+        DataReceiver.__init__(self, socket, params)
+        groups = make_channel_groups(params['channel_groups'], params['shape'][1])
+        if channels is None:
+            self.topics = [ALL_TOPIC]
+            self.receivers = {ALL_TOPIC: receiver_class(_TopicSocket(socket, ALL_TOPIC), params)}
+            self.take = None
+        else:
+            # smallest set of groups, in stream order, that covers the channels
+            needed = []
+            for c in channels:
+                if not any(c in groups[i] for i in needed):
+                    candidates = [i for i, g in enumerate(groups) if c in g]
+                    if len(candidates) == 0:
+                        raise ValueError("Channel %d is not part of any channel group." % c)
+                    needed.append(candidates[0])
+            needed.sort()
+            self.topics = [group_topic(i) for i in needed]
+            self.receivers = {group_topic(i): receiver_class(_TopicSocket(socket, group_topic(i)),
+                                                             group_params(params, groups[i]))
+                              for i in needed}
+            received = [c for i in needed for c in groups[i]]
+            take = [received.index(c) for c in channels]
+            self.take = None if take == list(range(len(received))) else np.array(take)
+        for topic in self.topics:
+            socket.setsockopt(zmq.SUBSCRIBE, topic)
+        self._parts = {}  # data received so far for the current index
+        self._index = None
+
+    def recv(self, return_data=True, flags=0):
+        # With flags=zmq.NOBLOCK, zmq.Again is raised if not all groups of the
+        # next chunk have arrived; the groups received so far are kept.
+        while True:
+            topic, *message = self.socket.recv_multipart(flags=flags)
+            receiver = self.receivers[topic]
+            receiver.socket.message = message
+            index, data = receiver.recv(return_data=True)
+            if len(self.topics) == 1:
+                break
+            if index != self._index:
+                # groups of a previous chunk that did not all arrive are dropped
+                self._parts = {}
+                self._index = index
+            self._parts[topic] = data
+            if len(self._parts) == len(self.topics):
+                data = np.concatenate([self._parts[t] for t in self.topics], axis=1)
+                self._parts = {}
+                self._index = None
+                break
+
+        if not return_data:
+            return index, None
+        if self.take is not None:
+            data = data[:, self.take]
+        return index, data
+
+    def close(self):
+        for receiver in self.receivers.values():
+            receiver.close()
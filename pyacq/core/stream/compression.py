@@ -1,3 +1,7 @@
+import zlib
+import numpy as np
+
+
 compression_methods = ['']
 
 
@@ -9,6 +13,18 @@ try:
 except ImportError:
     HAVE_BLOSC = False
 
+try:
+    import zstandard
+    HAVE_ZSTD = True
+except ImportError:
+    HAVE_ZSTD = False
+
+try:
+    import lz4.frame
+    HAVE_LZ4 = True
+except ImportError:
+    HAVE_LZ4 = False
+
 
 def compress(data, method, *args, **kwds):
     if method == '':
@@ -41,3 +57,224 @@ def _check_method(method):
             raise ValueError("Cannot use %s compression; blosc package is not importable." % method)
         else:
             raise ValueError('Unknown compression method "%s"' % method)
+
+
+# Codecs
+# ------
+# A codec method is a chain of filters followed by a compressor, joined with
+# '+', for example 'delta+shuffle+zstd-5'. Filters losslessly precondition
+# the array, and the compressor turns the result into bytes. The compressor
+# name may end with '-<level>'.
+#
+# Codecs are created once per sender / receiver (see get_codec()), so they can
+# keep compression contexts from one chunk to the next.
+# Each chunk is still encoded independently, so that receivers can join a
+# stream at any time and dropped packets do not corrupt later ones.
+
+all_codec_filters = {}
+all_codec_compressors = {}
+
+def register_codec_filter(name, filter_class):
+    """Register a filter that can be used in codec methods.
+
+    *filter_class* is called without arguments to create a filter with
+    ``encode(arr)`` and ``decode(arr)`` methods. Both take a C-contiguous array
+    with time on the first axis and return an array of the same shape and
+    dtype.
+    """
+    all_codec_filters[name] = filter_class
+
+
+def register_codec_compressor(name, compressor_class, available=True):
+    """Register a compressor that can be used in codec methods.
+
+    *compressor_class* is called with the compression level (or None for the
+    default) to create a compressor with ``compress(buf)`` and
+    ``decompress(buf)`` methods. If *available* is False (because a required
+    package is missing), methods using this compressor raise an error.
+    """
+    all_codec_compressors[name] = (compressor_class, available)
+
+
+class DeltaFilter:
+    """Replace each sample by its difference with the previous sample (per
+    channel). With *order* = 2 the difference is taken twice (second-order
+    prediction).
+
+    Differences are computed on the integer representation of the data, so
+    that the filter is lossless for floating point data as well.
+    """
+    def __init__(self, order=1):
+        self.order = order
+
+    def _int_view(self, arr):
+        if arr.dtype.kind in 'ui':
+            return arr
+        return arr.view('u%d' % arr.dtype.itemsize)
+
+    def encode(self, arr):
+        out = self._int_view(arr.copy())
+        for i in range(self.order):
+            out[1:] = out[1:] - out[:-1]
+        return out.view(arr.dtype)
+
+    def decode(self, arr):
+        out = self._int_view(arr)
+        for i in range(self.order):
+            out = np.cumsum(out, axis=0, dtype=out.dtype)
+        return out.view(arr.dtype)
+
+
+class ShuffleFilter:
+    """Group the bytes of all values by significance (byte shuffle), which
+    makes the high bytes of slowly varying signals very compressible.
+    """
+    def encode(self, arr):
+        itemsize = arr.dtype.itemsize
+        b = arr.reshape(-1).view('u1').reshape(-1, itemsize)
+        return np.ascontiguousarray(b.T).reshape(-1).view(arr.dtype).reshape(arr.shape)
+
+    def decode(self, arr):
+        itemsize = arr.dtype.itemsize
+        b = arr.reshape(-1).view('u1').reshape(itemsize, -1)
+        return np.ascontiguousarray(b.T).reshape(-1).view(arr.dtype).reshape(arr.shape)
+
+
+class BitShuffleFilter:
+    """Group the bits of all values by significance (bit shuffle).
+
+    The encoded array has one row of packed bits per bit of the dtype, so
+    this must be the last filter; the decoder is given the original dtype and
+    shape.
+    """
+    def encode(self, arr):
+        n = arr.size
+        bits = np.unpackbits(arr.reshape(-1).view('u1').reshape(n, arr.dtype.itemsize), axis=1)
+        return np.ascontiguousarray(np.packbits(bits.T, axis=1))
+
+    def decode(self, arr, dtype, shape):
+        n = int(np.prod(shape))
+        bits = np.unpackbits(arr.reshape(dtype.itemsize * 8, (n + 7) // 8), axis=1, count=n)
+        values = np.ascontiguousarray(np.packbits(bits.T, axis=1))
+        return values.reshape(-1).view(dtype).reshape(shape)
+
+
+register_codec_filter('delta', lambda: DeltaFilter(order=1))
+register_codec_filter('delta2', lambda: DeltaFilter(order=2))
+register_codec_filter('shuffle', ShuffleFilter)
+register_codec_filter('bitshuffle', BitShuffleFilter)
+
+
+class ZlibCompressor:
+    def __init__(self, level=None):
+        self.level = 1 if level is None else level
+
+    def compress(self, buf):
+        return zlib.compress(buf, self.level)
+
+    def decompress(self, buf):
+        return zlib.decompress(buf)
+
+
+class ZstdCompressor:
+    def __init__(self, level=None):
+        level = 3 if level is None else level
+        # Reusing contexts avoids reallocating their tables for every chunk.
+        self._cctx = zstandard.ZstdCompressor(level=level)
+        self._dctx = zstandard.ZstdDecompressor()
+
+    def compress(self, buf):
+        return self._cctx.compress(buf)
+
+    def decompress(self, buf):
+        return self._dctx.decompress(buf)
+
+
+class LZ4Compressor:
+    def __init__(self, level=None):
+        self.level = 0 if level is None else level
+
+    def compress(self, buf):
+        return lz4.frame.compress(buf, compression_level=self.level)
+
+    def decompress(self, buf):
+        return lz4.frame.decompress(buf)
+
+
+register_codec_compressor('zlib', ZlibCompressor)
+register_codec_compressor('zstd', ZstdCompressor, available=HAVE_ZSTD)
+register_codec_compressor('lz4', LZ4Compressor, available=HAVE_LZ4)
+
+_codec_packages = {'zstd': 'zstandard', 'lz4': 'lz4'}
+
+
+class Codec:
+    """Stateful encoder / decoder for one stream, created by get_codec().
+
+    ``encode(arr)`` takes a C-contiguous array and returns bytes;
+    ``decode(buf, dtype, shape)`` returns the original C-contiguous array.
+    """
+    def __init__(self, method):
+        *filter_names, comp = method.split('+')
+        self.method = method
+        self.filters = [all_codec_filters[name]() for name in filter_names]
+        if 'bitshuffle' in filter_names[:-1]:
+            raise ValueError("bitshuffle must be the last filter of a codec method")
+        name, _, level = comp.partition('-')
+        self.compressor = all_codec_compressors[name][0](int(level) if level else None)
+
+    def encode(self, arr):
+        for f in self.filters:
+            arr = f.encode(arr)
+        return self.compressor.compress(arr)
+
+    def decode(self, buf, dtype, shape):
+        arr = np.frombuffer(self.compressor.decompress(buf), dtype='u1')
+        if not any(isinstance(f, BitShuffleFilter) for f in self.filters):
+            arr = arr.view(dtype).reshape(shape)
+        for f in self.filters[::-1]:
+            if isinstance(f, BitShuffleFilter):
+                arr = f.decode(arr, dtype, shape)
+            else:
+                arr = f.decode(arr)
+        return arr
+
+
+def is_codec_method(method):
+    """Return True if *method* names a codec (see get_codec()) rather than
+    one of the plain compression methods.
+    """
+    if method == '' or method.startswith('blosc-'):
+        return False
+    *filter_names, comp = method.split('+')
+    name, _, level = comp.partition('-')
+    if name not in all_codec_compressors or (level and not level.lstrip('-').isdigit()):
+        return False
+    return all(f in all_codec_filters for f in filter_names)
+
+
+def get_codec(method):
+    """Return a new :class:`Codec` for *method*, or None if *method* is a
+    plain compression method (used with compress() / decompress()).
+
+    Codec methods are a '+'-separated chain of filters ('delta', 'delta2',
+    'shuffle', 'bitshuffle') ending with a compressor ('zlib', 'zstd', 'lz4'),
+    optionally followed by a compression level: for example 'zstd-9' or
+    'delta+shuffle+lz4'.
+    """
+    if not is_codec_method(method):
+        if method != '':
+            _check_method(method)
+        return None
+    comp = method.split('+')[-1].partition('-')[0]
+    if not all_codec_compressors[comp][1]:
+        raise ValueError("Cannot use %s compression; %s package is not importable." %
+                         (method, _codec_packages.get(comp, comp)))
+    return Codec(method)
+
+
+compression_methods.extend(['zlib', 'delta+shuffle+zlib'])
+if HAVE_ZSTD:
+    compression_methods.extend(['zstd', 'delta+shuffle+zstd', 'delta2+bitshuffle+zstd'])
+if HAVE_LZ4:
+    compression_methods.extend(['lz4', 'delta+shuffle+lz4'])
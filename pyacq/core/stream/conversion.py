@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import numpy as np
+
+from .arraytools import make_dtype
+
+
+def _coefs(value, default, n_channels):
+    # scale / offset stream parameter as a float or per-channel array
+    if value is None:
+        return default
+    value = np.asarray(value, dtype='float64')
+    if value.ndim == 0:
+        return float(value)
+    assert value.shape == (n_channels,), "scale and offset must be scalars or have one value per channel"
+    return value
+
+
+class ChunkConverter(object):
+    """Convert data chunks from the format of one stream to that of another.
+
+    The conversion is compiled once from the params of the input and output
+    streams into a short sequence of NumPy operations that write into
+    preallocated buffers, so that converting a chunk usually costs a single
+    pass over its memory:
+
+    * channel selection (*channels*; a contiguous range is a free view),
+    * rescaling between the *scale* / *offset* of both streams (the physical
+      value ``offset + scale * data`` is preserved),
+    * dtype conversion (rounded and clipped for integer outputs).
+
+    Transfer mode and buffer layout (axisorder, shared memory) are handled by
+    the output stream itself.
+
+    Parameters
+    ----------
+    in_params, out_params : dict
+        The params of the input and output streams. Only chunks with shape
+        ``(n_samples, n_channels)`` can be rescaled or have channels selected.
+    channels : list or None
+        The input channels to keep, in output order.
+    reuse_buffer : bool
+        If True (default), the array returned by :func:`convert()` is
+        overwritten by the next call. Use False unless the chunk is copied
+        before the next call: streams sent with zmq (``copy=False``) or
+        ``transfermode='inprocobject'`` keep a reference to sent chunks.
+    """
+    def __init__(self, in_params, out_params, channels=None, reuse_buffer=True):
+        self.in_dtype = make_dtype(in_params['dtype'])
+        self.out_dtype = make_dtype(out_params['dtype'])
+        self.reuse_buffer = reuse_buffer
+        in_shape = tuple(in_params['shape'][1:])
+        out_shape = tuple(out_params['shape'][1:])
+
+        # channel selection
+        self.take = None
+        if channels is not None:
+            channels = [int(c) for c in channels]
+            start = channels[0]
+            if channels == list(range(start, start + len(channels))):
+                self.take = slice(start, start + len(channels))
+            else:
+                self.take = np.array(channels)
+            in_shape = (len(channels),) + in_shape[1:]
+        if in_shape != out_shape:
+            raise ValueError("Cannot convert stream shape %s to %s%s." % (in_shape, out_shape,
+                             '' if channels is None else ' (with channels=%s)' % channels))
+
+        # rescaling: out = a * in + b
+        a, b = 1., 0.
+        if len(in_shape) == 1 and self.in_dtype.fields is None:
+            n_in = in_params['shape'][1]
+            in_scale = _coefs(in_params.get('scale'), 1., n_in)
+            in_offset = _coefs(in_params.get('offset'), 0., n_in)
+            if channels is not None:
+                in_scale = in_scale if np.isscalar(in_scale) else in_scale[channels]
+                in_offset = in_offset if np.isscalar(in_offset) else in_offset[channels]
+            out_scale = _coefs(out_params.get('scale'), 1., out_shape[0])
+            out_offset = _coefs(out_params.get('offset'), 0., out_shape[0])
+            a = np.asarray(in_scale / out_scale)
+            b = np.asarray((in_offset - out_offset) / out_scale)
+        self.gain = None if np.all(a == 1.) else a
+        self.bias = None if np.all(b == 0.) else b
+        if self.take is not None and not isinstance(self.take, slice) and self.in_dtype.fields is not None:
+            raise ValueError("Cannot select channels of a structured dtype.")
+
+        rescale = self.gain is not None or self.bias is not None
+        self.round = rescale and self.out_dtype.kind in 'iub'
+        if self.round:
+            info = np.iinfo(self.out_dtype)
+            self.limits = (info.min, info.max)
+        # the rescaling is computed in this dtype
+        self.work_dtype = self.out_dtype if self.out_dtype.kind in 'fc' else np.dtype('float64')
+
+        self.steps = []
+        if self.take is not None:
+            self.steps.append('select')
+        if rescale:
+            self.steps.append('rescale')
+        if self.in_dtype != self.out_dtype:
+            self.steps.append('astype')
+
+        self._buffers = {}
+
+    def _buffer(self, name, shape, dtype):
+        # preallocated buffer, grown when a larger chunk arrives
+        buf = self._buffers.get(name)
+        if not self.reuse_buffer or buf is None or buf.shape[0] < shape[0] or buf.shape[1:] != shape[1:]:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf[:shape[0]]
+
+    def convert(self, data):
+        """Return *data* converted to the output format.
+
+        If no conversion is needed, *data* itself is returned.
+        """
+        if len(self.steps) == 0:
+            return data
+
+        # channel selection
+        if isinstance(self.take, slice):
+            src = data[:, self.take]
+        elif self.take is not None:
+            shape = (data.shape[0], len(self.take)) + data.shape[2:]
+            if self.steps == ['select']:
+                return np.take(data, self.take, axis=1, out=self._buffer('out', shape, self.out_dtype))
+            src = np.take(data, self.take, axis=1, out=self._buffer('select', shape, self.in_dtype))
+        else:
+            src = data
+
+        # rescaling and dtype conversion
+        out = self._buffer('out', src.shape, self.out_dtype)
+        if self.gain is None and self.bias is None:
+            np.copyto(out, src, casting='unsafe')
+            return out
+        work = self._buffer('work', src.shape, self.work_dtype) if self.round else out
+        if self.gain is not None:
+            np.multiply(src, self.gain, out=work, casting='unsafe')
+            if self.bias is not None:
+                np.add(work, self.bias, out=work, casting='unsafe')
+        else:
+            np.add(src, self.bias, out=work, casting='unsafe')
+        if self.round:
+            np.rint(work, out=work)
+            np.clip(work, *self.limits, out=work)
+            np.copyto(out, work, casting='unsafe')
+        return out
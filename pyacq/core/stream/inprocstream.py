@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import random
+import string
+import struct
+import threading
+import collections
+import numpy as np
+
+from .streamhelpers import DataSender, DataReceiver, register_transfermode
+
+
+# Senders of this process, by channel name. Each channel holds one queue per
+# connected receiver.
+_channels = {}
+_channels_lock = threading.Lock()
+
+# (sequence number, index) sent over the socket for each chunk
+_notify_struct = struct.Struct('<QQ')
+
+
+class InprocObjectSender(DataSender):
+    """Stream sender that passes data chunks by reference to InputStreams
+    living in the same process.
+
+    Note: this class is usually not instantiated directly; use
+    ``OutputStream.configure(transfermode='inprocobject')``.
+
+    Each chunk is appended to an in-process queue for every connected
+    receiver, and only its index is sent over the socket, so that
+    ``poll()``/``recv()`` work as for other transfer modes. Arrays are not
+    serialized or copied; receivers get a read-only view of the array that was
+    sent, so the sender must not modify an array after sending it (or use
+    ``copy=True``). Any python object can be sent.
+
+    Extra parameters accepted when configuring the output stream:
+
+    * copy (bool) if True, arrays are copied before being sent. Default is False.
+    * object_queue_size (int) maximum number of chunks held for a receiver
+      that does not keep up. Default is 4096. Receivers that fall further
+      behind lose the oldest chunks, as with the socket high-water mark of
+      other transfer modes (see *sndhwm*, which may not be larger than
+      *object_queue_size*).
+    """
+    def __init__(self, socket, params):
+        DataSender.__init__(self, socket, params)
+        queue_size = self.params.get('object_queue_size', 4096)
+        sndhwm = self.params.get('sndhwm', None)
+        if sndhwm is not None and sndhwm > queue_size:
+            raise ValueError("sndhwm (%d) cannot be larger than object_queue_size (%d) with "
+                             "transfermode='inprocobject'." % (sndhwm, queue_size))
+        self.channel = 'pyacq_objects_' + ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(16))
+        self.params['object_channel'] = self.channel
+        self.queues = []
+        self._seq = 0
+        with _channels_lock:
+            _channels[self.channel] = self
+
+    def send(self, index, data):
+        # optional pre-processing before send
+        if isinstance(data, np.ndarray):
+            for f in self.funcs:
+                index, data = f(index, data)
+            if self.params.get('copy', False):
+                data = data.copy()
+            else:
+                data = data.view()
+            data.flags.writeable = False
+
+        # queues first, so that the chunk is available when the index arrives
+        self._seq += 1
+        for queue in self.queues:
+            queue.append((self._seq, data))
+        self.socket.send(_notify_struct.pack(self._seq, index))
+
+    def close(self):
+        with _channels_lock:
+            _channels.pop(self.channel, None)
+        self.queues = []
+
+
+class InprocObjectReceiver(DataReceiver):
+    """Helper class to receive data chunks by reference.
+
+    See InprocObjectSender. Chunks that were discarded from the queue because
+    the receiver fell behind are skipped and counted in *discarded_chunks*.
+    """
+    def __init__(self, socket, params):
+        DataReceiver.__init__(self, socket, params)
+        with _channels_lock:
+            sender = _channels.get(self.params['object_channel'], None)
+            if sender is None:
+                raise ValueError("transfermode='inprocobject' streams can only be received in the "
+                                 "process of their OutputStream.")
+            self.queue = collections.deque(maxlen=self.params.get('object_queue_size', 4096))
+            self._sender = sender
+            # copy-on-write, so the sender can iterate the list without locking
+            sender.queues = sender.queues + [self.queue]
+        self.discarded_chunks = 0
+
+    def recv(self, return_data=True):
+        queue = self.queue
+        while True:
+            seq, index = _notify_struct.unpack(self.socket.recv())
+            # Chunks queued before the subscription was active have no
+            # notification; skip them.
+            while len(queue) > 0 and queue[0][0] < seq:
+                queue.popleft()
+            if len(queue) > 0 and queue[0][0] == seq:
+                data = queue.popleft()[1]
+                break
+            # The receiver fell more than object_queue_size chunks behind and
+            # this chunk was discarded; the notifications of the newer chunks
+            # still in the queue follow.
+            self.discarded_chunks += 1
+
+        if not return_data:
+            return index, None
+        return index, data
+
+    def close(self):
+        with _channels_lock:
+            sender = self._sender
+            sender.queues = [q for q in sender.queues if q is not self.queue]
+        self.queue.clear()
+
+
+register_transfermode('inprocobject', InprocObjectSender, InprocObjectReceiver)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import sys
+import time
+import random
+import socket
+import select
+import struct
+import collections
+import ipaddress
+import zmq
+
+
+# Each message is sent as one or more datagrams with this header:
+#   session id (uint32), sequence number (uint64), fragment number (uint16),
+#   fragment count (uint16)
+# The session id is chosen randomly by each sending socket, so that receivers
+# can tell when a sender restarts its sequence numbers.
+_fragment_struct = struct.Struct('<IQHH')
+# The message itself starts with the number of parts and their sizes.
+_nparts_struct = struct.Struct('<H')
+
+
+def is_multicast_address(address):
+    """Return True if *address* is an IPv4 multicast group address.
+    """
+    try:
+        return ipaddress.IPv4Address(address).is_multicast
+    except ValueError:
+        return False
+
+
+def free_udp_port():
+    """Return a UDP port number that is currently unused.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+class MulticastSocket(object):
+    """UDP multicast socket used by streams with ``protocol='multicast'``.
+
+    This implements the small part of the zmq socket API used by stream
+    senders and receivers (``send()``, ``send_multipart()``, ``recv()``,
+    ``recv_multipart()``, ``poll()`` and ``close()``), so that all transfer
+    modes that do not rely on a local resource (not 'sharedmem' or
+    'inprocobject') can be used over multicast. Each chunk is sent once,
+    whatever the number of receivers.
+
+    Messages are split into datagrams of at most *max_datagram* bytes, each
+    carrying the message sequence number and a random session id of the
+    sending socket. Receivers reassemble them and count lost messages in
+    ``dropped`` (a message is lost if any of its datagrams is). There is no
+    retransmission. When a new sender (or a restarted one) sends to the
+    group, receivers start again from its first message.
+
+    Parameters
+    ----------
+    mode : 'send' or 'recv'
+        Whether this socket sends to or receives from the group.
+    group : str
+        The multicast group address, for example '239.255.0.1'.
+    port : int
+        The UDP port.
+    interface : str
+        Address of the local network interface used to send or join the
+        group. The default ('0.0.0.0') lets the system choose.
+    ttl : int
+        Time-to-live of sent datagrams (number of routers they may cross).
+    loop : bool
+        Whether sent datagrams are also delivered to receivers on this host.
+    max_datagram : int
+        Maximum size of sent datagrams, including headers. The default fits
+        in a standard ethernet frame.
+    rcvbuf : int or None
+        Requested size (in bytes) of the kernel receive buffer.
+    """
+    def __init__(self, mode, group, port, interface='0.0.0.0', ttl=1, loop=True, max_datagram=1400,
+                 rcvbuf=None):
+        assert mode in ('send', 'recv')
+        if not is_multicast_address(group):
+            raise ValueError("'%s' is not a multicast group address (224.0.0.0 to 239.255.255.255)." % group)
+        self.mode = mode
+        self.group = group
+        self.port = int(port)
+        self.max_datagram = max_datagram
+        self.dropped = 0
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if mode == 'send':
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(loop))
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+            self._seq = 0
+            self._session = random.SystemRandom().getrandbits(32)
+        else:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if rcvbuf is not None:
+                self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            # binding to the group filters out other groups on the same port (not possible on Windows)
+            self._sock.bind(('' if sys.platform.startswith('win') else group, self.port))
+            mreq = socket.inet_aton(group) + socket.inet_aton(interface)
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            self._sock.setblocking(False)
+            self._ready = collections.deque()  # complete messages
+            self._session = None  # session id of the sender
+            self._seq = None  # message being assembled
+            self._fragments = None
+            self._last_seq = None  # last complete message
+
+    @property
+    def buffered(self):
+        """Number of complete messages that can be received without reading
+        the socket.
+        """
+        return len(self._ready)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def getsockopt(self, opt):
+        if opt == zmq.LAST_ENDPOINT:
+            return ('multicast://%s:%d' % (self.group, self.port)).encode()
+        raise ValueError("Unsupported socket option %s" % opt)
+
+    def send(self, data, flags=0, copy=True):
+        self.send_multipart([data], flags=flags, copy=copy)
+
+    def send_multipart(self, parts, flags=0, copy=True):
+        parts = [memoryview(p).cast('B') for p in parts]
+        msg = b''.join([_nparts_struct.pack(len(parts)), struct.pack('<%dQ' % len(parts), *[len(p) for p in parts])] + parts)
+
+        size = self.max_datagram - _fragment_struct.size
+        n_frags = max(1, -(-len(msg) // size))
+        if n_frags > 0xffff:
+            raise ValueError("Message too large for multicast (%d bytes)." % len(msg))
+        self._seq += 1
+        msg = memoryview(msg)
+        for i in range(n_frags):
+            header = _fragment_struct.pack(self._session, self._seq, i, n_frags)
+            self._sock.sendmsg([header, msg[i*size:(i+1)*size]], [], 0, (self.group, self.port))
+
+    def poll(self, timeout=None, flags=zmq.POLLIN):
+        """Wait until a complete message is available, or *timeout* ms have
+        elapsed. Return zmq.POLLIN if a message is available, 0 otherwise.
+        """
+        if self.mode == 'send':
+            return zmq.POLLOUT if flags & zmq.POLLOUT else 0
+        if timeout is not None:
+            deadline = time.perf_counter() + timeout / 1000.
+        while len(self._ready) == 0:
+            self._read_available()
+            if len(self._ready) > 0:
+                break
+            if timeout is None:
+                wait = None
+            else:
+                wait = deadline - time.perf_counter()
+                if wait <= 0:
+                    break
+            select.select([self._sock], [], [], wait)
+        return zmq.POLLIN if len(self._ready) > 0 else 0
+
+    def recv_multipart(self, flags=0, copy=True):
+        if len(self._ready) == 0:
+            if flags & zmq.NOBLOCK:
+                if not self.poll(0):
+                    raise zmq.Again()
+            else:
+                self.poll(None)
+        return self._ready.popleft()
+
+    def recv(self, flags=0, copy=True):
+        return self.recv_multipart(flags=flags, copy=copy)[0]
+
+    def _read_available(self):
+        while True:
+            try:
+                datagram = self._sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            if len(datagram) < _fragment_struct.size:
+                continue
+            session, seq, i, n_frags = _fragment_struct.unpack_from(datagram)
+            if session != self._session:
+                # new sender: its sequence numbers start over
+                self._session = session
+                self._seq = None
+                self._fragments = None
+                self._last_seq = None
+            if seq != self._seq:
+                if (self._seq is not None and seq < self._seq) or \
+                        (self._last_seq is not None and seq <= self._last_seq):
+                    # late datagram of a message that was completed or given up
+                    continue
+                # start a new message; an incomplete previous one is lost
+                self._seq = seq
+                self._fragments = [None] * n_frags
+                self._missing = n_frags
+            elif self._fragments is None:
+                continue
+            if self._fragments[i] is None:
+                self._fragments[i] = datagram[_fragment_struct.size:]
+                self._missing -= 1
+            if self._missing == 0:
+                self._ready.append(self._unpack(b''.join(self._fragments)))
+                self._fragments = None
+                if self._last_seq is not None:
+                    self.dropped += seq - self._last_seq - 1
+                self._last_seq = seq
+
+    def _unpack(self, msg):
+        nparts = _nparts_struct.unpack_from(msg)[0]
+        pos = _nparts_struct.size
+        sizes = struct.unpack_from('<%dQ' % nparts, msg, pos)
+        pos += 8 * nparts
+        parts = []
+        for size in sizes:
+            parts.append(msg[pos:pos+size])
+            pos += size
+        return parts
+
+    def close(self, linger=None):
+        self._sock.close()
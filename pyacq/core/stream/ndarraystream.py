@@ -3,11 +3,28 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 import struct
+import json
 import zmq
 import numpy as np
 
 from .streamhelpers import DataSender, DataReceiver, register_transfermode
-from .arraytools import make_dtype
+
+
+# Header layout (version 2), little-endian:
+#   version (uint8, =2), ndim (uint8), 6 padding bytes, index (uint64),
+#   shape (ndim * uint64), followed by the dtype string (ascii).
+# Version 1 headers were JSON dicts and start with b'{'.
+HEADER_VERSION = 2
+_header_structs = {}
+
+def _header_struct(ndim):
+    # precompiled header Struct for arrays with *ndim* dimensions
+    st = _header_structs.get(ndim)
+    if st is None:
+        st = struct.Struct('<BB6xQ' + 'Q' * ndim)
+        _header_structs[ndim] = st
+    return st
+
 
 class NdarrayDataSender(DataSender):
     """Helper class to send data serialized over socket.
@@ -19,6 +36,11 @@ class NdarrayDataSender(DataSender):
     sent exactly as it appears in memory including array strides.
     
     """
+    def __init__(self, socket, params):
+        DataSender.__init__(self, socket, params)
+        self._last_dtype = None
+        self._dtype_bytes = None
+
     def send(self, index, data):
         # optional pre-processing before send
         if isinstance(data, np.ndarray):
@@ -26,14 +48,15 @@ class NdarrayDataSender(DataSender):
                 index, data = f(index, data)
                 
         """send a numpy array with metadata"""
-        md = dict(
-            dtype = str(data.dtype),
-            shape = data.shape,
-            index = index,
-        )
+        dtype = data.dtype
+        if dtype is not self._last_dtype:
+            self._dtype_bytes = str(dtype).encode('ascii')
+            self._last_dtype = dtype
+        ndim = data.ndim
+        md = _header_struct(ndim).pack(HEADER_VERSION, ndim, index, *data.shape) + self._dtype_bytes
         flags = 0
         copy = self.params.get('copy', True)
-        self.socket.send_json(md, flags|zmq.SNDMORE)
+        self.socket.send(md, flags|zmq.SNDMORE)
         self.socket.send(data, flags, copy=copy)
 
 
@@ -44,23 +67,37 @@ class NdarrayDataReceiver(DataReceiver):
     """
     def __init__(self, socket, params):
         DataReceiver.__init__(self, socket, params)
+        # dtype strings already seen in headers
+        self._dtypes = {}
     
     def recv(self, return_data=True):
         """recv a numpy array"""
         flags = 0
-        md = self.socket.recv_json(flags=flags)
+        md = self.socket.recv(flags=flags)
         msg = self.socket.recv(flags=flags)
-        # buf = buffer(msg)
-        # convert to array
-        dtype = make_dtype(self.params['dtype']) # this avoid some bugs but is not efficient because this is call every sends...
-        # dtype = self.params['dtype']     
-        data = np.frombuffer(msg, dtype=md['dtype'])
-        index = md['index']
-        data = data.reshape(md['shape'])
+        if md[0] == HEADER_VERSION:
+            ndim = md[1]
+            st = _header_struct(ndim)
+            header = st.unpack_from(md)
+            index = header[2]
+            shape = header[3:]
+            dtype = md[st.size:]
+        else:
+            # version 1 header
+            md = json.loads(md)
+            index = md['index']
+            shape = md['shape']
+            dtype = md['dtype']
 
         if not return_data:
             return index, None
 
+        # convert to array
+        dt = self._dtypes.get(dtype)
+        if dt is None:
+            dt = np.dtype(dtype if isinstance(dtype, str) else dtype.decode('ascii'))
+            self._dtypes[dtype] = dt
+        data = np.frombuffer(msg, dtype=dt).reshape(shape)
         return index, data
 
 
@@ -6,8 +6,25 @@ import struct
 import numpy as np
 
 from .streamhelpers import DataSender, DataReceiver, register_transfermode
-from .arraytools import is_contiguous, decompose_array, make_dtype
-from .compression import compress, decompress
+from .arraytools import is_contiguous, decompose_array
+from .compression import compress, decompress, get_codec
+
+
+# Header layout (version 2), little-endian:
+#   version (uint8, =2), ndim (uint8), 6 padding bytes,
+#   index (uint64), offset (uint64), shape (ndim * uint64), strides (ndim * int64)
+# Version 1 headers started with ndim as a big-endian uint64, so their first
+# byte is always 0.
+HEADER_VERSION = 2
+_header_structs = {}
+
+def _header_struct(ndim):
+    # precompiled header Struct for arrays with *ndim* dimensions
+    st = _header_structs.get(ndim)
+    if st is None:
+        st = struct.Struct('<BB6xQQ' + 'Q' * ndim + 'q' * ndim)
+        _header_structs[ndim] = st
+    return st
 
 
 class PlainDataSender(DataSender):
@@ -19,8 +36,14 @@ class PlainDataSender(DataSender):
     To avoid unnecessary copies (and thus optimize transmission speed), data is
     sent exactly as it appears in memory including array strides.
     
-    This class supports compression.
+    This class supports compression, including the codecs of
+    :func:`compression.get_codec() <pyacq.core.stream.compression.get_codec>`
+    (for which data is first made C-contiguous).
     """
+    def __init__(self, socket, params):
+        DataSender.__init__(self, socket, params)
+        self.codec = get_codec(self.params['compression'])
+
     def send(self, index, data):
         # optional pre-processing before send
         if isinstance(data, np.ndarray):
@@ -28,16 +51,22 @@ class PlainDataSender(DataSender):
                 index, data = f(index, data)
                 
         # serialize
+        if self.codec is not None:
+            data = np.ascontiguousarray(data)
         dtype = data.dtype
         shape = data.shape
         buf, offset, strides = decompose_array(data)
         
         # compress
-        comp = self.params['compression']
-        buf = compress(buf, comp, data.itemsize)
+        if self.codec is not None:
+            buf = self.codec.encode(buf)
+        else:
+            comp = self.params['compression']
+            buf = compress(buf, comp, data.itemsize)
         
         # Pack and send
-        stat = struct.pack('!' + 'Q' * (3+len(shape)) + 'q' * len(strides), len(shape), index, offset, *(shape + strides))
+        ndim = len(shape)
+        stat = _header_struct(ndim).pack(HEADER_VERSION, ndim, index, offset, *(shape + strides))
         copy = self.params.get('copy', False)
         self.socket.send_multipart([stat, buf], copy=copy)
 
@@ -49,12 +78,18 @@ class PlainDataReceiver(DataReceiver):
     """
     def __init__(self, socket, params):
         DataReceiver.__init__(self, socket, params)
+        self.codec = get_codec(self.params['compression'])
     
     def recv(self, return_data=True):
         # receive and unpack structure
         stat, data = self.socket.recv_multipart()
-        ndim = struct.unpack('!Q', stat[:8])[0]
-        stat = struct.unpack('!' + 'Q' * (ndim + 2) + 'q' * ndim, stat[8:])
+        if stat[0] == HEADER_VERSION:
+            ndim = stat[1]
+            stat = _header_struct(ndim).unpack(stat)[2:]
+        else:
+            # version 1 header
+            ndim = struct.unpack('!Q', stat[:8])[0]
+            stat = struct.unpack('!' + 'Q' * (ndim + 2) + 'q' * ndim, stat[8:])
         index = stat[0]
         
         if not return_data:
@@ -62,17 +97,18 @@ class PlainDataReceiver(DataReceiver):
         
         offset = stat[1]
         shape = stat[2:2+ndim]
-        strides = stat[-ndim:]
+        strides = stat[2+ndim:]
         
         # uncompress
-        comp = self.params['compression']
-        data = decompress(data, comp)
+        if self.codec is not None:
+            data = self.codec.decode(data, self.dtype, shape)
+        else:
+            comp = self.params['compression']
+            data = decompress(data, comp)
         
         # convert to array
-        dtype = make_dtype(self.params['dtype']) # this avoid some bugs but is not efficient because this is call every sends...
-        #~ dtype = self.params['dtype']
         data = np.ndarray(buffer=data, shape=shape,
-                          strides=strides, offset=offset, dtype=dtype)        
+                          strides=strides, offset=offset, dtype=self.dtype)
         return index, data
 
 
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import struct
+import numpy as np
+
+from .streamhelpers import DataSender, DataReceiver, register_transfermode
+
+
+# Header layout, little-endian:
+#   version (uint8, =2), ndim (uint8), flags (uint8), 1 padding byte,
+#   coefficients id (uint32), index (uint64), shape (ndim * uint64).
+# If flags has HAS_COEFS set, the header is followed by scale and offset
+# (2 * prod(shape[1:]) * float64).
+HEADER_VERSION = 2
+HAS_COEFS = 1
+_header_structs = {}
+
+def _header_struct(ndim):
+    # precompiled header Struct for arrays with *ndim* dimensions
+    st = _header_structs.get(ndim)
+    if st is None:
+        st = struct.Struct('<BBBxIQ' + 'Q' * ndim)
+        _header_structs[ndim] = st
+    return st
+
+
+def _quantize_dtype(params):
+    dtype = np.dtype(params.get('quantize_dtype', 'int16'))
+    if dtype.kind != 'i':
+        raise ValueError("quantize_dtype must be a signed integer type (got %s)" % dtype)
+    return dtype
+
+
+def _fixed_coefs(params):
+    # (scale, offset) configured in the stream parameters, or None if the
+    # scale is calibrated automatically
+    if params['scale'] is None:
+        return None
+    offset = params['offset']
+    return (np.asarray(params['scale'], dtype='float64'),
+            np.asarray(0. if offset is None else offset, dtype='float64'))
+
+
+class QuantizedDataSender(DataSender):
+    """Helper class to send floating point data quantized to small integers.
+    
+    Note: this class is usually not instantiated directly; use
+    ``OutputStream.configure(transfermode='quantized')``.
+    
+    Each value is sent as ``round((value - offset) / scale)``, and received as
+    ``offset + scale * quantized``, so the error is at most ``scale / 2``.
+    This halves (int16) or quarters (int8) the size of float32 data, and is
+    intended for consumers that do not need full precision, such as viewers.
+    NaN values are preserved.
+    
+    Extra parameters accepted when configuring the output stream:
+    
+    * quantize_dtype (str) 'int16' (default) or 'int8'.
+    * scale, offset (float or list of floats, one per channel) if *scale* is
+      given, values are quantized with this fixed scale and offset (default
+      0), and values outside the representable range are clipped. Receivers
+      read them from the stream parameters, so packets do not carry them.
+      If *scale* is None (default), scale and offset are calibrated for each
+      channel from the range of the data, so that no value is clipped. They
+      are kept while the following chunks fit in the range with at most
+      3 times the smallest possible scale, and are only sent in the packets
+      where they change, and every *coefs_interval* packets.
+    * coefs_interval (int) with an automatic scale, the number of packets
+      after which the coefficients are sent again even if they did not
+      change, so that receivers connected later can decode the stream
+      (default 100).
+    """
+    # headroom given to a new automatic calibration, and largest ratio to the
+    # smallest possible scale before the data is calibrated again
+    _auto_headroom = 1.5
+    _auto_max_ratio = 3.
+    
+    def __init__(self, socket, params):
+        DataSender.__init__(self, socket, params)
+        self.qdtype = _quantize_dtype(self.params)
+        self.qmax = np.iinfo(self.qdtype).max
+        # the smallest integer marks NaN values
+        self.qnan = np.iinfo(self.qdtype).min
+        
+        coefs = _fixed_coefs(self.params)
+        self.auto_scale = coefs is None
+        if self.auto_scale:
+            self.scale = None
+            self.offset = None
+        else:
+            self.scale, self.offset = coefs
+        self.coefs_interval = self.params.get('coefs_interval', 100)
+        # id of the current automatic calibration, and number of packets sent
+        # since its coefficients were last sent
+        self._coefs_id = 0
+        self._coefs_age = 0
+
+    def _calibrate(self, data, frame_shape):
+        # Return True if the automatic scale and offset were recomputed
+        if data.shape[0] == 0:
+            if self.scale is not None and self.scale.shape == frame_shape:
+                return False
+            # no range to compute for an empty chunk
+            self.scale = np.ones(frame_shape)
+            self.offset = np.zeros(frame_shape)
+            return True
+        
+        # fmin/fmax ignore NaN
+        lo = np.fmin.reduce(data, axis=0).astype('float64')
+        hi = np.fmax.reduce(data, axis=0).astype('float64')
+        needed = (hi - lo) / (2 * self.qmax)
+        
+        if self.scale is not None and self.scale.shape == frame_shape:
+            lim = self.qmax * self.scale
+            with np.errstate(invalid='ignore'):
+                fits = ((lo >= self.offset - lim) & (hi <= self.offset + lim) &
+                        (self.scale <= needed * self._auto_max_ratio))
+                # constant channels are only exact at the offset
+                fits |= (needed == 0) & (lo == self.offset)
+            fits |= np.isnan(lo)  # all-NaN channels
+            if np.all(fits):
+                return False
+        
+        self.offset = (hi + lo) / 2
+        self.scale = needed * self._auto_headroom
+        invalid = ~(self.scale > 0)  # constant or all-NaN channels
+        self.scale[invalid] = 1.
+        self.offset[np.isnan(self.offset)] = 0.
+        return True
+
+    def send(self, index, data):
+        # optional pre-processing before send
+        if isinstance(data, np.ndarray):
+            for f in self.funcs:
+                index, data = f(index, data)
+        
+        frame_shape = data.shape[1:]
+        flags = 0
+        if self.auto_scale:
+            if self._calibrate(data, frame_shape):
+                self._coefs_id = (self._coefs_id + 1) & 0xffffffff
+                self._coefs_age = 0
+            if self._coefs_age == 0:
+                flags = HAS_COEFS
+            self._coefs_age = (self._coefs_age + 1) % self.coefs_interval
+        scale = np.broadcast_to(self.scale, frame_shape)
+        offset = np.broadcast_to(self.offset, frame_shape)
+        
+        q = (data - offset) / scale
+        np.rint(q, out=q)
+        np.clip(q, -self.qmax, self.qmax, out=q)
+        nans = np.isnan(q)
+        q[nans] = 0
+        q = q.astype(self.qdtype, order='C')  # sent as a raw C-ordered buffer
+        q[nans] = self.qnan
+        
+        header = _header_struct(data.ndim).pack(HEADER_VERSION, data.ndim, flags, self._coefs_id,
+                                                index, *data.shape)
+        if flags & HAS_COEFS:
+            coefs = np.concatenate([np.ravel(scale), np.ravel(offset)]).astype('<f8')
+            header += coefs.tobytes()
+        self.socket.send_multipart([header, q])
+
+
+class QuantizedDataReceiver(DataReceiver):
+    """Helper class to receive quantized data and restore it to the stream
+    dtype.
+    
+    With an automatic scale, the chunks received before the first packet
+    carrying coefficients, or after a packet carrying new ones was lost,
+    cannot be decoded: they are returned filled with NaN (0 for integer
+    dtypes) and counted in *undecodable_chunks*.
+    
+    See QuantizedDataSender.
+    """
+    def __init__(self, socket, params):
+        DataReceiver.__init__(self, socket, params)
+        self.qdtype = _quantize_dtype(self.params)
+        self.qnan = np.iinfo(self.qdtype).min
+        # id and value of the last coefficients received; fixed coefficients
+        # have id 0
+        coefs = _fixed_coefs(self.params)
+        self._coefs_id = None if coefs is None else 0
+        self._coefs = coefs
+        self.undecodable_chunks = 0
+    
+    def recv(self, return_data=True):
+        header, buf = self.socket.recv_multipart()
+        ndim = header[1]
+        flags = header[2]
+        st = _header_struct(ndim)
+        values = st.unpack_from(header)
+        coefs_id = values[3]
+        index = values[4]
+        shape = values[5:]
+        frame_shape = shape[1:]
+        
+        if flags & HAS_COEFS:
+            n = int(np.prod(frame_shape))
+            coefs = np.frombuffer(header, dtype='<f8', count=2*n, offset=st.size)
+            self._coefs = (coefs[:n].reshape(frame_shape), coefs[n:].reshape(frame_shape))
+            self._coefs_id = coefs_id
+        
+        if not return_data:
+            return index, None
+        
+        data = np.empty(shape, dtype=self.dtype)
+        if coefs_id != self._coefs_id:
+            self.undecodable_chunks += 1
+            data.fill(np.nan if data.dtype.kind == 'f' else 0)
+            return index, data
+        scale = np.broadcast_to(self._coefs[0], frame_shape)
+        offset = np.broadcast_to(self._coefs[1], frame_shape)
+        
+        q = np.frombuffer(buf, dtype=self.qdtype).reshape(shape)
+        np.multiply(q, scale, out=data, casting='unsafe')
+        data += offset.astype(self.dtype)
+        if data.dtype.kind == 'f':
+            data[q == self.qnan] = np.nan
+        return index, data
+
+
+register_transfermode('quantized', QuantizedDataSender, QuantizedDataReceiver)
@@ -2,11 +2,9 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
-import struct
 import numpy as np
 
 from .streamhelpers import DataSender, DataReceiver, register_transfermode
-from .arraytools import make_dtype
 
 class RawBytesDataSender(DataSender):
     """Helper class to send data serialized over socket.
@@ -36,8 +34,6 @@ class RawBytesDataReceiver(DataReceiver):
         # receive and unpack structure
         buf, data = self.socket.recv_multipart()
         index = int.from_bytes(buf, byteorder='big')
-        dtype = make_dtype(self.params['dtype']) # this avoid some bugs but is not efficient because this is call every sends...
-        # dtype = self.params['dtype']
 
         if not return_data:
             return index, None
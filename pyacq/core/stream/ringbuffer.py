@@ -2,12 +2,25 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import math
+import mmap
+import time
 import numpy as np
 
-from .sharedarray import SharedMem, SharedArray
+from .sharedarray import SharedMem, SharedArray, MirroredSharedMem
 from .arraytools import make_dtype
 
 
+# Size of the shared header holding (read_index, write_index, write_seq, reserved)
+HEADER_SIZE = 32
+
+
+class RingBufferOverrun(IndexError):
+    """Raised when requested ring buffer data has been (or is being)
+    overwritten by newer data.
+    """
+
+
 class RingBuffer:
     """Class that collects data as it arrives from an InputStream and writes it
     into a single- or double-ring buffer.
@@ -16,10 +29,28 @@ class RingBuffer:
     received by the stream, up to a predefined length. Double ring buffers
     allow faster, copyless reads at the expense of doubled write time and memory
     footprint.
+    
+    With ``double='mirror'`` the buffer memory is mapped twice back-to-back in
+    virtual memory (see :class:`MirroredSharedMem`): reads are copyless like
+    a double buffer but each sample is written only once. In this mode the time
+    axis must come first in *axisorder*, and the buffer length is rounded up so
+    that the ring occupies a whole number of memory pages.
+    
+    If *shmem* is True, the buffer is allocated in a new shared memory block
+    that other processes can open by passing its ``shm_id`` as *shmem*.
+    *shm_options* is an optional dict of extra arguments (backend, hugepages,
+    populate) used to create the :class:`SharedMem` block.
+    
+    If *pyramid* is True (or a number of levels), a :class:`DecimationPyramid`
+    of min/max/mean values is updated as chunks arrive, and
+    :func:`get_decimated` can be used to read long windows at reduced
+    resolution. For shared buffers the pyramid is also in shared memory; its
+    ``shm_ids`` must then be passed as *pyramid* to open it in other
+    processes.
     """
-    def __init__(self, shape, dtype, double=True, shmem=None, fill=None, axisorder=None):
+    def __init__(self, shape, dtype, double=True, shmem=None, fill=None, axisorder=None, shm_options=None,
+                 pyramid=None):
         self.double = double
-        self.shape = shape
         # order of axes as written in memory. This does not affect the shape of the 
         # buffer as seen by the user, but can be used to make sure a specific axis
         # is contiguous in memory.
@@ -27,34 +58,71 @@ class RingBuffer:
             axisorder = np.arange(len(shape))
         self.axisorder = np.array(axisorder)
         
-        shape = (shape[0] * (2 if double else 1),) + shape[1:]
+        dtype = make_dtype(dtype)
+        if double == 'mirror':
+            if self.axisorder[0] != 0:
+                raise ValueError("RingBuffer with double='mirror' requires the time axis first in axisorder.")
+            # round the ring length up to a whole number of pages
+            frame_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+            quantum = mmap.PAGESIZE // math.gcd(frame_bytes, mmap.PAGESIZE)
+            shape = (-(-shape[0] // quantum) * quantum,) + tuple(shape[1:])
+        self.shape = shape
+        
+        shape = (shape[0] * (2 if double else 1),) + tuple(shape[1:])
         nativeshape = np.array(shape)[self.axisorder]
         
         # initialize int buffers with 0 and float buffers with nan
         if fill is None:
-            fill = 0 if make_dtype(dtype).kind in 'ui' else np.nan
+            fill = 0 if dtype.kind in 'ui' else np.nan
         self._filler = fill
         
-        if shmem is None:
-            self.buffer = np.empty(nativeshape, dtype=make_dtype(dtype)).transpose(np.argsort(axisorder))
+        if double == 'mirror':
+            shm_options = {} if shm_options is None else shm_options
+            nbytes = int(np.prod(self.shape)) * dtype.itemsize
+            if shmem in (None, True):
+                self._shmem = MirroredSharedMem(nbytes=nbytes, header_size=HEADER_SIZE, **shm_options)
+            else:
+                self._shmem = MirroredSharedMem(nbytes=nbytes, header_size=HEADER_SIZE, shm_id=shmem)
+            buf = self._shmem.data_to_numpy(dtype=dtype, shape=nativeshape)
+            self.buffer = buf.transpose(np.argsort(axisorder))
+            if shmem is None:
+                self.buffer[:self.shape[0]] = self._filler
+                self._indexes = np.zeros((4,), dtype='int64')
+                self.shm_id = None
+            else:
+                self._indexes = self._shmem.to_numpy(offset=0, dtype='int64', shape=(4,))
+                self.shm_id = self._shmem.shm_id
+        elif shmem is None:
+            self.buffer = np.empty(nativeshape, dtype=dtype).transpose(np.argsort(axisorder))
             self.buffer[:] = self._filler
-            self._indexes = np.zeros((2,), dtype='int64')
+            self._indexes = np.zeros((4,), dtype='int64')
             self._shmem = None
             self.shm_id = None
         else:
-            size = np.product(shape) * make_dtype(dtype).itemsize + 16
+            size = np.prod(shape) * dtype.itemsize + HEADER_SIZE
             if shmem is True:
                 # create new shared memory buffer
-                self._shmem = SharedMem(nbytes=size)
+                shm_options = {} if shm_options is None else shm_options
+                self._shmem = SharedMem(nbytes=size, **shm_options)
             else:
                 self._shmem = SharedMem(nbytes=size, shm_id=shmem)
-            buf = self._shmem.to_numpy(offset=16, dtype=dtype, shape=nativeshape)
+            buf = self._shmem.to_numpy(offset=HEADER_SIZE, dtype=dtype, shape=nativeshape)
             self.buffer = buf.transpose(np.argsort(axisorder))
-            self._indexes = self._shmem.to_numpy(offset=0, dtype='int64', shape=(2,))
+            self._indexes = self._shmem.to_numpy(offset=0, dtype='int64', shape=(4,))
             self.shm_id = self._shmem.shm_id
         
         self.dtype = self.buffer.dtype
         
+        if pyramid is None or pyramid is False:
+            self.pyramid = None
+        elif isinstance(pyramid, (list, tuple)):
+            self.pyramid = DecimationPyramid(self.shape, self.dtype, shmem=pyramid)
+        else:
+            levels = None if pyramid is True else int(pyramid)
+            self.pyramid = DecimationPyramid(self.shape, self.dtype, levels=levels,
+                                             shmem=None if shmem is None else True,
+                                             shm_options=shm_options)
+        
         if shmem in (None, True):
             # Index of last writable sample + 1. This value is used to determine which
             # buffer indices map to which data indices (where buffer indices wrap
@@ -72,6 +140,11 @@ class RingBuffer:
         #   2. new data is written over the old buffer data
         #   3. read_index is increased to indicate that the new data is now
         #      readable
+        # The whole sequence is bracketed by incrementing write_seq, which is
+        # odd while a write is in progress (a seqlock). Readers use it to take
+        # consistent snapshots of both indexes, and check write_index again
+        # after copying to detect data overwritten during the read (see
+        # get_data(validate=True)).
 
         #
         #              write_index-bsize     break_index      read_index       write_index
@@ -91,6 +164,20 @@ class RingBuffer:
     def first_index(self):
         return self._read_index - self.shape[0]
 
+    def _oldest_index(self, write_index=None):
+        # Oldest sample that is not (being) overwritten.
+        if write_index is None:
+            write_index = self._write_index
+        return write_index - self.shape[0]
+
+    def cursor(self, index=None):
+        """Return a new :class:`RingBufferCursor` that reads data from this
+        buffer starting at *index* (default is the current index).
+        
+        Each consumer of the buffer should use its own cursor.
+        """
+        return RingBufferCursor(self, index=index)
+
     @property
     def _write_index(self):
         return self._indexes[1]
@@ -99,14 +186,32 @@ class RingBuffer:
     def _read_index(self):
         return self._indexes[0]
 
+    @property
+    def _write_seq(self):
+        return self._indexes[2]
+
     def _set_write_index(self, i):
-        # what kind of protection do we need here?
+        # Only the writer modifies the indexes; readers are protected by
+        # write_seq and by checking write_index after reading.
         self._indexes[1] = i
 
     def _set_read_index(self, i):
-        # what kind of protection do we need here?
         self._indexes[0] = i
 
+    def _index_snapshot(self, max_retries=1000):
+        """Return (write_seq, read_index, write_index) read consistently
+        while no write was in progress.
+        """
+        for i in range(max_retries):
+            seq = int(self._indexes[2])
+            if seq % 2 == 0:
+                read_index = int(self._indexes[0])
+                write_index = int(self._indexes[1])
+                if int(self._indexes[2]) == seq:
+                    return seq, read_index, write_index
+            time.sleep(0)
+        raise RingBufferOverrun("Could not read a consistent ring buffer state after %d attempts." % max_retries)
+
     def new_chunk(self, data, index=None):
         dsize = data.shape[0]
         bsize = self.shape[0]
@@ -126,13 +231,14 @@ class RingBuffer:
                                                     (dsize, index-self._write_index)) 
 
         revert_inds = [self._read_index, self._write_index]
+        self._indexes[2] += 1
         try:
             # advance write index. This immediately prevents other processes from
             # accessing memory that is about to be overwritten.
             self._set_write_index(index)
             
             # decide if any skipped data needs to be filled in
-            fill_start = max(self._read_index, self._write_index - bsize)
+            fill_start = max(self._read_index, self._oldest_index())
             fill_stop = self._write_index - dsize
             
             if fill_stop > fill_start:
@@ -148,6 +254,11 @@ class RingBuffer:
             self._set_read_index(revert_inds[0])
             self._set_write_index(revert_inds[1])
             raise
+        finally:
+            self._indexes[2] += 1
+        
+        if self.pyramid is not None:
+            self.pyramid.update(self)
 
     def _write(self, start, stop, value):
         # get starting index
@@ -155,6 +266,11 @@ class RingBuffer:
         dsize = stop - start
         i = start % bsize
         
+        if self.double == 'mirror':
+            # the second half of the buffer maps the same memory as the first
+            self.buffer[i:i+dsize] = value
+            return
+        
         if self.double:
             self.buffer[i:i+dsize] = value
             i += bsize
@@ -190,7 +306,7 @@ class RingBuffer:
         
         return data
 
-    def get_data(self, start, stop, copy=False, join=True):
+    def get_data(self, start, stop, copy=False, join=True, validate=False, out=None, channels=None, dtype=None):
         """Return a segment of the ring buffer.
         
         Parameters
@@ -210,7 +326,40 @@ class RingBuffer:
             for the beginning and end of the requested segment. This can be
             used to avoid an unnecessary copy when the buffer has double=False
             and the caller does not require a contiguous array.
+        validate : bool
+            If True, the data is copied and then checked to have not been
+            overwritten by the writer (possibly in another process) while it
+            was being read. The requested segment must lie within
+            ``write_index - size`` and ``index()``; if it was (or would be)
+            overwritten, :class:`RingBufferOverrun` is raised. This makes
+            it safe to read large windows without locking. Default is False.
+        out : ndarray or None
+            If given, the segment is written into this array (of shape
+            ``(stop-start,) + channel shape``, any dtype and memory layout)
+            and *out* is returned. *copy* and *join* are then ignored.
+        channels : int, slice, list or None
+            Select channels (the second axis) to return. The selected channels
+            are gathered directly from the ring buffer into the output, without
+            first copying the other channels. An int removes the channel axis,
+            like ``data[:, channel]``.
+        dtype : dtype or None
+            If given, return the data cast to this dtype. The cast is done
+            while gathering the data.
+        
+        When any of *out*, *channels* or *dtype* is given, the result is
+        always a new (or the given) array filled in a single pass over the
+        requested data.
         """
+        if out is not None or channels is not None or dtype is not None:
+            read = lambda: self._gather(start, stop, out, channels, dtype)
+            if validate:
+                return self._get_validated_data(start, stop, read)
+            return read()
+        
+        if validate:
+            return self._get_validated_data(start, stop,
+                            lambda: self.get_data(start, stop, copy=True, join=join))
+        
         first, last = self.first_index(), self.index()
         if start < first or stop > last:
             raise IndexError("Requested segment (%d, %d) is out of bounds for ring buffer. "
@@ -261,6 +410,95 @@ class RingBuffer:
             empty = np.empty((0,) + data.shape[1:], dtype=data.dtype)
             return data, empty
 
+    def _gather(self, start, stop, out, channels, dtype, segments=None):
+        # Copy segment [start:stop] into out, selecting channels and casting.
+        # *segments* is a callable returning the arrays whose concatenation
+        # is [start:stop] (by default, the two pieces of the ring).
+        chan_shape = tuple(self.shape[1:])
+        if isinstance(channels, (int, np.integer)):
+            chan_shape = chan_shape[1:]
+        elif isinstance(channels, slice):
+            chan_shape = (len(range(*channels.indices(chan_shape[0]))),) + chan_shape[1:]
+        elif channels is not None:
+            channels = np.asarray(channels, dtype='int64')
+            chan_shape = (channels.size,) + chan_shape[1:]
+        
+        shape = (stop - start,) + chan_shape
+        if out is None:
+            out = np.empty(shape, dtype=self.dtype if dtype is None else dtype)
+        elif out.shape != shape:
+            raise ValueError("Output array has shape %s; expected %s" % (out.shape, shape))
+        if stop == start:
+            return out
+        
+        if segments is None:
+            segments = lambda: self.get_data(start, stop, join=False)
+        pos = 0
+        for src in segments():
+            dst = out[pos:pos + src.shape[0]]
+            pos += src.shape[0]
+            if src.shape[0] == 0:
+                continue
+            if channels is None:
+                dst[...] = src
+            elif isinstance(channels, np.ndarray):
+                if dst.dtype == src.dtype and dst.flags['C_CONTIGUOUS']:
+                    np.take(src, channels, axis=1, out=dst)
+                else:
+                    for j, c in enumerate(channels):
+                        dst[:, j] = src[:, c]
+            else:
+                # int or slice: a view of the source
+                dst[...] = src[:, channels]
+        return out
+
+    def _get_validated_data(self, start, stop, read, max_retries=10):
+        for i in range(max_retries):
+            seq, read_index, write_index = self._index_snapshot()
+            if stop > read_index:
+                raise IndexError("Requested segment (%d, %d) is out of bounds for ring buffer. "
+                                 "Current bounds are (%d, %d)." % (start, stop, self._oldest_index(write_index), read_index))
+            if start < self._oldest_index(write_index):
+                raise RingBufferOverrun("Requested segment (%d, %d) has been overwritten; oldest "
+                                        "valid index is %d." % (start, stop, self._oldest_index(write_index)))
+            try:
+                data = read()
+            except IndexError:
+                # the writer advanced between the snapshot and the read; retry
+                continue
+            if int(self._indexes[2]) == seq:
+                # nothing was written during the copy
+                return data
+            if start >= self._oldest_index(int(self._indexes[1])):
+                # writes happened, but not over the copied region
+                return data
+            raise RingBufferOverrun("Requested segment (%d, %d) was overwritten while being read." % (start, stop))
+        raise RingBufferOverrun("Could not read segment (%d, %d) after %d attempts." % (start, stop, max_retries))
+
+    def get_decimated(self, start, stop, target_points, validate=False):
+        """Return the segment ``[start:stop]`` at reduced resolution, using the
+        decimation pyramid (see *pyramid* in the constructor).
+        
+        The coarsest available decimation factor that still gives at least
+        *target_points* bins is used, so between *target_points* and twice as
+        many bins are returned (or the raw data if no level is fine enough).
+        Only bins that lie entirely inside the segment are returned; aligning
+        *start* and *stop* to the factor avoids dropping partial bins.
+        *validate* has the same meaning as in :func:`get_data`.
+        
+        Returns
+        -------
+        factor : int
+            Number of samples per bin.
+        mins, maxs, means : ndarray
+            Minimum, maximum and mean of each bin, with shape
+            ``(n_bins,) + shape[1:]``. When factor is 1, all three are the raw
+            data.
+        """
+        if self.pyramid is None:
+            raise TypeError("This RingBuffer has no decimation pyramid.")
+        return self.pyramid.get_decimated(self, start, stop, target_points, validate=validate)
+
     def _interpret_index(self, index):
         """Return normalized index, accounting for negative and None values.
         Also check that the index is readable.
@@ -269,7 +507,7 @@ class RingBuffer:
         the step is negative. This makes it possible to collect the result in
         the forward direction and handle the step later.
         """
-        start_index = self._write_index - self.shape[0]
+        start_index = self._oldest_index()
         if isinstance(index, (int, np.integer)):
             if index < 0:
                 index += self._read_index
@@ -315,3 +553,213 @@ class RingBuffer:
             return start, stop, step
         else:
             raise TypeError("Invalid index %s" % index)
+
+
+
+class RingBufferCursor:
+    """Read position of a single consumer of a :class:`RingBuffer`.
+    
+    Each call to :func:`read` returns all data that arrived since the previous
+    call as at most two zero-copy views. When the consumer falls so far
+    behind that unread data has been overwritten, the cursor skips ahead to
+    the oldest available sample and counts the lost samples instead of raising
+    an error. The lag statistics can be used to size buffers.
+    
+    Use :func:`RingBuffer.cursor` to create a cursor.
+    """
+    def __init__(self, ringbuffer, index=None):
+        self.ringbuffer = ringbuffer
+        self.position = ringbuffer.index() if index is None else index
+        self.lost_samples = 0
+        self.n_overruns = 0
+        self.n_reads = 0
+        self.max_lag = 0
+
+    def lag(self):
+        """Return the number of samples available but not read yet.
+        """
+        return self.ringbuffer.index() - self.position
+
+    def seek(self, index):
+        """Set the index of the next sample to read.
+        """
+        self.position = index
+
+    def _skip_overrun(self):
+        buf = self.ringbuffer
+        first = int(buf._oldest_index())
+        if self.position < first:
+            self.lost_samples += first - self.position
+            self.n_overruns += 1
+            self.position = first
+
+    def read(self, max_size=None, copy=False):
+        """Return the data received since the last read.
+        
+        Parameters
+        ----------
+        max_size : int or None
+            Maximum number of samples to return. Remaining samples are returned
+            by the next call.
+        copy : bool
+            If False (default), return views into the ring buffer; these are
+            only valid until the writer wraps around the buffer. If True,
+            return validated copies (see ``RingBuffer.get_data(validate=True)``).
+        
+        Returns
+        -------
+        start : int
+            Index of the first returned sample.
+        stop : int
+            Index of the last returned sample + 1. The cursor is now at *stop*.
+        data : tuple
+            Two arrays whose concatenation is the segment ``[start:stop]``. The
+            second one is empty unless the segment crosses the ring break of a
+            single ring buffer.
+        """
+        buf = self.ringbuffer
+        while True:
+            stop = int(buf.index())
+            self.max_lag = max(self.max_lag, stop - self.position)
+            self._skip_overrun()
+            start = self.position
+            if start >= stop:
+                # nothing new yet (or the cursor was moved ahead of the data)
+                empty = buf.buffer[:0]
+                return start, start, (empty, empty)
+            if max_size is not None:
+                stop = min(stop, start + max_size)
+            try:
+                if not copy:
+                    data = buf.get_data(start, stop, join=False)
+                else:
+                    data = buf.get_data(start, stop, join=False, validate=True)
+                break
+            except (RingBufferOverrun, IndexError):
+                # overwritten during the copy, or by a writer that advanced
+                # since the overrun check; skip the lost samples and retry
+                continue
+        self.position = stop
+        self.n_reads += 1
+        return start, stop, data
+
+    def stats(self):
+        """Return a dict of statistics about this consumer.
+        
+        * position: index of the next sample to read
+        * lag: samples currently available but not read
+        * max_lag: largest lag observed at read time
+        * lag_ratio: max_lag relative to the buffer size. Values near 1
+          indicate the buffer is too small for this consumer.
+        * lost_samples: total samples overwritten before being read
+        * n_overruns: number of reads that detected lost samples
+        * n_reads: number of reads
+        """
+        return dict(position=self.position, lag=self.lag(), max_lag=self.max_lag,
+                    lag_ratio=self.max_lag / self.ringbuffer.shape[0],
+                    lost_samples=self.lost_samples, n_overruns=self.n_overruns,
+                    n_reads=self.n_reads)
+
+
+
+class DecimationPyramid:
+    """Min/max/mean summaries of a :class:`RingBuffer` at power-of-two
+    decimation factors.
+    
+    Each level is itself a (possibly shared) RingBuffer of shape
+    ``(size // factor, 3) + shape[1:]`` holding min, max and mean of each bin
+    of *factor* samples. Levels are updated incrementally from the buffer
+    (or from the level below) each time a chunk is added, so reading a long
+    window at low resolution costs only a few bins per pixel.
+    
+    The finest level has a factor of ``2**first_level`` (8 by default), which
+    keeps the total pyramid smaller than the buffer itself.
+    
+    Usually created by ``RingBuffer(..., pyramid=True)``.
+    
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the RingBuffer this pyramid summarizes.
+    dtype : dtype
+        Dtype of the RingBuffer. Levels use a floating point dtype.
+    levels : int or None
+        Number of levels. By default, levels are added until the coarsest one
+        has fewer than 128 bins.
+    first_level : int
+        log2 of the decimation factor of the finest level.
+    shmem : None, True or list
+        None for a local pyramid, True to create levels in shared memory, or
+        the list of ``shm_ids`` of an existing shared pyramid.
+    shm_options : dict or None
+        Extra arguments for the shared memory blocks (see RingBuffer).
+    """
+    def __init__(self, shape, dtype, levels=None, first_level=3, shmem=None, shm_options=None):
+        self.shape = tuple(shape)
+        self.dtype = np.result_type(dtype, np.float32)
+        if isinstance(shmem, (list, tuple)):
+            # open the levels of an existing shared pyramid
+            shm_ids = list(shmem)
+        else:
+            if levels is None:
+                levels = max(int(np.log2(self.shape[0] / 128.)) - first_level + 1, 1)
+            shm_ids = [shmem] * levels
+        
+        self.factors = []
+        self.levels = []
+        for i in range(len(shm_ids)):
+            factor = 2 ** (first_level + i)
+            if self.shape[0] // factor < 2:
+                break
+            lshape = (self.shape[0] // factor, 3) + self.shape[1:]
+            level = RingBuffer(lshape, self.dtype, double=False, shmem=shm_ids[i],
+                               shm_options=shm_options)
+            self.factors.append(factor)
+            self.levels.append(level)
+        self.shm_ids = [level.shm_id for level in self.levels]
+
+    def update(self, buffer):
+        """Compute the bins completed by data recently added to *buffer*.
+        """
+        index = int(buffer.index())
+        source, source_factor = buffer, 1
+        for factor, level in zip(self.factors, self.levels):
+            n = index // factor
+            done = int(level.index())
+            if n <= done:
+                break
+            step = factor // source_factor
+            # bins whose source data is still available and that fit the level
+            first = -(-(int(source._write_index) - source.shape[0]) // step)
+            start = max(done, first, n - level.shape[0])
+            if start >= n:
+                break
+            data = source.get_data(start * step, n * step)
+            new = np.empty((n - start, 3) + self.shape[1:], dtype=self.dtype)
+            if source is buffer:
+                data = data.reshape((n - start, step) + self.shape[1:])
+                new[:, 0] = data.min(axis=1)
+                new[:, 1] = data.max(axis=1)
+                new[:, 2] = data.mean(axis=1)
+            else:
+                data = data.reshape((n - start, step, 3) + self.shape[1:])
+                new[:, 0] = data[:, :, 0].min(axis=1)
+                new[:, 1] = data[:, :, 1].max(axis=1)
+                new[:, 2] = data[:, :, 2].mean(axis=1)
+            level.new_chunk(new, index=n)
+            source, source_factor = level, factor
+
+    def get_decimated(self, buffer, start, stop, target_points, validate=False):
+        """See :func:`RingBuffer.get_decimated`.
+        """
+        chosen = None
+        for factor, level in zip(self.factors, self.levels):
+            if (stop - start) // factor < target_points:
+                break
+            chosen = factor, level
+        if chosen is None:
+            data = buffer.get_data(start, stop, validate=validate)
+            return 1, data, data, data
+        factor, level = chosen
+        bins = level.get_data(-(-start // factor), stop // factor, validate=validate)
+        return factor, bins[:, 0], bins[:, 1], bins[:, 2]
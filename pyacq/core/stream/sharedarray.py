@@ -3,11 +3,36 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 import numpy as np
-import sys, random, string, tempfile, mmap
+import sys, os, random, string, tempfile, mmap, weakref
 
 
-# TODO
-# On POSIX system it can optionally the shm_open way to avoid mmap.
+def _random_name(n):
+    return ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(n))
+
+
+# Available methods for creating a new shared memory buffer on this platform:
+#  * 'tempfile': a zero-filled temporary file on disk (portable, slow to allocate)
+#  * 'posix': a file in /dev/shm sized with ftruncate (this is what shm_open does
+#    on linux); allocation is O(1) and pages are only allocated when touched.
+#  * 'memfd': an anonymous memfd_create file, opened by other processes
+#    through /proc/<pid>/fd/<fd>. Supports real hugepages (MFD_HUGETLB).
+shm_backends = []
+if not sys.platform.startswith('win'):
+    shm_backends.append('tempfile')
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        shm_backends.append('posix')
+    if hasattr(os, 'memfd_create') and os.path.isdir('/proc/self/fd'):
+        shm_backends.append('memfd')
+
+if 'posix' in shm_backends:
+    default_shm_backend = 'posix'
+elif 'tempfile' in shm_backends:
+    default_shm_backend = 'tempfile'
+else:
+    default_shm_backend = None
+
+HUGEPAGE_SIZE = 2 * 1024 * 1024
+
 
 class SharedMem:
     """Class to create a shared memory buffer.
@@ -25,29 +50,83 @@ class SharedMem:
         The id of an existing SharedMem to open. If None, then a new shared
         memory file is created.
         On linux this is the filename, on Windows this is the tagname.
-    
+    backend : str or None
+        The method used to create a new buffer (ignored on Windows and when
+        *shm_id* is given). One of 'tempfile', 'posix' or 'memfd'; see
+        ``shm_backends`` for the methods available on this platform. The
+        default is 'posix' when /dev/shm is available.
+    hugepages : bool
+        If True, back the buffer with huge pages. With the 'memfd' backend this
+        uses MFD_HUGETLB (the buffer size is rounded up to a multiple of 2 MB
+        and the system must have huge pages reserved); with the other backends
+        this only advises the kernel to use transparent huge pages.
+    populate : bool
+        If True, prefault all pages of the mapping (MAP_POPULATE) so that the
+        first write into the buffer does not pay the page fault cost.
     """
-    def __init__(self, nbytes, shm_id=None):
+    def __init__(self, nbytes, shm_id=None, backend=None, hugepages=False, populate=False):
         self.nbytes = nbytes
         self.mmap_size = (self.nbytes // mmap.PAGESIZE + 1) * mmap.PAGESIZE
         self.shm_id = shm_id
+        self.backend = None
+        self._unlink = None
         
         if sys.platform.startswith('win'):
             if shm_id is None:
-                self.shm_id = u'pyacq_SharedMem_'+''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(128))
+                self.shm_id = u'pyacq_SharedMem_'+_random_name(128)
                 self.mmap = mmap.mmap(-1, self.nbytes, self.shm_id, access=mmap.ACCESS_WRITE)
             else:
                 self.mmap = mmap.mmap(-1, self.nbytes, self.shm_id, access=mmap.ACCESS_READ)
+            return
+        
+        flags = mmap.MAP_SHARED
+        if populate:
+            flags |= getattr(mmap, 'MAP_POPULATE', 0)
+        
+        if shm_id is None:
+            self._create_file(backend, hugepages)
+            self.mmap = mmap.mmap(self._tmpFile.fileno(), self.nbytes, flags, mmap.PROT_WRITE)
+            if hugepages and self.backend != 'memfd' and hasattr(mmap, 'MADV_HUGEPAGE'):
+                self.mmap.madvise(mmap.MADV_HUGEPAGE)
         else:
-            if shm_id is None:
-                self._tmpFile = tempfile.NamedTemporaryFile(prefix=u'pyacq_SharedMem_')
-                self._tmpFile.write(b'\x00' * self.nbytes)
-                self._tmpFile.flush()  # I do not anderstand but this is needed....
-                self.shm_id = self._tmpFile.name
-                self.mmap = mmap.mmap(self._tmpFile.fileno(), self.nbytes, mmap.MAP_SHARED, mmap.PROT_WRITE)
-            else:
-                self._tmpFile = open(self.shm_id, 'rb')
-                self.mmap = mmap.mmap(self._tmpFile.fileno(), self.nbytes, mmap.MAP_SHARED, mmap.PROT_READ)
+            self._tmpFile = open(self.shm_id, 'rb')
+            self.mmap = mmap.mmap(self._tmpFile.fileno(), self.nbytes, flags, mmap.PROT_READ)
+    
+    def _create_file(self, backend, hugepages, file_size=None):
+        """Create the file backing a new buffer of *file_size* bytes (default
+        is nbytes) and set self._tmpFile and self.shm_id.
+        """
+        if backend is None:
+            backend = default_shm_backend
+        if backend not in shm_backends:
+            raise ValueError("Unsupported shared memory backend '%s' (available: %s)" % 
+                             (backend, ', '.join(shm_backends)))
+        self.backend = backend
+        if file_size is None:
+            file_size = self.nbytes
+        
+        if backend == 'tempfile':
+            self._tmpFile = tempfile.NamedTemporaryFile(prefix=u'pyacq_SharedMem_')
+            self._tmpFile.write(b'\x00' * file_size)
+            self._tmpFile.flush()  # I do not anderstand but this is needed....
+            self.shm_id = self._tmpFile.name
+        elif backend == 'posix':
+            self.shm_id = u'/dev/shm/pyacq_SharedMem_' + _random_name(24)
+            fd = os.open(self.shm_id, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+            self._tmpFile = os.fdopen(fd, 'r+b')
+            # remove the file from /dev/shm when this object is closed or collected
+            self._unlink = weakref.finalize(self, _unlink_quiet, self.shm_id)
+            os.ftruncate(fd, file_size)
+        elif backend == 'memfd':
+            memfd_flags = 0
+            if hugepages:
+                memfd_flags |= os.MFD_HUGETLB
+                self.nbytes = -(-self.nbytes // HUGEPAGE_SIZE) * HUGEPAGE_SIZE
+                file_size = -(-file_size // HUGEPAGE_SIZE) * HUGEPAGE_SIZE
+            fd = os.memfd_create(u'pyacq_SharedMem', memfd_flags)
+            self._tmpFile = os.fdopen(fd, 'r+b')
+            self.shm_id = u'/proc/%d/fd/%d' % (os.getpid(), fd)
+            os.ftruncate(fd, file_size)
                 
     def close(self):
         """Close this buffer.
@@ -55,6 +134,8 @@ class SharedMem:
         self.mmap.close()
         if not sys.platform.startswith('win') and hasattr(self, '_tmpFile'):
             self._tmpFile.close()
+        if self._unlink is not None:
+            self._unlink()
     
     def to_dict(self):
         """Return a dict that can be serialized and sent to other processes to
@@ -69,7 +150,139 @@ class SharedMem:
                           strides=strides, offset=offset, dtype=dtype)        
         
 
+class MirroredSharedMem(SharedMem):
+    """Shared memory buffer whose data region is mapped twice, back-to-back,
+    in virtual memory.
+    
+    Writing at byte ``i`` of the data region also makes the byte visible at
+    ``i + nbytes``, so a ring buffer stored in this region can always be read
+    as one contiguous array across its wrap point while each sample is
+    written only once. This requires ``mmap(MAP_FIXED)`` and is only
+    available on POSIX systems (see ``HAVE_MIRROR``).
+    
+    The file is laid out as a small header region (*header_size* bytes,
+    padded to a whole page) followed by the data region. The header is
+    accessible through :func:`to_numpy`, the mirrored data region through
+    :func:`data_to_numpy`.
+    
+    Parameters
+    ----------
+    nbytes : int
+        Size of the data region in bytes. Must be a multiple of
+        ``mmap.PAGESIZE``.
+    shm_id : str or None
+        The id of an existing MirroredSharedMem to open. If None, then a new
+        shared memory file is created.
+    header_size : int
+        Size in bytes of the header region.
+    backend, hugepages, populate :
+        See :class:`SharedMem`. *hugepages* only advises the kernel to use
+        transparent huge pages.
+    """
+    def __init__(self, nbytes, shm_id=None, header_size=0, backend=None, hugepages=False, populate=False):
+        if not HAVE_MIRROR:
+            raise RuntimeError("Mirrored shared memory is not available on this platform.")
+        if nbytes % mmap.PAGESIZE != 0:
+            raise ValueError("Mirrored buffer size must be a multiple of %d bytes." % mmap.PAGESIZE)
+        self.nbytes = nbytes
+        self.header_size = header_size
+        self.data_offset = -(-header_size // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.shm_id = shm_id
+        self.backend = None
+        self._unlink = None
+        
+        if shm_id is None:
+            self._create_file(backend, False, file_size=self.data_offset + nbytes)
+            prot = mmap.PROT_READ | mmap.PROT_WRITE
+        else:
+            self._tmpFile = open(self.shm_id, 'rb')
+            prot = mmap.PROT_READ
+        self.readonly = shm_id is not None
+        fd = self._tmpFile.fileno()
+        
+        if header_size > 0:
+            self.mmap = mmap.mmap(fd, header_size, mmap.MAP_SHARED, prot)
+        else:
+            self.mmap = None
+        
+        # Reserve 2*nbytes of contiguous address space, then map the data
+        # region of the file over both halves (PROT_NONE == 0).
+        flags = mmap.MAP_SHARED | _MAP_FIXED
+        if populate:
+            flags |= getattr(mmap, 'MAP_POPULATE', 0)
+        addr = _mmap(None, 2 * nbytes, 0, mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS, -1, 0)
+        self._release = weakref.finalize(self, _munmap, addr, 2 * nbytes)
+        for half in (addr, addr + nbytes):
+            _mmap(half, nbytes, prot, flags, fd, self.data_offset)
+        if hugepages and hasattr(mmap, 'MADV_HUGEPAGE'):
+            _libc.madvise(addr, 2 * nbytes, mmap.MADV_HUGEPAGE)
+        self.address = addr
+    
+    def close(self):
+        """Close the file backing this buffer.
+        
+        The mapping itself is released once this object and all arrays
+        returned by :func:`data_to_numpy` have been garbage collected.
+        """
+        if self.mmap is not None:
+            self.mmap.close()
+        self._tmpFile.close()
+        if self._unlink is not None:
+            self._unlink()
+    
+    def to_dict(self):
+        return {'nbytes': self.nbytes, 'shm_id': self.shm_id, 'header_size': self.header_size}
+    
+    def data_to_numpy(self, dtype, shape, strides=None):
+        """Return a numpy array spanning both copies of the data region 
+        (``2 * nbytes`` bytes).
+        """
+        region = _MappedRegion(self, self.address, 2 * self.nbytes, self.readonly)
+        buf = np.asarray(region)
+        return np.ndarray(buffer=buf, shape=shape, strides=strides, dtype=dtype)
+
+
+class _MappedRegion:
+    # Exposes raw mapped memory to numpy while keeping its owner alive for
+    # as long as any array refers to it.
+    def __init__(self, owner, address, size, readonly):
+        self.owner = owner
+        self.__array_interface__ = {'version': 3, 'shape': (size,), 'typestr': '|u1',
+                                    'data': (address, readonly)}
+
+
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.mmap.restype = ctypes.c_void_p
+    _libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                           ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    _libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    _libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+    _MAP_FAILED = ctypes.c_void_p(-1).value
+    _MAP_FIXED = 0x10
+    HAVE_MIRROR = not sys.platform.startswith('win')
+except (ImportError, OSError, AttributeError):
+    HAVE_MIRROR = False
+
+
+def _mmap(addr, length, prot, flags, fd, offset):
+    ptr = _libc.mmap(addr, length, prot, flags, fd, offset)
+    if ptr is None or ptr == _MAP_FAILED:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ptr
+
+
+def _munmap(addr, length):
+    _libc.munmap(addr, length)
+
 
+def _unlink_quiet(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
 
 
 class SharedArray:
@@ -95,13 +308,15 @@ class SharedArray:
         The id of an existing SharedMem to open. If None, then a new shared
         memory file is created.
         On linux this is the filename, on Windows this is the tagname.
+    backend : str or None
+        The method used to create a new buffer. See :class:`SharedMem`.
     
     """
-    def __init__(self, shape=(1,), dtype='float64', shm_id=None):
+    def __init__(self, shape=(1,), dtype='float64', shm_id=None, backend=None):
         self.shape = shape
         self.dtype = np.dtype(dtype)
         nbytes = np.prod(shape)*self.dtype.itemsize
-        self.shmem = SharedMem(nbytes, shm_id)
+        self.shmem = SharedMem(nbytes, shm_id, backend=backend)
     
     def to_dict(self):
         return {'shape': self.shape, 'dtype': self.dtype, 'shm_id': self.shmem.shm_id}
@@ -8,6 +8,11 @@ import numpy as np
 from .streamhelpers import DataSender, DataReceiver, register_transfermode
 from .ringbuffer import RingBuffer
 
+
+# (index, chunk size) header sent for each chunk
+_stat_struct = struct.Struct('!QQ')
+
+
 class SharedMemSender(DataSender):
     """Stream sender that uses shared memory for efficient interprocess
     communication. Only the data pointer is sent over the socket.
@@ -19,26 +24,44 @@ class SharedMemSender(DataSender):
     
     * buffer_size (int) the size of the shared memory buffer in *frames*.
       The total shape of the allocated buffer is ``(buffer_size,) + shape``.
-    * double (bool) if True, then the buffer size is doubled and all frames are
-      written to the buffer twice. This makes it possible to guarantee
-      zero-copy reads by any connected InputStream.
+    * double (bool or 'mirror') if True, then the buffer size is doubled and all
+      frames are written to the buffer twice. This makes it possible to
+      guarantee zero-copy reads by any connected InputStream. With 'mirror',
+      the same guarantee is obtained by mapping the buffer memory twice in
+      virtual memory, so frames are written only once (POSIX only; requires
+      the time axis first in axisorder).
     * axisorder (tuple) The order that buffer axes should be arranged in
       memory. This makes it possible to optimize for specific algorithms that
       expect either row-major or column-major alignment. The default is
       row-major; the time axis comes first in the axis order.
     * fill (float) Value used to fill the buffer where no data is available.
+    * shm_backend (str) The method used to allocate shared memory: 'posix'
+      (/dev/shm, the default on linux), 'memfd' or 'tempfile'. See
+      ``pyacq.core.stream.sharedarray.shm_backends``.
+    * shm_hugepages (bool) if True, back the buffer with huge pages.
+    * shm_populate (bool) if True, prefault the whole buffer at allocation
+      time so that the first chunks sent do not pay page faults.
+    * pyramid (bool or int) if set, maintain a shared min/max/mean decimation
+      pyramid alongside the buffer (see :class:`DecimationPyramid`) so that
+      all connected viewers can read decimated data without recomputing it.
     """
     def __init__(self, socket, params):
         DataSender.__init__(self, socket, params)
         self.size = self.params['buffer_size']
         shape = (self.size,) + tuple(self.params['shape'][1:])
+        shm_options = dict(backend=self.params.get('shm_backend', None),
+                           hugepages=self.params.get('shm_hugepages', False),
+                           populate=self.params.get('shm_populate', False))
         self._buffer = RingBuffer(shape=shape, dtype=self.params['dtype'],
                                   shmem=True, axisorder=self.params['axisorder'],
-                                  double=self.params['double'], fill=self.params['fill'])
+                                  double=self.params['double'], fill=self.params['fill'],
+                                  shm_options=shm_options, pyramid=self.params.get('pyramid', None))
         self.params['shm_id'] = self._buffer.shm_id
+        if self._buffer.pyramid is not None:
+            self.params['pyramid_shm_ids'] = self._buffer.pyramid.shm_ids
     
     def send(self, index, data):
-        assert data.dtype == self.params['dtype']
+        assert data.dtype == self._buffer.dtype
         shape = data.shape
         if self.params['shape'][0] != -1:
             assert shape == self.params['shape']
@@ -47,7 +70,7 @@ class SharedMemSender(DataSender):
  
         self._buffer.new_chunk(data, index)
         
-        stat = struct.pack('!' + 'QQ', index, shape[0])
+        stat = _stat_struct.pack(index, shape[0])
         self.socket.send_multipart([stat])
 
 
@@ -59,7 +82,8 @@ class SharedMemReceiver(DataReceiver):
         self.size = self.params['buffer_size']
         shape = (self.size,) + tuple(self.params['shape'][1:])
         self.buffer = RingBuffer(shape=shape, dtype=self.params['dtype'], double=self.params['double'],
-                                 shmem=self.params['shm_id'], axisorder=self.params['axisorder'])
+                                 shmem=self.params['shm_id'], axisorder=self.params['axisorder'],
+                                 pyramid=self.params.get('pyramid_shm_ids', None))
 
     def recv(self, return_data=False):
         """Receive message indicating the index of the next data chunk.
@@ -73,7 +97,7 @@ class SharedMemReceiver(DataReceiver):
             default is False.
         """
         stat = self.socket.recv_multipart()[0]
-        index, size = struct.unpack('!QQ', stat)
+        index, size = _stat_struct.unpack(stat)
         if return_data:
             data = self.buffer[index-size:index]
         else:
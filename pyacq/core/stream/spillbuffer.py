@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import os
+import mmap
+import tempfile
+import numpy as np
+
+from .ringbuffer import RingBuffer
+from .arraytools import make_dtype
+
+
+class SpillRingBuffer(RingBuffer):
+    """RingBuffer with a long history kept in a memory-mapped file.
+
+    The buffer has two tiers: a RAM ring of *ram_size* samples holding the
+    most recent data, and an on-disk ring holding the last ``shape[0]``
+    samples. Every chunk is written to both tiers, so the disk ring always
+    contains the complete history while only the RAM ring is resident in
+    memory (the operating system caches recently written pages of the file).
+
+    Reads use the same API as :class:`RingBuffer`. Segments that lie within the
+    RAM ring are returned from memory (without copy when possible), and older
+    segments are read from the file. Validated reads
+    (``get_data(validate=True)``) are always served from the file.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the full history; ``shape[0]`` is the number of samples kept
+        on disk.
+    dtype : dtype
+        Data type of the buffer.
+    spill_to : str
+        Either a directory, in which case a temporary file is created there
+        and deleted when the buffer is closed, or the path of the file to use
+        (created or overwritten).
+    ram_size : int or None
+        Number of samples kept in the RAM ring. Default is ``shape[0] // 8``.
+
+    Other arguments are passed to :class:`RingBuffer` for the RAM ring. The
+    ``shape`` attribute of this buffer is the shape of the RAM ring; the full
+    history length is given by ``history``. Unlike RingBuffer, this buffer
+    cannot be shared with other processes.
+    """
+    def __init__(self, shape, dtype, spill_to, ram_size=None, double=True, fill=None, axisorder=None,
+                 pyramid=None):
+        history = int(shape[0])
+        if ram_size is None:
+            ram_size = max(history // 8, 1)
+        if ram_size > history:
+            raise ValueError("ram_size (%d) must not be larger than the history (%d)." % (ram_size, history))
+        RingBuffer.__init__(self, (ram_size,) + tuple(shape[1:]), dtype, double=double, fill=fill,
+                            axisorder=axisorder, pyramid=pyramid)
+        self.history = history
+
+        dtype = make_dtype(dtype)
+        nbytes = history * int(np.prod(shape[1:], dtype='int64')) * dtype.itemsize
+        if os.path.isdir(spill_to):
+            self._file = tempfile.NamedTemporaryFile(dir=spill_to, prefix='pyacq_spill_', suffix='.raw')
+        else:
+            self._file = open(spill_to, 'w+b')
+        self.filename = self._file.name
+        self._file.truncate(nbytes)
+        # Time axis first, so that each chunk is written contiguously. Samples
+        # are always written (or gap-filled) before they become readable, so
+        # the file does not need to be initialized.
+        self._mmap = mmap.mmap(self._file.fileno(), nbytes)
+        self._disk = np.frombuffer(self._mmap, dtype=dtype).reshape((history,) + tuple(shape[1:]))
+
+    def first_index(self):
+        return self._read_index - self.history
+
+    def _oldest_index(self, write_index=None):
+        if write_index is None:
+            write_index = self._write_index
+        return write_index - self.history
+
+    def close(self):
+        """Close the history file (and delete it if it is temporary).
+        
+        Arrays previously returned from the history remain valid; the file
+        stays mapped in memory until they are deleted.
+        """
+        if self._disk is None:
+            return
+        self._disk = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # returned arrays still use the mapping; it is released when they
+            # are garbage collected
+            pass
+        self._mmap = None
+        self._file.close()
+
+    def _write(self, start, stop, value):
+        shape = (stop - start,) + tuple(self.shape[1:])
+        value = np.broadcast_to(np.asarray(value, dtype=self.dtype), shape)
+
+        # write-through to the disk ring
+        history = self.history
+        pos = start
+        while pos < stop:
+            i = pos % history
+            n = min(stop - pos, history - i)
+            self._disk[i:i+n] = value[pos-start:pos-start+n]
+            pos += n
+
+        # the RAM ring only keeps the most recent samples
+        ram_start = max(start, stop - self.shape[0])
+        RingBuffer._write(self, ram_start, stop, value[ram_start-start:])
+
+    def get_data(self, start, stop, copy=False, join=True, validate=False, out=None, channels=None, dtype=None):
+        """Return a segment of the buffer.
+
+        See :func:`RingBuffer.get_data()` for parameters.
+        """
+        if not validate and start >= self._write_index - self.shape[0]:
+            # recent data: read from the RAM ring
+            return RingBuffer.get_data(self, start, stop, copy=copy, join=join, out=out,
+                                       channels=channels, dtype=dtype)
+
+        if out is not None or channels is not None or dtype is not None or join:
+            read = lambda: self._gather(start, stop, out, channels, dtype,
+                                        segments=lambda: self._disk_segments(start, stop))
+        else:
+            def read():
+                segs = self._disk_segments(start, stop)
+                if len(segs) > 2:
+                    pieces = segs
+                    segs = [self._gather(start, stop, None, None, None, segments=lambda: pieces),
+                            self._disk[:0]]
+                while len(segs) < 2:
+                    segs.append(self._disk[:0])
+                if copy or validate:
+                    segs = [s.copy() for s in segs]
+                return tuple(np.asarray(s) for s in segs)
+
+        if validate:
+            return self._get_validated_data(start, stop, read)
+
+        first, last = self.first_index(), self.index()
+        if start < first or stop > last:
+            raise IndexError("Requested segment (%d, %d) is out of bounds for ring buffer. "
+                             "Current bounds are (%d, %d)." % (start, stop, first, last))
+        return read()
+
+    def _disk_segments(self, start, stop):
+        # Arrays whose concatenation is [start:stop], read from the disk ring.
+        segs = []
+        if start < 0:
+            # before the first sample: the buffer is still filled with the filler
+            n = min(stop, 0) - start
+            filler = np.asarray(self._filler, dtype=self.dtype)
+            segs.append(np.broadcast_to(filler, (n,) + tuple(self.shape[1:])))
+            start += n
+        history = self.history
+        while start < stop:
+            i = start % history
+            n = min(stop - start, history - i)
+            segs.append(self._disk[i:i+n])
+            start += n
+        return segs
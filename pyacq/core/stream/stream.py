@@ -2,6 +2,8 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import os
+import sys
 import random
 import string
 import zmq
@@ -9,9 +11,13 @@ import numpy as np
 import weakref
 
 from .ringbuffer import RingBuffer
-from .streamhelpers import all_transfermodes
-from ..rpc import ObjectProxy
+from .spillbuffer import SpillRingBuffer
+from .streamhelpers import all_transfermodes, CoalescingSender
+from ..rpc import ObjectProxy, log
 from .arraytools import make_dtype
+from .compression import all_codec_compressors
+from .multicast import MulticastSocket, free_udp_port
+from .channelgroups import ChannelGroupSender, ChannelGroupReceiver, check_channel_groups
 
 
 default_stream = dict(
@@ -29,8 +35,14 @@ default_stream = dict(
     offset=None,
     units='',
     sample_rate=1.,
-    double=False,#make sens only for transfermode='sharemem',
+    double=False,#make sens only for transfermode='sharemem', True or 'mirror'
     fill=None,
+    coalesce_samples=0,
+    coalesce_max_latency=None,
+    sndhwm=None,
+    rcvhwm=None,
+    lossless=False,
+    channel_groups=None,
 )
 
 
@@ -58,8 +70,20 @@ class OutputStream(object):
         
         Parameters
         ----------
-        protocol : 'tcp', 'udp', 'inproc' or 'inpc' (linux only)
-            The type of protocol used for the zmq.PUB socket
+        protocol : 'tcp', 'udp', 'inproc', 'inpc' (linux only), 'multicast', 'epgm', 'pgm' or 'auto'
+            The type of protocol used for the zmq.PUB socket. With 'auto', the
+            protocol is chosen when the first InputStream connects (see
+            :func:`negotiate()`).
+            
+            With 'multicast', chunks are sent once over UDP multicast to all
+            InputStreams, whatever their number; *interface* is then the group
+            address (e.g. '239.255.0.1'). Lost datagrams are not retransmitted
+            (see :class:`MulticastSocket <stream.multicast.MulticastSocket>`
+            for the extra parameters *multicast_interface*, *multicast_ttl*,
+            *max_datagram* and *multicast_rcvbuf*). 'epgm' and 'pgm' use the
+            zmq PGM multicast transports, if libzmq was built with them
+            (*interface* is then e.g. 'eth0;239.192.1.1' and *port* must be
+            given).
         interface : str
             The bind adress for the zmq.PUB socket
         port : str
@@ -67,8 +91,14 @@ class OutputStream(object):
         transfermode: str
             The method used for data transfer:
             
+            * 'auto': chosen when the first InputStream connects (see :func:`negotiate()`).
             * 'plaindata': data are sent over a plain socket in two parts: (frame index, data).
             * 'sharedmem': data are stored in shared memory in a ring buffer and the current frame index is sent over the socket.
+            * 'quantized': float data are sent over a plain socket as int16 or int8 using *scale* and *offset*
+              (see :class:`QuantizedDataSender <stream.quantizedstream.QuantizedDataSender>`).
+            * 'inprocobject': arrays are passed by reference (read-only) to InputStreams in the same process;
+              only the frame index is sent over the socket
+              (see :class:`InprocObjectSender <stream.inprocstream.InprocObjectSender>`).
             * 'shared_cuda_buffer': (planned) data are stored in shared Cuda buffer and the current frame index is sent over the socket.
             * 'share_opencl_buffer': (planned) data are stored in shared OpenCL buffer and the current frame index is sent over the socket.
             
@@ -83,8 +113,13 @@ class OutputStream(object):
             
             * For ``streamtype=image``, the shape should be ``(-1, H, W)`` or ``(n_frames, H, W)``.
             * For ``streamtype=analogsignal`` the shape should be ``(n_samples, n_channels)`` or ``(-1, n_channels)``.
-        compression: '', 'blosclz', 'blosc-lz4'
-            The compression for the data stream. The default uses no compression.
+        compression: '', 'blosclz', 'blosc-lz4', 'zstd', 'delta+shuffle+lz4', ...
+            The compression for the data stream (only for ``transfermode='plaindata'``).
+            The default uses no compression. Besides blosc, lossless codecs
+            made of filters ('delta', 'delta2', 'shuffle', 'bitshuffle') and a
+            compressor ('zlib', 'zstd', 'lz4', optionally with a level, e.g.
+            'zstd-9') can be chained with '+'; see
+            :func:`get_codec() <pyacq.core.stream.compression.get_codec>`.
         scale: float
             An optional scale factor + offset to apply to the data before it is sent over the stream.
             ``output = offset + scale * input``
@@ -94,6 +129,38 @@ class OutputStream(object):
             Units of the stream data. Mainly used for 'analogsignal'.
         sample_rate: float or None
             Sample rate of the stream in Hz.
+        coalesce_samples: int
+            If > 0, consecutive chunks smaller than this number of frames are
+            merged before being sent, which reduces the message rate of streams
+            that send one or a few samples at a time. A merged chunk is sent
+            as soon as it holds *coalesce_samples* frames. Default is 0 (no
+            coalescing).
+        coalesce_max_latency: float or None
+            Maximum time (in ms) that a frame may be held back by coalescing.
+            If None, merged chunks are only sent when full, when the stream
+            has a gap, or on :func:`flush()`.
+        sndhwm: int or None
+            High-water mark of the socket: the number of chunks queued for
+            each InputStream before new chunks are dropped (or, with
+            *lossless*, before :func:`send()` blocks). None uses the zmq
+            default (1000).
+        rcvhwm: int or None
+            High-water mark of the InputStream sockets (see *sndhwm*);
+            InputStreams can override it in their spec.
+        lossless: bool
+            If True, use PUSH/PULL sockets instead of PUB/SUB: when an
+            InputStream does not keep up, :func:`send()` blocks instead of
+            dropping chunks. This is intended for recorders and other
+            consumers that must not lose data. Only one InputStream should
+            connect (chunks are distributed among several InputStreams), and
+            :func:`send()` blocks until it is connected.
+        channel_groups: int, list or None
+            If set, InputStreams can subscribe to a subset of the channels of a
+            ``(n_samples, n_channels)`` stream (see *channels* in
+            :func:`InputStream.connect()`), and only the channel groups that
+            are subscribed to are sent. This is either a number of channels
+            per group, or a list of groups (lists of channel indices). See
+            :class:`ChannelGroupSender <stream.channelgroups.ChannelGroupSender>`.
         kwargs :
             All extra keyword arguments are passed to the DataSender constructor
             for the chosen transfermode (for example, see 
@@ -113,16 +180,46 @@ class OutputStream(object):
         for i in range(1, len(shape)):
             assert shape[i] > 0, "Shape index %d must be > 0." % i
         
+        # with 'auto', binding is deferred until the first InputStream connects
+        self.sender = None
+        if 'auto' not in (self.params['protocol'], self.params['transfermode']):
+            self._bind()
+
+        self.configured = True
+        if self.node and self.node():
+            self.node().after_output_configure(self.name)
+
+    def _bind(self):
         if self.params['protocol'] in ('inproc', 'ipc'):
             pipename = u'pyacq_pipe_'+''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(24))
             self.params['interface'] = pipename
             self.url = '{protocol}://{interface}'.format(**self.params)
         else:
+            if self.params['protocol'] in ('pgm', 'epgm') and not zmq.has('pgm'):
+                raise ValueError("protocol '%s' requires libzmq built with PGM support." % self.params['protocol'])
+            if self.params['protocol'] == 'multicast' and self.params['port'] == '*':
+                self.params['port'] = free_udp_port()
             self.url = '{protocol}://{interface}:{port}'.format(**self.params)
-        context = zmq.Context.instance()
-        self.socket = context.socket(zmq.PUB)
-        self.socket.linger = 1000  # don't let socket deadlock when exiting
-        self.socket.bind(self.url)
+        if self.params['protocol'] == 'multicast':
+            if self.params['lossless'] or self.params['transfermode'] in ('sharedmem', 'inprocobject'):
+                raise ValueError("protocol 'multicast' cannot be used with lossless=True or "
+                                 "transfermode='%s'." % self.params['transfermode'])
+            self.socket = MulticastSocket('send', self.params['interface'], self.params['port'],
+                                          interface=self.params.get('multicast_interface', '0.0.0.0'),
+                                          ttl=self.params.get('multicast_ttl', 1),
+                                          max_datagram=self.params.get('max_datagram', 1400))
+        else:
+            context = zmq.Context.instance()
+            if self.params['channel_groups'] is not None:
+                check_channel_groups(self.params)
+                # XPUB reports subscriptions, so only subscribed groups are sent
+                self.socket = context.socket(zmq.XPUB)
+            else:
+                self.socket = context.socket(zmq.PUSH if self.params['lossless'] else zmq.PUB)
+            self.socket.linger = 1000  # don't let socket deadlock when exiting
+            if self.params['sndhwm'] is not None:
+                self.socket.sndhwm = self.params['sndhwm']
+            self.socket.bind(self.url)
         self.addr = self.socket.getsockopt(zmq.LAST_ENDPOINT).decode()
         self.port = self.addr.rpartition(':')[2]
         self.params['port'] = self.port
@@ -131,11 +228,79 @@ class OutputStream(object):
         if transfermode not in all_transfermodes:
             raise ValueError("Unsupported transfer mode '%s'" % transfermode)
         sender_class = all_transfermodes[transfermode][0]
-        self.sender = sender_class(self.socket, self.params)
+        if self.params['channel_groups'] is not None:
+            self.sender = ChannelGroupSender(self.socket, self.params, sender_class)
+        else:
+            self.sender = sender_class(self.socket, self.params)
+        if self.params['coalesce_samples'] > 0:
+            latency = self.params['coalesce_max_latency']
+            if latency is not None:
+                latency = latency / 1000.
+            self.sender = CoalescingSender(self.sender, self.params['coalesce_samples'], max_latency=latency)
 
-        self.configured = True
-        if self.node and self.node():
-            self.node().after_output_configure(self.name)
+    def negotiate(self, host_name, pid):
+        """Resolve 'auto' protocol and transfermode for an InputStream that
+        runs in process *pid* on host *host_name*, and return the stream params.
+        
+        This is called by :func:`InputStream.connect()`. The cheapest path is
+        chosen for the first InputStream that connects:
+        
+        * same process: 'inproc' protocol and 'inprocobject' transfer.
+        * same host: 'ipc' protocol ('tcp' on Windows), and 'sharedmem' transfer
+          if *buffer_size* > 0, otherwise 'plaindata'.
+        * other host: 'tcp' protocol bound on all interfaces, and 'plaindata'
+          transfer compressed with the best available lossless codec (unless a
+          compression was configured).
+        
+        Later InputStreams must be able to use the chosen path; connecting
+        from further away (for example from another host after a same-host
+        InputStream) raises ValueError. Streams that were not configured with
+        'auto' are returned unchanged.
+        """
+        negotiated = self.params.get('negotiated', None)
+        if self.sender is not None and negotiated is None:
+            return self.params
+        
+        if host_name != log.get_host_name():
+            locality = 'remote'
+        elif pid != os.getpid():
+            locality = 'host'
+        else:
+            locality = 'process'
+        
+        if negotiated is None:
+            self._resolve_auto(locality)
+            self.params['negotiated'] = locality
+            self._bind()
+        elif _localities.index(locality) > _localities.index(negotiated):
+            raise ValueError("Stream was negotiated for a %s connection (protocol=%s, transfermode=%s); "
+                             "cannot connect from %s." % (negotiated, self.params['protocol'],
+                             self.params['transfermode'], _locality_names[locality]))
+        return self.params
+
+    def _resolve_auto(self, locality):
+        params = self.params
+        if params['protocol'] == 'auto':
+            if locality == 'process':
+                params['protocol'] = 'inproc'
+            elif locality == 'host' and not sys.platform.startswith('win'):
+                params['protocol'] = 'ipc'
+            else:
+                params['protocol'] = 'tcp'
+                if locality == 'remote' and params['interface'] in ('127.0.0.1', 'localhost'):
+                    params['interface'] = '0.0.0.0'
+        
+        if params['transfermode'] == 'auto':
+            # inprocobject and sharedmem do not support channel groups
+            groups = params['channel_groups'] is not None
+            if locality == 'process' and not groups:
+                params['transfermode'] = 'inprocobject'
+            elif locality == 'host' and params['buffer_size'] > 0 and not groups:
+                params['transfermode'] = 'sharedmem'
+            else:
+                params['transfermode'] = 'plaindata'
+                if locality == 'remote' and params['compression'] == '':
+                    params['compression'] = _auto_compression(params['dtype'])
 
     def send(self, data, index=None, **kargs):
         """Send a data chunk and its frame index.
@@ -150,19 +315,52 @@ class OutputStream(object):
         if index is None:
             index = self.last_index + data.shape[0]
         self.last_index = index
+        if self.sender is None:
+            # 'auto' stream that no InputStream has connected to yet
+            return
         self.sender.send(index, data, **kargs)
 
+    def flush(self):
+        """Send any data held back by chunk coalescing (see *coalesce_samples*
+        in :func:`configure()`).
+        """
+        if isinstance(self.sender, CoalescingSender):
+            self.sender.flush()
+
     def close(self):
         """Close the output.
         
         This closes the socket and releases shared memory, if necessary.
         """
+        if self.sender is None:
+            return
         self.sender.close()
         self.socket.close()
         del self.socket
         del self.sender
 
 
+_localities = ['process', 'host', 'remote']
+_locality_names = {'process': 'the same process', 'host': 'another process', 'remote': 'another host'}
+
+
+def _auto_compression(dtype):
+    """Return the compression used for 'auto' streams sent to another host.
+    """
+    dtype = make_dtype(dtype)
+    if dtype.fields is not None or dtype.kind not in 'uif':
+        return ''
+    for comp in ('zstd', 'lz4', 'zlib'):
+        if all_codec_compressors[comp][1]:
+            return ('delta+shuffle+' if dtype.kind in 'ui' else 'shuffle+') + comp
+    return ''
+
+
+def _is_auto(params):
+    # True if connecting to a stream with these params requires negotiate()
+    return 'auto' in (params['protocol'], params['transfermode']) or 'negotiated' in params
+
+
 def _shape_equal(shape1, shape2):
     """
     Check if shape of stream are compatible.
@@ -212,34 +410,61 @@ class InputStream(object):
         self.name = name
         self.buffer = None
         self._own_buffer = False  # whether InputStream should populate buffer
+        self._pending = None  # packet received by recv_all() but not yet returned
+        self._take = None  # channels selected on reception
     
-    def connect(self, output):
+    def connect(self, output, channels=None):
         """Connect an output to this input.
         
         Any data send over the stream using :func:`output.send() <OutputStream.send>`
         can be retrieved using :func:`input.recv() <InputStream.recv>`.
         
+        If the output was configured with ``protocol='auto'`` or
+        ``transfermode='auto'``, the cheapest path between the two ends is
+        negotiated here (see :func:`OutputStream.negotiate()`).
+        
         Parameters
         ----------
         output : OutputStream (or proxy to a remote OutputStream)
             The OutputStream to connect.
+        channels : list or None
+            If given, only these channels of a ``(n_samples, n_channels)``
+            stream are received, in this order, and ``params['shape']`` of
+            this InputStream is changed accordingly. If the output was
+            configured with *channel_groups*, only the groups containing these
+            channels are sent to this InputStream; otherwise the whole stream
+            is received and the channels are selected on reception.
         """
+        host = None
         if isinstance(output, dict):
             self.params = output
         elif isinstance(output, OutputStream):
             self.params = output.params
+            if _is_auto(self.params):
+                self.params = output.negotiate(log.get_host_name(), os.getpid())
         elif isinstance(output, ObjectProxy):
             self.params = output.params._get_value()
+            if _is_auto(self.params):
+                self.params = output.negotiate(log.get_host_name(), os.getpid(), _return_type='value')
+            # address of the output's host, as seen from here
+            host = output._rpc_addr.decode().rpartition(':')[0].partition('://')[2]
         else:
             raise TypeError("Invalid type for stream: %s" % type(output))
-            
+        if 'auto' in (self.params['protocol'], self.params['transfermode']):
+            raise ValueError("Cannot connect to a stream with 'auto' protocol or transfermode "
+                             "before it is negotiated; connect to the OutputStream instead of its params.")
+        
         if self.params['protocol'] in ('inproc', 'ipc'):
             self.url = '{protocol}://{interface}'.format(**self.params)
         else:
-            self.url = '{protocol}://{interface}:{port}'.format(**self.params)
+            interface = self.params['interface']
+            if interface in ('0.0.0.0', '*') and host:
+                interface = host
+            self.url = '{protocol}://{interface}:{port}'.format(protocol=self.params['protocol'],
+                                                               interface=interface, port=self.params['port'])
             
         # allow some keys in self.spec to override self.params
-        readonly_params = ['protocol', 'transfermode', 'shape', 'dtype']
+        readonly_params = ['protocol', 'transfermode', 'shape', 'dtype', 'lossless']
         for k,v in self.spec.items():
             if k in readonly_params:
                 if k=='shape':
@@ -255,19 +480,42 @@ class InputStream(object):
             else:
                 self.params[k] = v
         
-        context = zmq.Context.instance()
-        self.socket = context.socket(zmq.SUB)
-        self.socket.linger = 1000  # don't let socket deadlock when exiting
-        self.socket.setsockopt(zmq.SUBSCRIBE, b'')
-        #~ self.socket.setsockopt(zmq.DELAY_ATTACH_ON_CONNECT,1)
-        self.socket.connect(self.url)
+        if self.params['protocol'] == 'multicast':
+            self.socket = MulticastSocket('recv', self.params['interface'], self.params['port'],
+                                          interface=self.params.get('multicast_interface', '0.0.0.0'),
+                                          rcvbuf=self.params.get('multicast_rcvbuf', 4 * 1024**2))
+        else:
+            context = zmq.Context.instance()
+            if self.params.get('lossless', False):
+                self.socket = context.socket(zmq.PULL)
+            else:
+                self.socket = context.socket(zmq.SUB)
+                if self.params.get('channel_groups', None) is None:
+                    self.socket.setsockopt(zmq.SUBSCRIBE, b'')
+            self.socket.linger = 1000  # don't let socket deadlock when exiting
+            if self.params.get('rcvhwm', None) is not None:
+                self.socket.rcvhwm = self.params['rcvhwm']
+            #~ self.socket.setsockopt(zmq.DELAY_ATTACH_ON_CONNECT,1)
+            self.socket.connect(self.url)
         
         transfermode = self.params['transfermode']
         if transfermode not in all_transfermodes:
             raise ValueError("Unsupported transfer mode '%s'" % transfermode)
         receiver_class = all_transfermodes[transfermode][1]
-        self.receiver = receiver_class(self.socket, self.params)
+        self._take = None
+        if self.params.get('channel_groups', None) is not None:
+            # subscribes to the topics it needs
+            self.receiver = ChannelGroupReceiver(self.socket, self.params, receiver_class, channels=channels)
+        else:
+            self.receiver = receiver_class(self.socket, self.params)
+            if channels is not None:
+                self._take = np.array(channels)
+        if channels is not None:
+            self.params = dict(self.params)
+            self.params['shape'] = (self.params['shape'][0], len(channels))
+            self.params['channels'] = list(channels)
         
+        self.reset_counters()
         self.connected = True
         if self.node and self.node():
             self.node().after_input_connect(self.name)        
@@ -277,7 +525,22 @@ class InputStream(object):
         
         Return True if a new packet is available.
         """
+        if self._pending is not None:
+            return zmq.POLLIN
         return self.socket.poll(timeout=timeout)
+
+    def _buffered(self):
+        # True if a packet can be received without waiting on the socket
+        # (not visible to a zmq.Poller watching the socket)
+        return self._pending is not None or getattr(self.socket, 'buffered', 0) > 0
+    
+    def _recv_nowait(self, **kargs):
+        # Receive a packet once poll() has reported one. A chunk sent as one
+        # message per channel group may be incomplete: raise zmq.Again rather
+        # than wait for its other groups.
+        if isinstance(self.receiver, ChannelGroupReceiver):
+            kargs['flags'] = zmq.NOBLOCK
+        return self.recv(**kargs)
     
     def recv(self, **kargs):
         """
@@ -294,19 +557,125 @@ class InputStream(object):
             to read from the shared array or ``input_stream.recv(with_data=True)``
             to return the received data chunk.
         """
+        if self._pending is not None:
+            packet, self._pending = self._pending, None
+            return packet
         index, data = self.receiver.recv(**kargs)
+        if self._take is not None and data is not None:
+            data = data[:, self._take]
         if self._own_buffer and data is not None and self.buffer is not None:
             self.buffer.new_chunk(data, index=index)
+        
+        # update counters
+        self.received_chunks += 1
+        if isinstance(data, np.ndarray) and data.ndim > 0:
+            size = data.shape[0]
+            start = index - size
+            if self._next_index is not None and start > self._next_index:
+                missing = start - self._next_index
+                self.gaps += 1
+                self.dropped_samples += missing
+                self.dropped_chunks += -(-missing // size) if size > 0 else 1
+        self._next_index = index
         return index, data
 
+    def reset_counters(self):
+        """Reset the reception counters of this stream.
+        
+        InputStream keeps the following counters, which are reset on connect:
+        
+        * received_chunks: the number of chunks received.
+        * gaps: the number of holes detected in the stream (a chunk that does
+          not start at the end of the previous one). Holes are usually caused
+          by a socket high-water mark being reached (see *sndhwm* and
+          *lossless* in :func:`OutputStream.configure()`).
+        * dropped_samples: the total number of frames missing in these holes.
+        * dropped_chunks: the number of chunks missing, estimated from the
+          size of the chunk that follows each hole (exact for streams that
+          send chunks of a fixed size).
+        
+        Holes can only be detected for chunks that are received with their
+        data (for example, not with ``transfermode='sharedmem'`` and
+        ``return_data=False``).
+        """
+        self.received_chunks = 0
+        self.gaps = 0
+        self.dropped_samples = 0
+        self.dropped_chunks = 0
+        self._next_index = None
+
+    def recv_all(self, max_packets=None, concat=True, return_data=True):
+        """Receive all packets that are already waiting, without blocking.
+        
+        This is much cheaper than calling :func:`recv()` for each packet when
+        many small chunks have accumulated (for example after the consumer
+        was stalled).
+        
+        Parameters
+        ----------
+        max_packets : int or None
+            Maximum number of packets to receive.
+        concat : bool
+            If True (default), the received chunks are concatenated into a
+            single array (or bytes). Concatenation stops at the first gap
+            between chunks (a chunk that does not start at the previous
+            index); the chunk after the gap is returned by the next call.
+            If False, a list of ``(index, data)`` packets is returned instead.
+        return_data : bool
+            Passed to :func:`recv()`. If False, only the final index is
+            returned.
+        
+        Returns
+        -------
+        index: int or None
+            The absolute sample index after the last received chunk, or None
+            if no packet was waiting.
+        data: np.ndarray, bytes, list or None
+            The received data (see *concat*).
+        """
+        packets = []
+        while max_packets is None or len(packets) < max_packets:
+            if self._pending is None and not self.socket.poll(0):
+                break
+            try:
+                index, data = self._recv_nowait(return_data=return_data)
+            except zmq.Again:
+                # the rest of this chunk has not arrived yet
+                break
+            if concat and packets and isinstance(data, np.ndarray):
+                if index - data.shape[0] != packets[-1][0]:
+                    # gap in the stream; keep this packet for the next call
+                    self._pending = (index, data)
+                    break
+            packets.append((index, data))
+        
+        if not concat:
+            return (packets[-1][0] if packets else None), packets
+        if len(packets) == 0:
+            return None, None
+        index = packets[-1][0]
+        chunks = [data for i, data in packets if data is not None]
+        if len(chunks) == 0:
+            return index, None
+        elif len(chunks) == 1:
+            return index, chunks[0]
+        elif isinstance(chunks[0], np.ndarray):
+            return index, np.concatenate(chunks, axis=0)
+        else:
+            return index, b''.join(chunks)
+
     def close(self):
         """Close the stream.
         
         This closes the socket. No data can be received after this point.
+        The history file of a :class:`SpillRingBuffer` attached with
+        :func:`set_buffer()` is closed too.
         """
         self.receiver.close()
         self.socket.close()
         del self.socket
+        if self._own_buffer and isinstance(self.buffer, SpillRingBuffer):
+            self.buffer.close()
     
     def __getitem__(self, *args):
         """Return a data slice from the RingBuffer attached to this InputStream.
@@ -331,27 +700,55 @@ class InputStream(object):
             raise TypeError("No ring buffer configured for this InputStream.")
         return self.buffer.get_data(*args, **kargs)
     
-    def set_buffer(self, size=None, double=True, axisorder=None, shmem=None, fill=None):
+    def set_buffer(self, size=None, double=True, axisorder=None, shmem=None, fill=None, pyramid=None,
+                   spill_to=None, ram_size=None):
         """Ensure that this InputStream has a RingBuffer at least as large as 
         *size* and with the specified double-mode and axis order.
         
+        If *pyramid* is set, the buffer must also maintain a decimation
+        pyramid (see :class:`RingBuffer`). With ``pyramid='optional'``, an
+        existing buffer without pyramid (such as the shared memory buffer of a
+        sharedmem stream) is reused rather than copied into a new buffer; a
+        new buffer is given a pyramid.
+        
+        If *spill_to* is given (a directory or file path), a new
+        :class:`SpillRingBuffer` is attached that keeps *size* samples of
+        history in a memory-mapped file and only the last *ram_size* samples
+        in memory.
+        
         If necessary, this will attach a new RingBuffer to the stream and remove
         any existing buffer.
         """
+        optional_pyramid = isinstance(pyramid, str) and pyramid == 'optional'
+        if optional_pyramid:
+            pyramid = True
+        
         # first see if we already have a buffer that meets requirements
         bufs = []
         if self.buffer is not None:
             bufs.append((self.buffer, self._own_buffer))
-        if self.receiver.buffer is not None:
+        if self.receiver.buffer is not None and self._take is None:
             bufs.append((self.receiver.buffer, False))
+        if spill_to is not None:
+            bufs = []
         for buf, own in bufs:
+            if pyramid and buf.pyramid is None and not optional_pyramid:
+                continue
             if buf.shape[0] >= size and buf.double == double and (axisorder is None or all(buf.axisorder == axisorder)):
                 self.buffer = buf
                 self._own_buffer = own
                 return
             
         # attach a new buffer
+        if self._own_buffer and isinstance(self.buffer, SpillRingBuffer):
+            self.buffer.close()
         shape = (size,) + tuple(self.params['shape'][1:])
         dtype = make_dtype(self.params['dtype'])
-        self.buffer = RingBuffer(shape=shape, dtype=dtype, double=double, axisorder=axisorder, shmem=shmem, fill=fill)
+        if spill_to is not None:
+            self.buffer = SpillRingBuffer(shape=shape, dtype=dtype, spill_to=spill_to, ram_size=ram_size,
+                                          double=double, axisorder=axisorder, fill=fill, pyramid=pyramid)
+            self._own_buffer = True
+            return
+        self.buffer = RingBuffer(shape=shape, dtype=dtype, double=double, axisorder=axisorder, shmem=shmem, fill=fill,
+                                 pyramid=pyramid)
         self._own_buffer = True
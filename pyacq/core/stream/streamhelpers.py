@@ -2,6 +2,10 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import time
+import threading
+import numpy as np
+
 from .arraytools import make_dtype
 from pyacq.core.rpc.proxy import ObjectProxy
 
@@ -46,10 +50,123 @@ class DataReceiver:
         #~ if 'dtype' in self.params:
             #~ self.params['dtype'] = make_dtype(self.params['dtype'])
         self.buffer = None
+        self._dtype_key = None
+        self._dtype = None
+
+    @property
+    def dtype(self):
+        """The stream dtype as a numpy dtype.
+        
+        make_dtype() is too slow to call for every packet, so the result is
+        cached until ``params['dtype']`` is replaced.
+        """
+        dt = self.params['dtype']
+        if dt is not self._dtype_key:
+            self._dtype = make_dtype(dt)
+            self._dtype_key = dt
+        return self._dtype
             
     def recv(self, return_data=False):
         raise NotImplementedError()
     
     def close(self):
         pass
+
+
+class CoalescingSender(DataSender):
+    """Wrap a DataSender to merge consecutive small chunks into larger ones.
     
+    Chunks are copied into a preallocated buffer of *size* frames, which is
+    sent when full, when a chunk does not follow the previous one (gap in
+    index, different shape or dtype), or at the latest *max_latency* seconds
+    after its first frame was buffered (checked by a background thread).
+    The index sent with each merged chunk is that of its last frame, so
+    receivers see the same index semantics as without coalescing.
+    
+    Note: this class is usually not instantiated directly; use
+    ``OutputStream.configure(coalesce_samples=N, coalesce_max_latency=ms)``.
+    """
+    def __init__(self, sender, size, max_latency=None):
+        DataSender.__init__(self, sender.socket, sender.params)
+        self.sender = sender
+        self.funcs = sender.funcs
+        self.size = size
+        self.max_latency = max_latency
+        
+        shape = tuple(self.params['shape'][1:])
+        self._buffer_args = ((size,) + shape, make_dtype(self.params['dtype']))
+        self._buffer = np.empty(*self._buffer_args)
+        self._n = 0  # number of buffered frames
+        self._index = None  # index of the last buffered frame + 1
+        self._deadline = None
+        self._closed = False
+        
+        # The socket is also used by the flush thread; all sends go through this lock.
+        self._lock = threading.Condition()
+        self._thread = None
+        if max_latency is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def send(self, index, data, **kargs):
+        with self._lock:
+            buf = self._buffer
+            if (kargs or not isinstance(data, np.ndarray) or data.dtype != buf.dtype
+                    or data.shape[1:] != buf.shape[1:]):
+                self._flush()
+                self.sender.send(index, data, **kargs)
+                return
+            
+            dsize = data.shape[0]
+            if self._n > 0 and (index - dsize != self._index or self._n + dsize > self.size):
+                self._flush()
+            if dsize >= self.size:
+                self.sender.send(index, data)
+                return
+            
+            self._buffer[self._n:self._n+dsize] = data
+            if self._n == 0 and self.max_latency is not None:
+                self._deadline = time.perf_counter() + self.max_latency
+                self._lock.notify()
+            self._n += dsize
+            self._index = index
+            if self._n == self.size:
+                self._flush()
+
+    def flush(self):
+        """Send any buffered frames now.
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._n == 0:
+            return
+        # Hand the buffer over to the sender (which may not copy it) and
+        # start a new one.
+        data = self._buffer[:self._n]
+        self._buffer = np.empty(*self._buffer_args)
+        self._n = 0
+        self._deadline = None
+        self.sender.send(self._index, data)
+
+    def _run(self):
+        with self._lock:
+            while not self._closed:
+                if self._deadline is None:
+                    self._lock.wait()
+                    continue
+                dt = self._deadline - time.perf_counter()
+                if dt > 0:
+                    self._lock.wait(dt)
+                else:
+                    self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._closed = True
+            self._lock.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.sender.close()
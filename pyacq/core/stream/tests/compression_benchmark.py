@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Compare compression methods on representative signals: compression ratio
+and encode / decode throughput.
+
+    python compression_benchmark.py [method ...]
+"""
+import time
+import sys
+import numpy as np
+
+from pyacq.core.stream.compression import (compression_methods, compress, decompress, get_codec,
+                                           HAVE_ZSTD)
+
+
+def make_signals(n_samples=4096, n_channels=64, sample_rate=1000.):
+    """EEG-like signals: alpha oscillation + 1/f-like drift + white noise, in
+    microvolts, digitized as int16, as 24-bit values in int32, and as float32.
+    """
+    rng = np.random.RandomState(0)
+    t = np.arange(n_samples)[:, None] / sample_rate
+    phase = rng.uniform(0, 2*np.pi, size=n_channels)
+    alpha = 20 * np.sin(2 * np.pi * 10 * t + phase)
+    drift = np.cumsum(rng.normal(scale=0.5, size=(n_samples, n_channels)), axis=0)
+    noise = rng.normal(scale=2, size=(n_samples, n_channels))
+    uv = alpha + drift + noise
+    return {
+        'int16': np.round(uv / 0.1).astype('int16'),  # 0.1 uV/bit
+        'int24': np.round(uv / 0.02235).astype('int32'),  # OpenBCI-like scale
+        'float32': uv.astype('float32'),
+    }
+
+
+def benchmark_method(method, data, nloop=5):
+    codec = get_codec(method)
+    if codec is None:
+        encode = lambda: compress(data, method, data.itemsize)
+        decode = lambda buf: decompress(buf, method)
+    else:
+        encode = lambda: codec.encode(data)
+        decode = lambda buf: codec.decode(buf, data.dtype, data.shape)
+    
+    t_enc, t_dec = [], []
+    for i in range(nloop):
+        t0 = time.perf_counter()
+        buf = encode()
+        t1 = time.perf_counter()
+        decode(buf)
+        t2 = time.perf_counter()
+        t_enc.append(t1 - t0)
+        t_dec.append(t2 - t1)
+    
+    nbytes = data.nbytes
+    return nbytes / len(memoryview(buf).cast('B')), nbytes * 1e-6 / min(t_enc), nbytes * 1e-6 / min(t_dec)
+
+
+if __name__ == '__main__':
+    methods = sys.argv[1:]
+    if len(methods) == 0:
+        methods = list(compression_methods)
+        if HAVE_ZSTD:
+            methods += ['zstd-1', 'zstd-9', 'delta+shuffle+zstd-1', 'delta2+shuffle+zstd',
+                        'delta+bitshuffle+zstd']
+    
+    for name, data in make_signals().items():
+        print('#####', name, data.shape)
+        for method in methods:
+            ratio, enc, dec = benchmark_method(method, data)
+            print(repr(method).ljust(26), 'ratio = %5.2f' % ratio,
+                  'encode = %7.1f MB/s' % enc, 'decode = %7.1f MB/s' % dec)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+"""
+Compare the shared memory backends: time to allocate a buffer and
+time of the first write into it (page faults).
+
+    python sharedmem_benchmark.py [size_in_MB]
+"""
+import time
+import sys
+import numpy as np
+
+from pyacq.core.stream.sharedarray import SharedMem, shm_backends
+
+
+def benchmark_sharedmem(backend, nbytes, populate=False, hugepages=False):
+    t0 = time.perf_counter()
+    try:
+        shm = SharedMem(nbytes=nbytes, backend=backend, populate=populate, hugepages=hugepages)
+    except OSError as e:
+        print(backend.ljust(9), 'populate=%d hugepages=%d' % (populate, hugepages), 'failed:', e)
+        return
+    t1 = time.perf_counter()
+    arr = shm.to_numpy(offset=0, dtype='uint8', shape=(nbytes,))
+    arr[:] = 1
+    t2 = time.perf_counter()
+    arr[:] = 2
+    t3 = time.perf_counter()
+    
+    print(backend.ljust(9), 'populate=%d hugepages=%d' % (populate, hugepages),
+          'alloc = %0.02f ms' % ((t1-t0)*1000),
+          'first write = %0.02f ms' % ((t2-t1)*1000),
+          'second write = %0.02f ms' % ((t3-t2)*1000))
+    
+    del arr
+    shm.close()
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    nbytes = size * 1024 * 1024
+    print('Buffer size: %d MB' % size)
+    for backend in shm_backends:
+        for populate in (False, True):
+            for hugepages in (False, True):
+                benchmark_sharedmem(backend, nbytes, populate=populate, hugepages=hugepages)
@@ -7,8 +7,8 @@ import numpy as np
 import cProfile
 import sys
 
-from test_stream import protocols, compressions
-from pyacq.core.stream  import OutputStream, InputStream
+from test_stream import protocols
+from pyacq.core.stream  import OutputStream, InputStream, compression_methods as compressions
 
 
 def benchmark_stream(protocol, transfermode, compression, chunksize, nb_channels=16, nloop=10, profile=False):
@@ -52,8 +52,45 @@ def benchmark_stream(protocol, transfermode, compression, chunksize, nb_channels
     return dt
 
 
+def benchmark_small_chunks(transfermode, chunksize, protocol='inproc', nb_channels=16, nloop=2000):
+    """Measure per-packet send+recv overhead for small chunks, where header
+    packing and parsing dominate over the data copy.
+    """
+    outstream = OutputStream()
+    outstream.configure(protocol=protocol, interface='127.0.0.1', port='*',
+                        transfermode=transfermode, streamtype='analogsignal',
+                        dtype='float32', shape=(-1, nb_channels), buffer_size=chunksize*20)
+    time.sleep(.5)
+    instream = InputStream()
+    instream.connect(outstream)
+    
+    arr = np.random.rand(chunksize, nb_channels).astype('float32')
+    
+    # warm up
+    for i in range(10):
+        outstream.send(arr)
+        instream.recv()
+    
+    start = time.perf_counter()
+    for i in range(nloop):
+        outstream.send(arr)
+        instream.recv()
+    dt = (time.perf_counter() - start) / nloop
+    
+    outstream.close()
+    instream.close()
+    
+    print(transfermode.ljust(10), protocol.ljust(6), 'chunksize = %3d' % chunksize,
+          'per packet = %0.01f us' % (dt*1e6))
+    return dt
+
+
+if len(sys.argv) > 1 and sys.argv[1] == 'small':
+    for chunksize in [16, 32, 64]:
+        for transfermode in ['plaindata', 'ndarray', 'rawbytes', 'sharedmem']:
+            benchmark_small_chunks(transfermode, chunksize)
 
-if len(sys.argv) > 1 and sys.argv[1] == 'profile':
+elif len(sys.argv) > 1 and sys.argv[1] == 'profile':
     benchmark_stream(protocol='inproc', transfermode='plaindata', 
                     compression='', chunksize=100000, nb_channels=16,
                     profile=True, nloop=100)
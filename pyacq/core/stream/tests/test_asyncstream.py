@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import time
+import asyncio
+import threading
+import numpy as np
+
+from pyacq.core.stream import OutputStream, InputStream, AsyncInputStream, AsyncOutputStream
+
+
+def test_async_input_stream():
+    n_streams = 20
+    outstreams = []
+    instreams = []
+    for i in range(n_streams):
+        outstream = OutputStream()
+        outstream.configure(protocol='inproc', transfermode='plaindata', dtype='float32', shape=(-1, 2))
+        instream = AsyncInputStream()
+        instream.connect(outstream)
+        outstreams.append(outstream)
+        instreams.append(instream)
+    
+    async def consume(instream, n):
+        indexes = []
+        async for index, data in instream:
+            assert data.shape == (10, 2)
+            indexes.append(index)
+            if len(indexes) == n:
+                return indexes
+    
+    async def main():
+        consumers = [asyncio.ensure_future(consume(instream, 5)) for instream in instreams]
+        await asyncio.sleep(.2)
+        for i in range(5):
+            for outstream in outstreams:
+                outstream.send(np.zeros((10, 2), dtype='float32'))
+            await asyncio.sleep(0)
+        return await asyncio.wait_for(asyncio.gather(*consumers), 5)
+    
+    results = asyncio.run(main())
+    for indexes in results:
+        assert indexes == [10, 20, 30, 40, 50]
+    
+    for outstream, instream in zip(outstreams, instreams):
+        outstream.close()
+        instream.close()
+
+
+def test_async_output_stream():
+    outstream = AsyncOutputStream()
+    outstream.configure(protocol='tcp', transfermode='plaindata', dtype='int16', shape=(-1, 3))
+    instream = AsyncInputStream()
+    instream.connect(outstream)
+    
+    async def main():
+        await asyncio.sleep(.2)
+        arr = np.arange(30, dtype='int16').reshape(10, 3)
+        await outstream.send(arr)
+        index, data = await instream.recv()
+        assert index == 10
+        assert np.all(data == arr)
+        # nothing else is waiting
+        assert not await instream.poll(timeout=50)
+    
+    asyncio.run(main())
+    outstream.close()
+    instream.close()
+
+
+def test_async_channel_groups():
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='plaindata', dtype='float32', shape=(-1, 8),
+                        channel_groups=4)
+    instream = AsyncInputStream()
+    instream.connect(outstream, channels=[6, 1])
+    assert instream.params['shape'][1] == 2
+    
+    async def main():
+        await asyncio.sleep(.2)
+        arr = np.arange(80, dtype='float32').reshape(10, 8)
+        outstream.send(arr)
+        index, data = await asyncio.wait_for(instream.recv(), 5)
+        assert index == 10
+        assert np.all(data == arr[:, [6, 1]])
+    
+    asyncio.run(main())
+    outstream.close()
+    instream.close()
+
+
+def test_async_channel_groups_missing_group():
+    # a chunk whose channel groups do not all arrive must not block the loop
+    outstream = OutputStream()
+    outstream.configure(protocol='tcp', transfermode='plaindata', dtype='float32', shape=(-1, 8),
+                        channel_groups=4)
+    instream = AsyncInputStream()
+    instream.connect(outstream, channels=[1, 6])
+    arr = np.arange(80, dtype='float32').reshape(10, 8)
+    
+    def send():
+        time.sleep(.2)
+        # the second group of the first chunk is lost
+        group_sender = outstream.sender.group_senders[1]
+        send_group = group_sender.send
+        group_sender.send = lambda index, data: None
+        outstream.send(arr)
+        group_sender.send = send_group
+        time.sleep(.3)
+        outstream.send(arr)
+    
+    async def main():
+        ticks = 0
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(.01)
+                ticks += 1
+        ticker = asyncio.ensure_future(tick())
+        thread = threading.Thread(target=send)
+        thread.start()
+        index, data = await asyncio.wait_for(instream.recv(), 5)
+        thread.join()
+        ticker.cancel()
+        assert index == 20
+        assert np.all(data == arr[:, [1, 6]])
+        assert ticks > 30
+    
+    asyncio.run(main())
+    outstream.close()
+    instream.close()
+
+
+if __name__ == '__main__':
+    test_async_input_stream()
+    test_async_output_stream()
+    test_async_channel_groups()
+    test_async_channel_groups_missing_group()
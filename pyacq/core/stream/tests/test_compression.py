@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import numpy as np
+import pytest
+from pyacq.core.stream.compression import get_codec, compression_methods, HAVE_ZSTD
+
+
+def test_codecs():
+    rng = np.random.RandomState(0)
+    signal = np.cumsum(rng.normal(size=(257, 7)), axis=0) * 50
+    methods = [m for m in compression_methods if get_codec(m) is not None]
+    methods += ['delta2+shuffle+zlib-9', 'bitshuffle+zlib', 'delta+delta2+zlib']
+    for dtype in ('int16', 'uint8', 'int32', 'float32', 'float64'):
+        data = signal.astype(dtype)
+        for method in methods:
+            # sender and receiver have separate codecs; reuse them across chunks
+            enc, dec = get_codec(method), get_codec(method)
+            for chunk in (data, data[:100], data[:0]):
+                buf = enc.encode(chunk)
+                out = dec.decode(buf, chunk.dtype, chunk.shape)
+                assert out.shape == chunk.shape
+                assert out.dtype == chunk.dtype
+                assert np.all(out.view('u1') == chunk.view('u1'))
+    
+    # preconditioning helps on slowly varying integer signals
+    data = signal.astype('int16')
+    assert len(get_codec('delta+shuffle+zlib').encode(data)) < len(get_codec('zlib').encode(data))
+
+
+def test_codec_errors():
+    assert get_codec('') is None
+    for method in ('foo', 'zlib-x', 'delta+foo+zlib', 'bitshuffle+delta+zlib'):
+        with pytest.raises(ValueError):
+            get_codec(method)
+    if not HAVE_ZSTD:
+        with pytest.raises(ValueError):
+            get_codec('zstd')
+
+
+if __name__ == '__main__':
+    test_codecs()
+    test_codec_errors()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2016, French National Center for Scientific Research (CNRS)
+# Distributed under the (new) BSD License. See LICENSE for more info.
+
+import numpy as np
+import pytest
+from pyacq.core.stream import ChunkConverter
+
+
+def params(dtype, n_channels, **kargs):
+    return dict(dtype=dtype, shape=(-1, n_channels), **kargs)
+
+
+def test_chunk_converter():
+    rng = np.random.RandomState(0)
+    data = rng.randint(-2000, 2000, size=(100, 8)).astype('int16')
+
+    # nothing to convert: the chunk is passed through
+    conv = ChunkConverter(params('int16', 8), params('int16', 8))
+    assert conv.steps == []
+    assert conv.convert(data) is data
+
+    # dtype only
+    conv = ChunkConverter(params('int16', 8), params('float32', 8))
+    assert conv.steps == ['astype']
+    out = conv.convert(data)
+    assert out.dtype == 'float32'
+    assert np.array_equal(out, data)
+
+    # int16 counts to float32 volts, with per-channel scale
+    scale = np.linspace(0.1, 0.8, 8)
+    conv = ChunkConverter(params('int16', 8, scale=list(scale), offset=1.), params('float32', 8))
+    out = conv.convert(data)
+    assert out.dtype == 'float32'
+    assert np.allclose(out, data * scale + 1., rtol=1e-6)
+
+    # and back: rounded, clipped
+    conv = ChunkConverter(params('float64', 8), params('int16', 8, scale=0.5))
+    volts = data * 0.5 + 0.2
+    volts[0, 0] = 1e6
+    out = conv.convert(volts)
+    assert out.dtype == 'int16'
+    assert out[0, 0] == 32767
+    assert np.array_equal(out[1:], data[1:])
+
+    # contiguous and arbitrary channel selection, with and without rescaling
+    for channels in ([2, 3, 4], [5, 0, 3]):
+        conv = ChunkConverter(params('int16', 8), params('int16', 3), channels=channels)
+        assert conv.steps == ['select']
+        assert np.array_equal(conv.convert(data), data[:, channels])
+        conv = ChunkConverter(params('int16', 8, scale=list(scale)), params('float64', 3), channels=channels)
+        assert np.allclose(conv.convert(data), data[:, channels] * scale[channels])
+
+    # buffers are reused across chunks, and grown as needed
+    conv = ChunkConverter(params('int16', 8), params('float32', 8))
+    out1 = conv.convert(data[:50])
+    out2 = conv.convert(data[50:])
+    assert np.shares_memory(out1, out2)
+    assert np.array_equal(conv.convert(data), data)
+    conv = ChunkConverter(params('int16', 8), params('float32', 8), reuse_buffer=False)
+    assert not np.shares_memory(conv.convert(data[:50]), conv.convert(data[50:]))
+
+    with pytest.raises(ValueError):
+        ChunkConverter(params('int16', 8), params('int16', 4))
+    with pytest.raises(ValueError):
+        ChunkConverter(params('int16', 8), params('int16', 3), channels=[0, 1])
+
+
+if __name__ == '__main__':
+    test_chunk_converter()
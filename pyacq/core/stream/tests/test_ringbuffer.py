@@ -2,9 +2,13 @@
 # Copyright (c) 2016, French National Center for Scientific Research (CNRS)
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
+import os
+import tempfile
+import threading
 import numpy as np
 import pytest
-from pyacq.core.stream import OutputStream, InputStream, RingBuffer
+from pyacq.core.stream import OutputStream, InputStream, RingBuffer, RingBufferOverrun, SpillRingBuffer
+from pyacq.core.stream.sharedarray import HAVE_MIRROR
 
 
 def test_ringbuffer():
@@ -142,7 +146,270 @@ def test_ringbuffer_shm():
     assert np.all(buf1[:] == buf2[:])
 
 
+@pytest.mark.skipif(not HAVE_MIRROR, reason='mirrored memory not available')
+def test_ringbuffer_mirror():
+    # 10 frames of 5*7 bytes is not a whole page: length is rounded up
+    buf1 = RingBuffer(shape=(10, 5, 7), dtype=np.ubyte, double='mirror')
+    assert buf1.shape[0] >= 10
+    assert (buf1.shape[0] * 35) % 4096 == 0
+    buf2 = RingBuffer(shape=buf1.shape, dtype=np.ubyte, double=True)
+    assert np.all(buf1[:] == buf2[:])
+    
+    with pytest.raises(ValueError):
+        RingBuffer(shape=(10, 5, 7), dtype=np.ubyte, double='mirror', axisorder=(1, 0, 2))
+    
+    # both halves map the same memory
+    bsize = buf1.shape[0]
+    buf1.new_chunk(np.ones((5, 5, 7), dtype=np.ubyte))
+    buf2.new_chunk(np.ones((5, 5, 7), dtype=np.ubyte))
+    assert np.all(buf1.buffer[:bsize] == buf1.buffer[bsize:])
+    
+    # compare against a double buffer, including chunks crossing the ring break
+    for i in range(20):
+        n = np.random.randint(1, bsize)
+        d = np.random.randint(0, 255, size=(n, 5, 7)).astype(np.ubyte)
+        buf1.new_chunk(d)
+        buf2.new_chunk(d, index=buf1.index())
+        assert np.all(buf1[:] == buf2[:])
+        assert np.all(buf1[-n:] == d)
+        # reads across the break are still zero-copy
+        a = buf1.get_data(buf1.first_index(), buf1.index())
+        assert not a.flags['OWNDATA']
+    
+    # shared memory
+    buf3 = RingBuffer(shape=(100, 4), dtype='float32', double='mirror', shmem=True)
+    buf4 = RingBuffer(shape=(100, 4), dtype='float32', double='mirror', shmem=buf3.shm_id)
+    assert buf3.shape == buf4.shape
+    d = np.random.normal(size=(buf3.shape[0] - 10, 4)).astype('float32')
+    buf3.new_chunk(d)
+    buf3.new_chunk(d)
+    assert buf4.index() == buf3.index()
+    assert np.all(buf4[-d.shape[0]:] == d)
+    assert not buf4.buffer.flags['WRITEABLE']
+
+
+def test_ringbuffer_validate():
+    buf1 = RingBuffer(shape=(100, 3), dtype='float64', double=False, shmem=True)
+    buf2 = RingBuffer(shape=(100, 3), dtype='float64', double=False, shmem=buf1.shm_id)
+    
+    def chunk(start, stop):
+        return np.repeat(np.arange(start, stop, dtype='float64')[:, None], 3, axis=1)
+    
+    buf1.new_chunk(chunk(0, 70))
+    assert buf1._write_seq == 2
+    a = buf2.get_data(10, 70, validate=True)
+    assert np.all(a == chunk(10, 70))
+    a[:] = -1
+    assert np.all(buf2[10:70] == chunk(10, 70))
+    with pytest.raises(IndexError):
+        buf2.get_data(10, 71, validate=True)
+    
+    # crosses the ring break
+    buf1.new_chunk(chunk(70, 150))
+    a, b = buf2.get_data(60, 150, validate=True, join=False)
+    assert np.all(np.concatenate([a, b]) == chunk(60, 150))
+    with pytest.raises(RingBufferOverrun):
+        buf2.get_data(49, 150, validate=True)
+    
+    # concurrent writer: every validated read must be consistent
+    done = threading.Event()
+    def writer():
+        for i in range(150, 100000, 7):
+            buf1.new_chunk(chunk(i, i+7))
+        done.set()
+    thread = threading.Thread(target=writer)
+    thread.start()
+    n_ok = 0
+    while not done.is_set():
+        stop = buf2.index()
+        try:
+            data = buf2.get_data(stop-95, stop, validate=True)
+        except RingBufferOverrun:
+            continue
+        assert np.all(data == chunk(stop-95, stop))
+        n_ok += 1
+    thread.join()
+    assert n_ok > 0
+
+
+def test_ringbuffer_cursor():
+    for double in (False, True):
+        buf = RingBuffer(shape=(100, 2), dtype='float64', double=double)
+        chunk = lambda start, stop: np.repeat(np.arange(start, stop, dtype='float64')[:, None], 2, axis=1)
+        
+        cur1 = buf.cursor()
+        cur2 = buf.cursor()
+        start, stop, (a, b) = cur1.read()
+        assert (start, stop) == (0, 0)
+        assert a.shape[0] + b.shape[0] == 0
+        
+        buf.new_chunk(chunk(0, 60))
+        start, stop, (a, b) = cur1.read(max_size=50)
+        assert (start, stop) == (0, 50)
+        assert np.all(np.concatenate([a, b]) == chunk(0, 50))
+        assert cur1.lag() == 10
+        
+        # crosses the ring break
+        buf.new_chunk(chunk(60, 120))
+        start, stop, (a, b) = cur1.read()
+        assert (start, stop) == (50, 120)
+        assert np.all(np.concatenate([a, b]) == chunk(50, 120))
+        if not double:
+            assert a.shape[0] == 50 and b.shape[0] == 20
+        else:
+            assert b.shape[0] == 0
+        assert cur1.lost_samples == 0
+        assert cur1.lag() == 0
+        
+        # cur2 has not read anything and has fallen behind
+        start, stop, (a, b) = cur2.read(copy=True)
+        assert (start, stop) == (20, 120)
+        assert np.all(np.concatenate([a, b]) == chunk(20, 120))
+        stats = cur2.stats()
+        assert stats['lost_samples'] == 20
+        assert stats['n_overruns'] == 1
+        assert stats['max_lag'] == 120
+        assert stats['lag'] == 0
+        
+        # the writer advances between the overrun check and the read
+        cur3 = buf.cursor(index=0)
+        check_overrun = cur3._skip_overrun
+        def skip_then_write():
+            check_overrun()
+            if buf.index() == 120:
+                buf.new_chunk(chunk(120, 200))
+        cur3._skip_overrun = skip_then_write
+        start, stop, (a, b) = cur3.read()
+        assert (start, stop) == (100, 200)
+        assert np.all(np.concatenate([a, b]) == chunk(100, 200))
+        assert cur3.lost_samples == 100
+
+
+def test_ringbuffer_pyramid():
+    data = np.random.normal(size=(5000, 3)).astype('float32')
+    for shmem in (None, True):
+        buf = RingBuffer(shape=(2048, 3), dtype='float32', double=True, shmem=shmem, pyramid=True)
+        pyramid = buf.pyramid
+        assert pyramid.factors[0] == 8
+        assert pyramid.factors[-1] == 16
+        if shmem:
+            buf2 = RingBuffer(shape=(2048, 3), dtype='float32', double=True, shmem=buf.shm_id,
+                              pyramid=pyramid.shm_ids)
+            assert buf2.pyramid.factors == pyramid.factors
+        else:
+            buf2 = buf
+        
+        pos = 0
+        for size in [3, 5, 100, 1000, 13, 2000, 1879]:
+            buf.new_chunk(data[pos:pos+size])
+            pos += size
+        assert pos == 5000
+        
+        start, stop = pos - 1600, pos - pos % 16
+        for target, factor in [(50, 16), (150, 8), (1000, 1)]:
+            f, mins, maxs, means = buf2.get_decimated(start, stop, target, validate=True)
+            assert f == factor
+            first = -(-start // f) * f
+            ref = data[first:stop].reshape(-1, f, 3)
+            assert mins.shape == ref.shape[:1] + (3,)
+            assert np.allclose(mins, ref.min(axis=1))
+            assert np.allclose(maxs, ref.max(axis=1))
+            assert np.allclose(means, ref.mean(axis=1), atol=1e-5)
+        
+        # skipped data is filled with nan in all levels
+        buf.new_chunk(data[:100], index=pos + 200)
+        f, mins, maxs, means = buf2.get_decimated(pos, pos + 96, 5)
+        assert f == 16
+        assert np.all(np.isnan(mins))
+
+
+def test_ringbuffer_get_data_out():
+    data = np.random.normal(size=(300, 6)).astype('float32')
+    for double in (False, True):
+        for axisorder in (None, (1, 0)):
+            buf = RingBuffer(shape=(100, 6), dtype='float32', double=double, axisorder=axisorder)
+            buf.new_chunk(data[:90], index=90)
+            buf.new_chunk(data[90:180], index=180)
+            buf.new_chunk(data[180:250], index=250)
+            for start, stop in [(160, 200), (180, 250), (150, 150)]:
+                ref = data[start:stop]
+                assert np.all(buf.get_data(start, stop, channels=[4, 1]) == ref[:, [4, 1]])
+                assert np.all(buf.get_data(start, stop, channels=2) == ref[:, 2])
+                assert np.all(buf.get_data(start, stop, channels=slice(1, 4)) == ref[:, 1:4])
+                
+                d = buf.get_data(start, stop, channels=[0, 5], dtype='float64', validate=True)
+                assert d.dtype == 'float64'
+                assert np.all(d == ref[:, [0, 5]].astype('float64'))
+                
+                out = np.empty((6, stop-start), dtype='float64').T
+                d = buf.get_data(start, stop, out=out)
+                assert d is out
+                assert np.all(out == ref)
+                
+                out = np.empty((stop-start, 2), dtype='float32')
+                buf.get_data(start, stop, out=out, channels=[3, 0])
+                assert np.all(out == ref[:, [3, 0]])
+            
+            with pytest.raises(ValueError):
+                buf.get_data(160, 200, out=np.empty((40, 3)))
+
+
+def test_spill_ringbuffer():
+    data = np.arange(2000 * 3, dtype='float32').reshape(2000, 3)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for double in (False, True):
+            buf = SpillRingBuffer(shape=(500, 3), dtype='float32', spill_to=tmpdir, ram_size=64,
+                                  double=double, axisorder=(1, 0))
+            assert buf.shape == (64, 3)
+            assert os.path.dirname(buf.filename) == tmpdir
+            
+            # before any data: history is filled with nan
+            assert np.all(np.isnan(buf[-10:]))
+            
+            for i in range(0, 1200, 40):
+                buf.new_chunk(data[i:i+40])
+            assert buf.index() == 1200
+            assert buf.first_index() == 700
+            
+            # recent data comes from the RAM ring, older data from disk
+            assert np.all(buf.get_data(1150, 1200) == data[1150:1200])
+            assert np.all(buf.get_data(700, 1200) == data[700:1200])
+            assert np.all(buf[-500:] == data[700:1200])
+            assert np.all(buf[710] == data[710])
+            a, b = buf.get_data(900, 1100, join=False)
+            assert np.all(np.concatenate([a, b]) == data[900:1100])
+            
+            d = buf.get_data(750, 1190, channels=[2, 0], validate=True)
+            assert np.all(d == data[750:1190][:, [2, 0]])
+            with pytest.raises(IndexError):
+                buf.get_data(699, 1000)
+            with pytest.raises(RingBufferOverrun):
+                buf.get_data(699, 1000, validate=True)
+            
+            # skipped data is filled on disk too
+            buf.new_chunk(data[1600:1640], index=1640)
+            assert np.all(buf.get_data(1600, 1640) == data[1600:1640])
+            assert np.all(np.isnan(buf.get_data(1200, 1600)))
+            assert np.all(buf.get_data(1140, 1200) == data[1140:1200])
+            
+            # cursors see the whole history
+            cur = buf.cursor(index=1140)
+            start, stop, (a, b) = cur.read(max_size=100)
+            assert (start, stop) == (1140, 1240)
+            assert np.all(a[:60] == data[1140:1200])
+            buf.close()
+            # the temporary file is deleted; arrays read from it stay valid
+            assert not os.path.exists(buf.filename)
+            assert np.all(a[:60] == data[1140:1200])
+        assert os.listdir(tmpdir) == []
+
 
 if __name__ =='__main__':
     test_ringbuffer()
-    test_ringbuffer_shm()
\ No newline at end of file
+    test_ringbuffer_shm()
+    test_ringbuffer_mirror()
+    test_ringbuffer_validate()
+    test_ringbuffer_cursor()
+    test_ringbuffer_pyramid()
+    test_ringbuffer_get_data_out()
+    test_spill_ringbuffer()
\ No newline at end of file
@@ -3,7 +3,7 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 
-from pyacq.core.stream.sharedarray import SharedArray, SharedMem
+from pyacq.core.stream.sharedarray import SharedArray, SharedMem, shm_backends
 import numpy as np
 import pyqtgraph.multiprocess as mp
 
@@ -18,6 +18,24 @@ def test_sharedmem():
     assert not arr2.flags['WRITEABLE']
 
 
+def test_sharedmem_backends():
+    for backend in shm_backends:
+        for populate in (False, True):
+            shm1 = SharedMem(nbytes=10000, backend=backend, populate=populate)
+            assert shm1.backend == backend
+            arr1 = shm1.to_numpy(offset=0, shape=10000, dtype='ubyte')
+            assert np.all(arr1 == 0)
+            arr1[:] = np.arange(10000) % 256
+            
+            shm2 = SharedMem(nbytes=10000, shm_id=shm1.shm_id)
+            arr2 = shm2.to_numpy(offset=0, shape=10000, dtype='ubyte')
+            assert np.all(arr1 == arr2)
+            
+            del arr1, arr2
+            shm2.close()
+            shm1.close()
+
+
 def test_sharedarray():    
     sa = SharedArray(shape=(10), dtype = 'int32')
     np_a = sa.to_numpy()
@@ -47,5 +65,6 @@ def test_sharedarray_multiprocess():
     
 if __name__ == '__main__':
     test_sharedmem()
+    test_sharedmem_backends()
     test_sharedarray()
     test_sharedarray_multiprocess()
@@ -4,11 +4,18 @@
 
 import time
 import timeit
+import threading
 import pytest
 import sys
 import os
+import tempfile
+import struct
+import zmq
 
 from pyacq.core.stream import OutputStream, InputStream, RingBuffer, compression_methods
+from pyacq.core.stream.sharedarray import shm_backends, HAVE_MIRROR
+from pyacq.core.stream.multicast import MulticastSocket
+from pyacq.core.rpc import log
 import numpy as np
 
 
@@ -32,6 +39,61 @@ def test_stream_sharedmem():
         check_stream(chunksize=chunksize, chan_shape=chan_shape, buffer_size=shm_size,
                      transfermode='sharedmem', protocol=protocol,
                      dtype=dtype)
+    for shm_backend in shm_backends:
+        check_stream(chunksize=chunksize, chan_shape=chan_shape, buffer_size=shm_size,
+                     transfermode='sharedmem', protocol='tcp', dtype=dtype,
+                     shm_backend=shm_backend, shm_populate=True)
+
+def test_stream_inprocobject():
+    for protocol in protocols:
+        check_stream(transfermode='inprocobject', protocol=protocol)
+    
+    outstream = OutputStream()
+    outstream.configure(protocol='inproc', transfermode='inprocobject', dtype='float32', shape=(-1, 4))
+    outstream.send(np.zeros((10, 4), dtype='float32'))  # no receiver yet
+    instreams = [InputStream(), InputStream()]
+    for instream in instreams:
+        instream.connect(outstream)
+    time.sleep(.1)
+    
+    arr = np.random.rand(100, 4).astype('float32')
+    outstream.send(arr)
+    for instream in instreams:
+        index, data = instream.recv()
+        assert index == 110
+        # same memory, not writable
+        assert np.shares_memory(data, arr)
+        assert not data.flags.writeable
+    
+    for instream in instreams:
+        instream.close()
+    outstream.close()
+    
+    # a receiver that falls behind loses the oldest chunks
+    outstream = OutputStream()
+    outstream.configure(protocol='inproc', transfermode='inprocobject', dtype='float32', shape=(-1, 4),
+                        object_queue_size=5)
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    outstream.send(np.full((10, 4), 0, dtype='float32'))
+    instream.recv()
+    for i in range(1, 9):
+        outstream.send(np.full((10, 4), i, dtype='float32'))
+    for i in range(4, 9):
+        index, data = instream.recv()
+        assert index == (i + 1) * 10
+        assert np.all(data == i)
+    assert instream.receiver.discarded_chunks == 3
+    assert instream.gaps == 1 and instream.dropped_samples == 30
+    instream.close()
+    outstream.close()
+    
+    with pytest.raises(ValueError):
+        outstream = OutputStream()
+        outstream.configure(protocol='inproc', transfermode='inprocobject', dtype='float32', shape=(-1, 4),
+                            object_queue_size=10, sndhwm=100)
+
             
 def check_stream(chunksize=1024, chan_shape=(16,), **kwds):
     chunk_shape = (chunksize,) + chan_shape
@@ -74,6 +136,8 @@ def test_plaindata_ringbuffer():
 def test_sharedmem_ringbuffer():
     check_stream_ringbuffer(transfermode='sharedmem', buffer_size=4096)
     check_stream_ringbuffer(transfermode='sharedmem', buffer_size=4096, axisorder=(1, 0))
+    if HAVE_MIRROR:
+        check_stream_ringbuffer(transfermode='sharedmem', buffer_size=4096, double='mirror')
     
 def check_stream_ringbuffer(**kwds):
     chunk_shape = (-1, 16)
@@ -96,6 +160,10 @@ def check_stream_ringbuffer(**kwds):
     # Make sure we are re-using sharedmem buffer
     if instream.receiver.buffer is not None:
         assert instream._own_buffer is False
+        # the shared buffer has no pyramid, but is still reused if it is optional
+        instream.set_buffer(stream_spec['buffer_size'], axisorder=stream_spec['axisorder'],
+                    double=stream_spec['double'], pyramid='optional')
+        assert instream.buffer is instream.receiver.buffer
         
     time.sleep(.1)
     
@@ -111,11 +179,414 @@ def check_stream_ringbuffer(**kwds):
     
 
 
+def test_stream_spill_buffer():
+    outstream = OutputStream()
+    outstream.configure(protocol='inproc', transfermode='plaindata', dtype='float32', shape=(-1, 4))
+    instream = InputStream()
+    instream.connect(outstream)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        instream.set_buffer(1000, spill_to=tmpdir, ram_size=100)
+        old_buffer = instream.buffer
+        assert os.path.exists(old_buffer.filename)
+        # replacing the buffer closes the previous history file
+        instream.set_buffer(2000, spill_to=tmpdir, ram_size=100)
+        assert not os.path.exists(old_buffer.filename)
+        # closing the stream closes its history file
+        instream.close()
+        assert os.listdir(tmpdir) == []
+    outstream.close()
+
+
+def test_stream_legacy_headers():
+    # receivers still accept version 1 packet headers
+    arr = np.random.rand(64, 4).astype('float32')
+    for transfermode in ('plaindata', 'ndarray'):
+        outstream = OutputStream()
+        outstream.configure(protocol='inproc', transfermode=transfermode, dtype='float32', shape=(-1, 4))
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        
+        if transfermode == 'plaindata':
+            header = struct.pack('!QQQQQqq', 2, 64, 0, 64, 4, 16, 4)
+            outstream.socket.send_multipart([header, arr])
+        else:
+            outstream.socket.send_json(dict(dtype='float32', shape=(64, 4), index=64), zmq.SNDMORE)
+            outstream.socket.send(arr)
+        index, arr2 = instream.recv(return_data=True)
+        assert index == 64
+        assert np.all(arr2 == arr)
+        
+        outstream.send(arr, index=128)
+        index, arr2 = instream.recv(return_data=True)
+        assert index == 128
+        assert np.all(arr2 == arr)
+        
+        outstream.close()
+        instream.close()
+
+
+def test_stream_recv_all():
+    arr = np.random.rand(100, 4).astype('float32')
+    outstream = OutputStream()
+    outstream.configure(protocol='inproc', transfermode='plaindata', dtype='float32', shape=(-1, 4))
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    
+    assert instream.recv_all() == (None, None)
+    
+    for i in range(10):
+        outstream.send(arr[i*10:(i+1)*10])
+    time.sleep(.1)
+    index, data = instream.recv_all(max_packets=4)
+    assert index == 40
+    assert np.all(data == arr[:40])
+    index, data = instream.recv_all()
+    assert index == 100
+    assert np.all(data == arr[40:])
+    
+    # a gap splits the result
+    outstream.send(arr[:10], index=110)
+    outstream.send(arr[10:20], index=130)
+    outstream.send(arr[20:30], index=140)
+    time.sleep(.1)
+    index, data = instream.recv_all()
+    assert index == 110
+    assert instream.poll(0)
+    index, data = instream.recv_all()
+    assert index == 140
+    assert np.all(data == arr[10:30])
+    
+    outstream.send(arr[:10], index=150)
+    outstream.send(arr[10:20], index=160)
+    time.sleep(.1)
+    index, packets = instream.recv_all(concat=False)
+    assert index == 160
+    assert [p[0] for p in packets] == [150, 160]
+    
+    outstream.close()
+    instream.close()
+
+
+def test_stream_coalesce():
+    arr = np.random.rand(100, 4).astype('float32')
+    for transfermode in ('plaindata', 'sharedmem'):
+        outstream = OutputStream()
+        outstream.configure(protocol='inproc', transfermode=transfermode, dtype='float32', shape=(-1, 4),
+                            buffer_size=200, coalesce_samples=10, coalesce_max_latency=50.)
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        
+        # single samples are merged in chunks of 10
+        for i in range(25):
+            outstream.send(arr[i:i+1])
+        for i in range(2):
+            index, data = instream.recv(return_data=True)
+            assert index == (i + 1) * 10
+            assert np.all(data == arr[i*10:(i+1)*10])
+        assert not instream.poll(0)
+        
+        # the remainder is sent after max latency
+        assert instream.poll(1000)
+        index, data = instream.recv(return_data=True)
+        assert index == 25
+        assert np.all(data == arr[20:25])
+        
+        # a gap or a large chunk flushes the buffer
+        outstream.send(arr[25:28])
+        outstream.send(arr[30:32], index=32)
+        outstream.send(arr[32:50])
+        for stop, start in [(28, 25), (32, 30), (50, 32)]:
+            index, data = instream.recv(return_data=True)
+            assert index == stop
+            assert np.all(data == arr[start:stop])
+        
+        outstream.send(arr[50:52])
+        outstream.flush()
+        index, data = instream.recv(return_data=True)
+        assert index == 52
+        
+        outstream.close()
+        instream.close()
+
+
+def test_stream_quantized():
+    rng = np.random.RandomState(0)
+    arr = (rng.normal(size=(200, 4)) * [1, 10, 100, 0]).astype('float32')
+    arr[5, 1] = np.nan
+    for quantize_dtype, scale in [('int16', None), ('int8', None), ('int16', [0.01, 0.1, 1., 1.])]:
+        outstream = OutputStream()
+        outstream.configure(protocol='inproc', transfermode='quantized', dtype='float32', shape=(-1, 4),
+                            quantize_dtype=quantize_dtype, scale=scale, offset=None)
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        
+        qmax = np.iinfo(quantize_dtype).max
+        for chunk in (arr[:100], arr[100:]):
+            outstream.send(chunk)
+            index, data = instream.recv(return_data=True)
+            assert data.dtype == 'float32'
+            assert data.shape == chunk.shape
+            assert np.all(np.isnan(data) == np.isnan(chunk))
+            if scale is None:
+                # the automatic scale is kept while it is at most 3 times the smallest one
+                step = 3 * (np.nanmax(chunk, axis=0) - np.nanmin(chunk, axis=0)) / (2 * qmax)
+                expected = chunk
+            else:
+                step = np.array(scale)
+                expected = np.clip(chunk, -qmax * step, qmax * step)
+            err = np.abs(data - expected)
+            assert np.all((err <= step * 0.5 + 1e-5) | np.isnan(err))
+        
+        # empty chunks
+        outstream.send(arr[:0])
+        index, data = instream.recv(return_data=True)
+        assert data.shape == (0, 4) and data.dtype == 'float32'
+        
+        outstream.close()
+        instream.close()
+
+
+class _MessageQueue:
+    # socket stand-in that keeps the messages sent to it
+    def __init__(self):
+        self.messages = []
+    
+    def send_multipart(self, parts):
+        self.messages.append([bytes(part) for part in parts])
+    
+    def recv_multipart(self):
+        return self.messages.pop(0)
+
+
+def test_stream_quantized_coefs():
+    from pyacq.core.stream.quantizedstream import QuantizedDataSender, QuantizedDataReceiver
+    rng = np.random.RandomState(0)
+    chunk = rng.uniform(-1, 1, size=(32, 4)).astype('float32')
+    header_size = struct.calcsize('<BBBxIQQQ')
+    
+    # a fixed scale is only sent in the stream parameters
+    params = dict(dtype='float32', shape=(-1, 4), quantize_dtype='int8', scale=[0.01] * 4, offset=None)
+    socket = _MessageQueue()
+    sender = QuantizedDataSender(socket, params)
+    receiver = QuantizedDataReceiver(socket, params)
+    sender.send(32, chunk)
+    assert [len(part) for part in socket.messages[0]] == [header_size, chunk.size]
+    index, data = receiver.recv()
+    assert index == 32
+    assert np.allclose(data, chunk, atol=0.005 + 1e-6)
+    
+    # an automatic scale is sent when it changes, and every coefs_interval packets
+    params = dict(params, scale=None, coefs_interval=5)
+    socket = _MessageQueue()
+    sender = QuantizedDataSender(socket, params)
+    chunks = [chunk, chunk * 0.9, chunk, chunk * 2, chunk * 2, chunk * 2, chunk * 2, chunk * 2, chunk * 2]
+    for i, c in enumerate(chunks):
+        sender.send(32 * (i + 1), c)
+    coefs_size = header_size + 2 * 4 * 8
+    sizes = [len(msg[0]) for msg in socket.messages]
+    assert sizes == [coefs_size, header_size, header_size, coefs_size, header_size, header_size,
+                     header_size, header_size, coefs_size]
+    
+    # a receiver that missed the first packet cannot decode the next ones
+    socket.messages.pop(0)
+    receiver = QuantizedDataReceiver(socket, params)
+    for i, c in enumerate(chunks[1:]):
+        index, data = receiver.recv()
+        assert index == 32 * (i + 2)
+        if i < 2:
+            assert np.all(np.isnan(data))
+        else:
+            assert np.allclose(data, c, atol=3 * 2 / 127)
+    assert receiver.undecodable_chunks == 2
+
+
+def test_stream_auto():
+    arr = np.arange(400, dtype='int16').reshape(100, 4)
+    
+    # same process: inproc
+    outstream = OutputStream()
+    outstream.configure(protocol='auto', transfermode='auto', dtype='int16', shape=(-1, 4), buffer_size=1000)
+    assert outstream.sender is None
+    outstream.send(arr)  # dropped; nothing is connected yet
+    instream = InputStream()
+    instream.connect(outstream)
+    assert instream.params['protocol'] == 'inproc'
+    assert instream.params['transfermode'] == 'inprocobject'
+    time.sleep(.1)
+    outstream.send(arr)
+    index, data = instream.recv()
+    assert index == 200
+    assert np.all(data == arr)
+    # a connection from another host cannot use this stream
+    with pytest.raises(ValueError):
+        outstream.negotiate('other-host', 1)
+    instream.close()
+    outstream.close()
+    
+    # other process on the same host: ipc + sharedmem
+    if not sys.platform.startswith('win'):
+        outstream = OutputStream()
+        outstream.configure(protocol='auto', transfermode='auto', dtype='int16', shape=(-1, 4), buffer_size=1000)
+        params = outstream.negotiate(log.get_host_name(), -1)
+        assert params['protocol'] == 'ipc'
+        assert params['transfermode'] == 'sharedmem'
+        outstream.close()
+    
+    # other host: tcp on all interfaces, compressed
+    outstream = OutputStream()
+    outstream.configure(protocol='auto', transfermode='auto', dtype='int16', shape=(-1, 4))
+    params = outstream.negotiate('other-host', -1)
+    assert params['protocol'] == 'tcp'
+    assert params['interface'] == '0.0.0.0'
+    assert params['transfermode'] == 'plaindata'
+    assert params['compression'].startswith('delta+shuffle+')
+    # same-host connections can still use it
+    outstream.negotiate(log.get_host_name(), -1)
+    instream = InputStream()
+    instream.connect(outstream)
+    time.sleep(.1)
+    outstream.send(arr)
+    index, data = instream.recv()
+    assert np.all(data == arr)
+    instream.close()
+    outstream.close()
+
+
+def test_stream_hwm_and_counters():
+    chunk = np.zeros((10, 2), dtype='float32')
+    n_chunks = 500
+    for lossless in (False, True):
+        outstream = OutputStream()
+        # inproc: no kernel socket buffers, so the HWM alone decides what is dropped
+        outstream.configure(protocol='inproc', transfermode='plaindata', dtype='float32', shape=(-1, 2),
+                            sndhwm=5, rcvhwm=5, lossless=lossless)
+        instream = InputStream()
+        instream.connect(outstream)
+        time.sleep(.1)
+        
+        if lossless:
+            # send() blocks when the queues are full
+            sender = threading.Thread(target=lambda: [outstream.send(chunk) for i in range(n_chunks)])
+            sender.start()
+        else:
+            for i in range(n_chunks):
+                outstream.send(chunk)
+            time.sleep(.1)
+        
+        received = 0
+        while instream.poll(timeout=200):
+            index, data = instream.recv()
+            received += data.shape[0]
+        if not lossless:
+            # chunks dropped at the end of the burst show up as a gap before the next one
+            outstream.send(chunk)
+            index, data = instream.recv()
+            received += data.shape[0]
+        if lossless:
+            sender.join()
+            assert received == n_chunks * 10
+            assert instream.gaps == 0
+        else:
+            assert instream.gaps > 0
+        assert instream.received_chunks == received // 10
+        assert instream.dropped_samples == index - received
+        assert instream.dropped_chunks == instream.dropped_samples // 10
+        
+        outstream.close()
+        instream.close()
+
+
+def test_stream_multicast():
+    # loopback multicast
+    for compression in ('', 'zlib'):
+        check_stream(protocol='multicast', interface='239.255.0.1', multicast_interface='127.0.0.1',
+                     compression=compression)
+    
+    outstream = OutputStream()
+    outstream.configure(protocol='multicast', interface='239.255.0.1', multicast_interface='127.0.0.1',
+                        transfermode='plaindata', dtype='int16', shape=(-1, 512))
+    instreams = [InputStream(), InputStream()]
+    for instream in instreams:
+        instream.connect(outstream)
+    
+    # chunks of 100kB are split into many datagrams
+    for i in range(3):
+        arr = np.random.randint(-1000, 1000, size=(100, 512)).astype('int16')
+        outstream.send(arr)
+        for instream in instreams:
+            assert instream.poll(timeout=1000)
+            index, data = instream.recv()
+            assert index == (i + 1) * 100
+            assert np.all(data == arr)
+    for instream in instreams:
+        assert instream.socket.dropped == 0
+    
+    # a sender restarted on the same group and port starts its sequence over
+    port = int(outstream.params['port'])
+    outstream.close()
+    receiver = instreams[0].socket
+    sender = MulticastSocket('send', '239.255.0.1', port, interface='127.0.0.1')
+    sender.send(b'restarted')
+    assert receiver.poll(timeout=1000)
+    assert receiver.recv() == b'restarted'
+    assert receiver.dropped == 0
+    sender.close()
+    for instream in instreams:
+        instream.close()
+
+
+def test_stream_channel_subset():
+    arr = np.arange(1000, dtype='float32').reshape(100, 10)
+    for transfermode, channel_groups in [('plaindata', None), ('sharedmem', None),
+                                         ('plaindata', 4), ('quantized', [[0, 1, 2], [3, 4, 5, 6, 7, 8, 9]])]:
+        outstream = OutputStream()
+        outstream.configure(protocol='tcp', transfermode=transfermode, dtype='float32', shape=(-1, 10),
+                            buffer_size=1000, channel_groups=channel_groups, scale=None)
+        instreams = {}
+        for channels in (None, [5], [1, 9, 4], [4, 5, 6, 7]):
+            instream = InputStream()
+            instream.connect(outstream, channels=channels)
+            instreams[str(channels)] = (channels, instream)
+        time.sleep(.2)
+        
+        outstream.send(arr)
+        for channels, instream in instreams.values():
+            index, data = instream.recv(return_data=True)
+            assert index == 100
+            expected = arr if channels is None else arr[:, channels]
+            assert instream.params['shape'][1] == expected.shape[1]
+            if transfermode == 'quantized':
+                assert np.allclose(data, expected, atol=.1)
+            else:
+                assert np.all(data == expected)
+            instream.close()
+        
+        if channel_groups is not None:
+            # only subscribed groups are sent
+            subscribed = outstream.sender.subscribed
+            assert len(subscribed) > 0
+        outstream.close()
+
 
 if __name__ == '__main__':
     test_stream_plaindata()
     test_stream_sharedmem()
     test_plaindata_ringbuffer()
     test_sharedmem_ringbuffer()
+    test_stream_spill_buffer()
+    test_stream_legacy_headers()
+    test_stream_recv_all()
+    test_stream_coalesce()
+    test_stream_quantized()
+    test_stream_quantized_coefs()
+    test_stream_auto()
+    test_stream_inprocobject()
+    test_stream_hwm_and_counters()
+    test_stream_multicast()
+    test_stream_channel_subset()
     
 
@@ -47,7 +47,31 @@ def test_nodegroup0():
     proc.stop()
 
 
+def test_nodegroup_batch():
+    proc, host = Host.spawn('host1')
+    ng = host.create_nodegroup('nodegroup')
+    
+    # set up all nodes in a single round-trip
+    with ng._client().batch():
+        nodes = [ng.create_node('_MyTestNode', name='mynode{}'.format(i)) for i in range(5)]
+        for node in nodes:
+            node.configure()
+            node.initialize()
+            node.start()
+    nodes = [node.result() for node in nodes]
+    assert all(node.running() for node in nodes)
+    
+    with ng._client().batch():
+        for node in nodes:
+            node.stop()
+            ng.remove_node(node)
+    
+    ng.close()
+    proc.stop()
+
+
 if __name__ == '__main__':
     test_nodegroup0()
+    test_nodegroup_batch()
 
 
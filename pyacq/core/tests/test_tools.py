@@ -3,7 +3,7 @@
 # Distributed under the (new) BSD License. See LICENSE for more info.
 
 from pyacq.core import OutputStream, InputStream
-from pyacq.core.tools import ThreadPollInput, StreamConverter, ChannelSplitter
+from pyacq.core.tools import ThreadPollInput, StreamDispatcher, StreamConverter, ChannelSplitter
 from pyqtgraph.Qt import QtCore, QtGui
 import pyqtgraph as pg
 
@@ -128,6 +128,73 @@ def test_streamconverter():
     app.exec_()
 
 
+def test_streamconverter_rescale_channels():
+    app = pg.mkQApp()
+    
+    outstream = OutputStream()
+    outstream.configure(protocol='inproc', transfermode='plaindata', streamtype='analogsignal',
+                        dtype='int16', shape=(-1, nb_channel), scale=0.5, offset=-1.)
+    
+    channels = [3, 1, 4]
+    conv = StreamConverter()
+    conv.configure(channels=channels)
+    conv.input.connect(outstream)
+    conv.output.configure(protocol='inproc', transfermode='plaindata', streamtype='analogsignal',
+                          dtype='float32', shape=(-1, len(channels)))
+    conv.initialize()
+    
+    instream = InputStream()
+    instream.connect(conv.output)
+    conv.start()
+    
+    data = np.random.randint(-1000, 1000, size=(chunksize, nb_channel)).astype('int16')
+    outstream.send(data)
+    assert instream.poll(timeout=2000)
+    pos, arr = instream.recv()
+    assert pos == chunksize
+    assert arr.dtype == 'float32'
+    assert np.allclose(arr, data[:, channels] * 0.5 - 1.)
+    
+    conv.stop()
+    instream.close()
+    conv.close()
+    outstream.close()
+
+
+def test_streamconverter_no_buffer_reuse():
+    # zmq sends converted chunks without copying them: a chunk must not be
+    # overwritten by the conversion of the next one before it is received
+    app = pg.mkQApp()
+
+    outstream = OutputStream()
+    outstream.configure(protocol='inproc', transfermode='plaindata', streamtype='analogsignal',
+                        dtype='int16', shape=(-1, 16))
+
+    conv = StreamConverter()
+    conv.configure()
+    conv.input.connect(outstream)
+    conv.output.configure(protocol='inproc', transfermode='plaindata', streamtype='analogsignal',
+                          dtype='float32', shape=(-1, 16))
+    conv.initialize()
+
+    instream = InputStream()
+    instream.connect(conv.output)
+    conv.start()
+
+    outstream.send(np.ones((4096, 16), dtype='int16'))
+    outstream.send(np.full((4096, 16), 2, dtype='int16'))
+    time.sleep(0.2)
+    for value in (1., 2.):
+        assert instream.poll(timeout=2000)
+        pos, arr = instream.recv()
+        assert np.all(arr == value)
+
+    conv.stop()
+    instream.close()
+    conv.close()
+    outstream.close()
+
+
 def test_stream_splitter():
     app = pg.mkQApp()
     
@@ -174,8 +241,61 @@ def test_stream_splitter():
     app.exec_()
     
     
+def test_StreamDispatcher():
+    app = pg.mkQApp()
+    
+    class Collector(ThreadPollInput):
+        def process_data(self, pos, data):
+            self.received.append((pos, data.shape[0]))
+    
+    for max_workers in (0, 2):
+        dispatcher = StreamDispatcher(timeout=50, max_workers=max_workers)
+        outstreams, instreams, received = [], [], []
+        for i in range(8):
+            outstream = OutputStream()
+            outstream.configure(**stream_spec)
+            instream = InputStream()
+            instream.connect(outstream)
+            outstreams.append(outstream)
+            instreams.append(instream)
+            received.append([])
+        
+        # half use callbacks, half use the ThreadPollInput adapter
+        pollers = []
+        for i, instream in enumerate(instreams):
+            if i % 2 == 0:
+                dispatcher.register(instream, lambda pos, data, l=received[i]: l.append((pos, data.shape[0])),
+                                    return_data=True)
+            else:
+                poller = Collector(input_stream=instream, return_data=True, dispatcher=dispatcher)
+                poller.received = received[i]
+                poller.start()
+                pollers.append(poller)
+        dispatcher.start()
+        time.sleep(.2)
+        
+        for j in range(20):
+            for outstream in outstreams:
+                outstream.send(np.zeros((chunksize, nb_channel), dtype='float32'))
+        time.sleep(.5)
+        
+        for poller in pollers:
+            poller.stop()
+            assert not poller.isRunning()
+        dispatcher.stop()
+        dispatcher.wait()
+        
+        for r in received:
+            assert r == [((j + 1) * chunksize, chunksize) for j in range(20)]
+        for outstream, instream in zip(outstreams, instreams):
+            outstream.close()
+            instream.close()
+
 
 if __name__ == '__main__':
     test_ThreadPollInput()
+    test_StreamDispatcher()
     test_streamconverter()
+    test_streamconverter_rescale_channels()
+    test_streamconverter_no_buffer_reuse()
     test_stream_splitter()
@@ -6,6 +6,9 @@ import time
 import weakref
 import logging
 import atexit
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import zmq
 from collections import OrderedDict
@@ -14,6 +17,7 @@ from pyqtgraph.util.mutex import Mutex
 
 from .node import Node, register_node_type
 from .stream import OutputStream, InputStream
+from .stream import ChunkConverter
 
 
 class ThreadPollInput(QtCore.QThread):
@@ -25,12 +29,25 @@ class ThreadPollInput(QtCore.QThread):
     introduces too much latency or consumes too much CPU).
     
     The `process_data()` method may be reimplemented to define other behaviors.
+    
+    If *batch* is True, all packets waiting in the stream are received at once
+    with :func:`InputStream.recv_all()`, so `process_data()` is called once
+    with the concatenated data rather than once per packet. This limits the
+    number of callbacks and signals when the thread falls behind a stream of
+    small chunks.
+    
+    If a :class:`StreamDispatcher` is given as *dispatcher*, no thread is
+    started: `start()` registers the stream with the dispatcher, which then
+    calls `process_data()` from its own thread, and `stop()` unregisters it.
+    This lets many pollers share a single thread.
     """
     new_data = QtCore.Signal(int,object)
-    def __init__(self, input_stream, timeout=200, return_data=None, parent=None):
+    def __init__(self, input_stream, timeout=200, return_data=None, batch=False, dispatcher=None, parent=None):
         QtCore.QThread.__init__(self, parent)
         self.input_stream = weakref.ref(input_stream)
         self.timeout = timeout
+        self.batch = batch
+        self.dispatcher = dispatcher
         self.return_data = return_data
         if self.return_data is None:
             self.return_data = self.input_stream()._own_buffer
@@ -55,7 +72,10 @@ class ThreadPollInput(QtCore.QThread):
             ev = self.input_stream().poll(timeout=self.timeout)
             if ev>0:
                 try:
-                    pos, data = self.input_stream().recv(return_data=self.return_data)
+                    if self.batch:
+                        pos, data = self.input_stream().recv_all(return_data=self.return_data)
+                    else:
+                        pos, data = self.input_stream().recv(return_data=self.return_data)
                 except zmq.error.ContextTerminated:
                     self.stop()
                     return
@@ -63,6 +83,28 @@ class ThreadPollInput(QtCore.QThread):
                     self._pos = pos
                 self.process_data(self._pos, data)
     
+    def start(self, *args):
+        """Start polling, either in this thread or with the dispatcher.
+        """
+        if self.dispatcher is None:
+            QtCore.QThread.start(self, *args)
+            return
+        with self.running_lock:
+            self.running = True
+        self.dispatcher.register(self.input_stream(), self._dispatched,
+                                 return_data=self.return_data, batch=self.batch)
+    
+    def _dispatched(self, pos, data):
+        with self.lock:
+            self._pos = pos
+        self.process_data(pos, data)
+    
+    def isRunning(self):
+        if self.dispatcher is None:
+            return QtCore.QThread.isRunning(self)
+        with self.running_lock:
+            return self.running
+    
     def process_data(self, pos, data):
         """This method is called from the polling thread when a new data chunk
         has been received. The default implementation emits the `new_data`
@@ -74,9 +116,14 @@ class ThreadPollInput(QtCore.QThread):
     
     def stop(self):
         """Request the polling thread to stop.
+        
+        With a dispatcher, the stream is unregistered and this returns once
+        any running `process_data()` call has finished.
         """
         with self.running_lock:
             self.running = False
+        if self.dispatcher is not None and self.input_stream() is not None:
+            self.dispatcher.unregister(self.input_stream())
     
     def pos(self):
         """Return the current stream position.
@@ -85,6 +132,182 @@ class ThreadPollInput(QtCore.QThread):
             return self._pos
 
 
+class _DispatcherEntry:
+    # An InputStream registered with a StreamDispatcher.
+    def __init__(self, input_stream, callback, return_data, batch):
+        self.input_stream = weakref.ref(input_stream)
+        self.socket = input_stream.socket
+        if not isinstance(self.socket, zmq.Socket):
+            # zmq.Poller reports other sockets by file descriptor
+            self.socket = self.socket.fileno()
+        self.callback = callback
+        self.return_data = return_data
+        self.batch = batch
+        self.active = True
+        self.lock = threading.RLock()  # held while the callback runs
+        self.queue = collections.deque()  # packets waiting for a worker
+        self.queue_lock = threading.Lock()
+        self.scheduled = False  # a worker is draining the queue
+
+
+class StreamDispatcher(QtCore.QThread):
+    """Thread that polls many InputStreams with a single zmq.Poller and calls a
+    callback for each received packet.
+    
+    This replaces one :class:`ThreadPollInput` per stream (for example one per
+    recorded stream) by a single thread, which reduces the number of threads
+    competing for the GIL and of timeout wake-ups. ThreadPollInput subclasses
+    can use a dispatcher without other changes (see the *dispatcher* argument
+    of ThreadPollInput).
+    
+    Callbacks of a given stream are always called one at a time and in order.
+    By default they are called from the dispatcher thread. If *max_workers* > 0,
+    they are run by a pool of that many worker threads instead, so that a slow
+    callback does not delay the other streams; at most *max_pending* packets
+    per stream are then received ahead of its callback (further data waits
+    in the socket).
+    
+    Streams may be registered or unregistered at any time; changes take effect
+    within *timeout* ms.
+    """
+    def __init__(self, timeout=200, max_workers=0, max_pending=16, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._entries = OrderedDict()
+        self._entries_lock = threading.Lock()
+        self._entries_changed = True
+        self.running = False
+        self.running_lock = Mutex()
+        atexit.register(self.stop)
+    
+    def register(self, input_stream, callback, return_data=None, batch=False):
+        """Call ``callback(pos, data)`` for each packet received by
+        *input_stream*.
+        
+        *return_data* and *batch* have the same meaning as for
+        :class:`ThreadPollInput`.
+        """
+        if return_data is None:
+            return_data = input_stream._own_buffer
+        entry = _DispatcherEntry(input_stream, callback, return_data, batch)
+        with self._entries_lock:
+            if id(input_stream) in self._entries:
+                raise ValueError("InputStream %s is already registered." % input_stream.name)
+            self._entries[id(input_stream)] = entry
+            self._entries_changed = True
+    
+    def unregister(self, input_stream):
+        """Stop dispatching packets of *input_stream*.
+        
+        Once this returns, the callback of this stream is not running and will
+        not be called again (unless this is called from the callback itself).
+        """
+        with self._entries_lock:
+            entry = self._entries.pop(id(input_stream), None)
+            self._entries_changed = True
+        if entry is None:
+            return
+        with entry.lock:
+            entry.active = False
+        with entry.queue_lock:
+            entry.queue.clear()
+    
+    def run(self):
+        with self.running_lock:
+            self.running = True
+        executor = ThreadPoolExecutor(self.max_workers) if self.max_workers > 0 else None
+        poller = None
+        try:
+            while True:
+                with self.running_lock:
+                    if not self.running:
+                        break
+                with self._entries_lock:
+                    entries = list(self._entries.values())
+                    if self._entries_changed:
+                        poller = zmq.Poller()
+                        for entry in entries:
+                            poller.register(entry.socket, zmq.POLLIN)
+                        self._entries_changed = False
+                
+                # packets held back by recv_all() are not visible to the poller
+                pending = any(e.input_stream() is not None and e.input_stream()._buffered()
+                              for e in entries)
+                timeout = 0 if pending else self.timeout
+                if len(entries) == 0:
+                    time.sleep(self.timeout / 1000.)
+                    continue
+                events = dict(poller.poll(timeout))
+                
+                backlog = False
+                for entry in entries:
+                    input_stream = entry.input_stream()
+                    if input_stream is None:
+                        logging.info("StreamDispatcher has lost InputStream")
+                        with self._entries_lock:
+                            self._entries = OrderedDict((k, e) for k, e in self._entries.items() if e is not entry)
+                            self._entries_changed = True
+                        continue
+                    if entry.socket not in events and not input_stream._buffered():
+                        continue
+                    if executor is not None and len(entry.queue) >= self.max_pending:
+                        backlog = True
+                        continue
+                    try:
+                        if entry.batch:
+                            pos, data = input_stream.recv_all(return_data=entry.return_data)
+                        else:
+                            pos, data = input_stream.recv(return_data=entry.return_data)
+                    except zmq.error.ContextTerminated:
+                        self.stop()
+                        return
+                    if executor is None:
+                        self._call(entry, pos, data)
+                    else:
+                        self._schedule(executor, entry, pos, data)
+                
+                if backlog:
+                    # wait for the workers rather than spin on ready sockets
+                    time.sleep(0.001)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+    
+    def _call(self, entry, pos, data):
+        with entry.lock:
+            if entry.active:
+                entry.callback(pos, data)
+    
+    def _schedule(self, executor, entry, pos, data):
+        with entry.queue_lock:
+            entry.queue.append((pos, data))
+            if entry.scheduled:
+                return
+            entry.scheduled = True
+        executor.submit(self._drain, entry)
+    
+    def _drain(self, entry):
+        # worker: run the queued callbacks of one stream, in order
+        while True:
+            with entry.queue_lock:
+                if len(entry.queue) == 0 or not entry.active:
+                    entry.scheduled = False
+                    return
+                pos, data = entry.queue.popleft()
+            try:
+                self._call(entry, pos, data)
+            except Exception:
+                logging.exception("Error in StreamDispatcher callback")
+    
+    def stop(self):
+        """Request the dispatcher thread to stop.
+        """
+        with self.running_lock:
+            self.running = False
+
+
 class ThreadPollOutput(ThreadPollInput):
     """    
     Thread that monitors an OutputStream in the background and emits a Qt signal
@@ -106,22 +329,25 @@ class ThreadPollOutput(ThreadPollInput):
 
 
 class ThreadStreamConverter(ThreadPollInput):
-    """Thread that polls for data on an input stream and converts the transfer
-    mode or time axis of the data before relaying it through its output.
+    """Thread that polls for data on an input stream and converts the dtype,
+    scale or channels of the data before relaying it through its output.
+    
+    The conversion itself is done by a :class:`ChunkConverter`; the transfer
+    mode and buffer layout are converted by the output stream.
     """
-    def __init__(self, input_stream, output_stream, conversions,timeout=200, parent=None):
+    def __init__(self, input_stream, output_stream, conversions, channels=None, timeout=200, parent=None):
         ThreadPollInput.__init__(self, input_stream, timeout=timeout, return_data=True, parent=parent)
         self.output_stream = weakref.ref(output_stream)
         self.conversions = conversions
+        # Only sharedmem copies chunks before send() returns; the other
+        # transfer modes may still reference the chunk (zmq zero-copy sends,
+        # inprocobject queue) when the next one is converted.
+        reuse_buffer = output_stream.params['transfermode'] == 'sharedmem'
+        self.converter = ChunkConverter(input_stream.params, output_stream.params,
+                                        channels=channels, reuse_buffer=reuse_buffer)
     
     def process_data(self, pos, data):
-        #~ if 'transfermode' in self.conversions and self.conversions['transfermode'][0]=='sharedmem':
-            #~ data = self.input_stream().get_array_slice(self, pos, None)
-        #~ if 'timeaxis' in self.conversions:
-            #~ data = data.swapaxes(*self.conversions['timeaxis'])
-        if data.dtype!=self.output_stream().params['dtype']:
-            data = data.astype(self.output_stream().params['dtype'])
-        self.output_stream().send(data, index=pos)
+        self.output_stream().send(self.converter.convert(data), index=pos)
 
 
 class StreamConverter(Node):
@@ -132,9 +358,15 @@ class StreamConverter(Node):
     
     * convert transfer mode 'plaindata' to 'sharedarray'. (to get a local long buffer)
     * convert dtype 'int32' to 'float64'
+    * rescale data between the *scale* and *offset* of the input and output
+      streams (for example int16 ADC counts to float32 volts)
+    * keep a subset of the channels (see *channels* in :func:`configure()`)
     * change timeaxis 0 to 1 (in fact a transpose)
     * ...
     
+    All conversions of a chunk are compiled into a few vectorized operations
+    that write into preallocated buffers.
+    
     Usage::
     
         conv = StreamConverter()
@@ -152,24 +384,29 @@ class StreamConverter(Node):
     def __init__(self, **kargs):
         Node.__init__(self, **kargs)
     
-    def _configure(self, **kargs):
-        pass
+    def _configure(self, channels=None):
+        """
+        Params
+        -----------
+        channels: list or None
+            The input channels to relay, in output order. The output shape
+            must then be ``(n_samples, len(channels))``.
+        """
+        self.channels = channels
     
     def _initialize(self):
         self.conversions = {}
         # check convertion
         for k in self.input.params:
-            if k in ('port', 'protocol', 'interface', 'dtype'):
+            if k in ('port', 'protocol', 'interface'):
                 continue  # the OutputStream/InputStream already do it
             
             old, new = self.input.params.get(k, None), self.output.params.get(k, None)
             if old != new and old is not None:
                 self.conversions[k] = (old, new)
-                
-        # DO some check ???
-        # if 'shape' in self.conversions:
-        #    assert 'timeaxis' in self.conversions        
-        self.thread = ThreadStreamConverter(self.input, self.output, self.conversions)
+        
+        self.thread = ThreadStreamConverter(self.input, self.output, self.conversions,
+                                            channels=self.channels)
     
     def _start(self):
         self.thread.start()
@@ -7,7 +7,7 @@ import pyqtgraph as pg
 import numpy as np
 from pyqtgraph.util.mutex import Mutex
 
-from ..core import (Node, register_node_type, ThreadPollInput)
+from ..core import (Node, register_node_type, ThreadPollInput, StreamDispatcher)
 
 
 
@@ -121,10 +121,12 @@ class TriggerAccumulator(Node,  QtCore.QObject):
         buf_size = int(self.inputs['signals'].params['sample_rate'] * self.max_xsize)
         self.inputs['signals'].set_buffer(size=buf_size, axisorder=[1,0], double=True)
         
-        self.trig_poller  = ThreadPollInput(self.inputs['events'], return_data=True)
+        # both inputs are polled from one thread
+        self.dispatcher = StreamDispatcher()
+        self.trig_poller  = ThreadPollInput(self.inputs['events'], return_data=True, dispatcher=self.dispatcher)
         self.trig_poller.new_data.connect(self.on_new_trig)
         
-        self.limit_poller = ThreadPollInputUntilPosLimit(self.inputs['signals'])
+        self.limit_poller = ThreadPollInputUntilPosLimit(self.inputs['signals'], dispatcher=self.dispatcher)
         self.limit_poller.limit_reached.connect(self.on_limit_reached)
         
         self.wait_thread_list = []
@@ -133,12 +135,15 @@ class TriggerAccumulator(Node,  QtCore.QObject):
     def _start(self):
         self.trig_poller.start()
         self.limit_poller.start()
+        self.dispatcher.start()
 
     def _stop(self):
         self.trig_poller.stop()
         self.trig_poller.wait()
         self.limit_poller.stop()
         self.limit_poller.wait()
+        self.dispatcher.stop()
+        self.dispatcher.wait()
         
         for thread in self.wait_thread_list:
             thread.stop()
@@ -161,15 +166,15 @@ class TriggerAccumulator(Node,  QtCore.QObject):
                 self.limit_poller.append_limit(trig_index[ self.events_dtype_field]+self.limit2)
     
     def on_limit_reached(self, limit_index):
-        arr = self.inputs['signals'].get_data(limit_index-self.size, limit_index).transpose()
-        if arr is not None:
-            self.stack[self.stack_pos,:,:] = arr
-            
-            self.stack_pos +=1
-            self.stack_pos = self.stack_pos%self.params['stack_size']
-            self.total_trig += 1
-            
-            self.new_chunk.emit(self.total_trig)
+        # gather the sweep directly into the stack
+        self.inputs['signals'].get_data(limit_index-self.size, limit_index,
+                                        out=self.stack[self.stack_pos,:,:].transpose())
+        
+        self.stack_pos +=1
+        self.stack_pos = self.stack_pos%self.params['stack_size']
+        self.total_trig += 1
+        
+        self.new_chunk.emit(self.total_trig)
 
     def recreate_stack(self):
         self.limit1 = l1 = int(self.params['left_sweep']*self.sample_rate)
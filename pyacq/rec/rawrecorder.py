@@ -8,7 +8,7 @@ import logging
 import os
 import json
 
-from ..core import Node, register_node_type, ThreadPollInput, InputStream
+from ..core import Node, register_node_type, ThreadPollInput, StreamDispatcher, InputStream
 from pyqtgraph.Qt import QtCore, QtGui
 from pyqtgraph.util.mutex import Mutex
 
@@ -19,8 +19,9 @@ class RawRecorder(Node):
     """
     Simple recorder Node of multiple streams in raw data format.
     
-    Implementation is simple, this launch one thread by stream.
-    Each one pull data and write it directly into a file in binary format.
+    Implementation is simple: all streams are polled by a single
+    StreamDispatcher thread, and each chunk is written directly into the
+    file of its stream in binary format.
     
     Usage:
     list_of_stream_to_record = [...]
@@ -56,6 +57,7 @@ class RawRecorder(Node):
         self.threads = []
         
         self.mutex = Mutex()
+        self.dispatcher = StreamDispatcher()
         
         self._stream_properties = collections.OrderedDict()
         
@@ -64,7 +66,7 @@ class RawRecorder(Node):
             fid = open(filename, mode='wb')
             self.files.append(fid)
             
-            thread = ThreadRec(name, input, fid)
+            thread = ThreadRec(name, input, fid, dispatcher=self.dispatcher)
             self.threads.append(thread)
             thread.recv_start_index.connect(self.on_start_index)
             
@@ -82,11 +84,14 @@ class RawRecorder(Node):
     def _start(self):
         for thread in self.threads:
             thread.start()
+        self.dispatcher.start()
 
     def _stop(self):
         for thread in self.threads:
             thread.stop()
             thread.wait()
+        self.dispatcher.stop()
+        self.dispatcher.wait()
         
         #test in any pending data in streams
         for i, (name, input) in enumerate(self.inputs.items()):
@@ -126,8 +131,9 @@ def _flush_dict(filename, d):
 
 class ThreadRec(ThreadPollInput):
     recv_start_index = QtCore.Signal(str, int)
-    def __init__(self, name, input_stream,fid, timeout = 200, parent = None):
-        ThreadPollInput.__init__(self, input_stream, timeout=timeout, return_data=True, parent=parent)
+    def __init__(self, name, input_stream,fid, timeout = 200, dispatcher=None, parent = None):
+        ThreadPollInput.__init__(self, input_stream, timeout=timeout, return_data=True,
+                                 dispatcher=dispatcher, parent=parent)
         self.name = name
         self.fid = fid
         self._start_index = None
@@ -10,6 +10,7 @@ import weakref
 
 from ..core import (WidgetNode, register_node_type, InputStream,
         ThreadPollInput, StreamConverter)
+from ..core.stream import RingBufferOverrun
 
 
 class MyViewBox(pg.ViewBox):
@@ -54,6 +55,9 @@ class BaseOscilloscope(WidgetNode):
     
     #In the code  willingly : self.input is self.inputs['signal'] because some subclass can have several inputs
     
+    # whether the input buffer maintains a decimation pyramid
+    _buffer_pyramid = False
+    
     def __init__(self, **kargs):
         WidgetNode.__init__(self, **kargs)
         
@@ -87,7 +91,8 @@ class BaseOscilloscope(WidgetNode):
         self.nb_channel = self.inputs['signals'].params['shape'][1]
         self.sample_rate = self.inputs['signals'].params['sample_rate']
         buf_size = int(self.sample_rate * self.max_xsize)
-        self.inputs['signals'].set_buffer(size=buf_size, axisorder=[1,0], double=True)
+        self.inputs['signals'].set_buffer(size=buf_size, axisorder=[1,0], double=True,
+                                          pyramid=self._buffer_pyramid)
         #TODO : check that this not lead 
         
 
@@ -154,6 +159,8 @@ class BaseOscilloscope(WidgetNode):
         self.t_vect = np.arange(0,self.small_size, dtype=float)/(self.sample_rate/decimate)
         self.t_vect -= self.t_vect[-1]
         self.curves_data = [np.zeros((self.small_size), dtype=float) for i in range(self.nb_channel)]
+        # reused by _refresh to gather the visible window
+        self._full_arr = np.empty((self.nb_channel, self.full_size), dtype=float)
 
     def estimate_decimate(self, nb_point=4000):
         xsize = self.params['xsize']
@@ -367,6 +374,12 @@ class QOscilloscope(BaseOscilloscope):
     
     _ControllerClass = OscilloscopeController
     
+    # use the decimation pyramid if the input has one (for example, the shared
+    # buffer of a sharedmem stream configured with pyramid=True); otherwise
+    # the sender's buffer is still reused and min_max decimation is computed
+    # from the raw data.
+    _buffer_pyramid = 'optional'
+    
     def __init__(self, **kargs):
         BaseOscilloscope.__init__(self, **kargs)
         
@@ -396,6 +409,26 @@ class QOscilloscope(BaseOscilloscope):
         
         self.reset_curves_data()
     
+    def _min_max_from_pyramid(self, head, decimate):
+        """Return min_max decimated data computed from the decimation pyramid
+        of the input buffer, or None if the pyramid cannot be used.
+        """
+        buf = self.inputs['signals'].buffer
+        if buf.pyramid is None:
+            return None
+        block = decimate*2
+        # pyramid bins must evenly divide the min_max blocks
+        max_factor = block & -block
+        if max_factor < buf.pyramid.factors[0]:
+            return None
+        factor, mins, maxs, means = buf.get_decimated(head-self.full_size, head,
+                                        self.full_size//max_factor, validate=True)
+        n = block//factor
+        small_arr = np.empty((self.nb_channel, self.small_size), dtype=float)
+        small_arr[:, ::2] = maxs.T.reshape(self.nb_channel, -1, n).max(axis=2)
+        small_arr[:, 1::2] = mins.T.reshape(self.nb_channel, -1, n).min(axis=2)
+        return small_arr
+    
     def _refresh(self):
         mode = self.params['mode']
         decimate = int(self.params['decimate'])
@@ -411,25 +444,34 @@ class QOscilloscope(BaseOscilloscope):
             else:
                 head = head - head%decimate
         
-        full_arr = self.inputs['signals'].get_data(head-self.full_size, head, copy=False, join=True).T
-        
-        full_arr = full_arr.astype(float)
-        
-        if decimate>1:
-            if self.params['decimation_method'] == 'pure_decimate':
-                small_arr = full_arr[:, ::decimate].copy()
-            elif self.params['decimation_method'] == 'min_max':
-                arr = full_arr.reshape(full_arr.shape[0], -1, decimate*2)
-                small_arr = np.empty((full_arr.shape[0], self.small_size), dtype=full_arr.dtype)
-                small_arr[:, ::2] = arr.max(axis=2)
-                small_arr[:, 1::2] = arr.min(axis=2)
-            elif self.params['decimation_method'] == 'mean':
-                arr = full_arr.reshape(full_arr.shape[0], -1, decimate)
-                small_arr = arr.mean(axis=2)
+        try:
+            small_arr = None
+            if decimate>1 and self.params['decimation_method'] == 'min_max':
+                small_arr = self._min_max_from_pyramid(head, decimate)
+            if small_arr is None:
+                # validated read: the poller thread may be writing into the buffer
+                full_arr = self._full_arr
+                self.inputs['signals'].get_data(head-self.full_size, head, validate=True, out=full_arr.T)
+        except RingBufferOverrun:
+            # data was overwritten during the read; wait for the next refresh
+            return
+        
+        if small_arr is None:
+            if decimate>1:
+                if self.params['decimation_method'] == 'pure_decimate':
+                    small_arr = full_arr[:, ::decimate].copy()
+                elif self.params['decimation_method'] == 'min_max':
+                    arr = full_arr.reshape(full_arr.shape[0], -1, decimate*2)
+                    small_arr = np.empty((full_arr.shape[0], self.small_size), dtype=full_arr.dtype)
+                    small_arr[:, ::2] = arr.max(axis=2)
+                    small_arr[:, 1::2] = arr.min(axis=2)
+                elif self.params['decimation_method'] == 'mean':
+                    arr = full_arr.reshape(full_arr.shape[0], -1, decimate)
+                    small_arr = arr.mean(axis=2)
+                else:
+                    raise(NotImplementedError)
             else:
-                raise(NotImplementedError)
-        else:
-            small_arr = full_arr.copy()
+                small_arr = full_arr.copy()
         
         # gain/offset
         small_arr[visibles, :] *= gains[visibles, None]
@@ -15,6 +15,7 @@ from collections import OrderedDict
 
 from ..core import (WidgetNode, Node, register_node_type, InputStream, OutputStream,
         ThreadPollInput, StreamConverter)
+from ..core.stream import RingBufferOverrun
 
 from .qoscilloscope import MyViewBox
 
@@ -538,6 +539,7 @@ class ComputeThread(QtCore.QThread):
         self.local = local
         
         self.worker_params = None
+        self._full_arr = None
 
     def run(self):
         if self.worker_params is None: 
@@ -558,7 +560,14 @@ class ComputeThread(QtCore.QThread):
         
         #full_arr = self.in_stream[head-sig_chunk_size:head, self.channel] #TODO keep this when working
         #~ full_arr = self.in_stream[-sig_chunk_size:, self.channel]
-        full_arr = self.in_stream.get_data(head-sig_chunk_size, head, copy=False, join=True)[:, self.channel]
+        try:
+            # validated read: the buffer may be written by another process meanwhile
+            if self._full_arr is None or self._full_arr.shape[0] != sig_chunk_size:
+                self._full_arr = np.empty(sig_chunk_size, dtype=self.in_stream.buffer.dtype)
+            full_arr = self.in_stream.get_data(head-sig_chunk_size, head, validate=True,
+                                               channels=self.channel, out=self._full_arr)
+        except RingBufferOverrun:
+            return
         #~ print(full_arr.flags)
         
         
@@ -76,7 +76,7 @@ class QTriggeredOscilloscope(BaseOscilloscope):
         
         self.trigger.configure()
         self.trigger.input.connect(self.input.params)
-        self.trigger.output.configure(protocol='inproc', transfermode='plaindata')
+        self.trigger.output.configure(protocol='inproc', transfermode='inprocobject')
         self.trigger.initialize()
         
         #create a triggeraccumulator